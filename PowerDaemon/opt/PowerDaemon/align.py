@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+align.py - Align counter sources on one clock and merge them onto one tick grid
+
+Every source (a perf stat output, RAPL, cpu.stat, ...) reports counts over
+its own intervals: record i covers (timestamp[i-1], timestamp[i]] on the
+source's clock, the first one from the source's start. Pairing outputs by
+position breaks as soon as their intervals drift apart or one skips a
+line, and then divides one window's energy by another window's
+instructions.
+
+An Aligner maps each source's timestamps onto a common monotonic clock
+(source time + offset, the source's start on that clock) and splits every
+interval's counts over the windows [origin + k * interval, origin + (k + 1)
+* interval) it overlaps, in proportion to the overlap. A window is emitted
+once every source has reported past its end, as one record holding every
+source's values for exactly that window.
+
+Part of a window no source interval covered is a gap. Values are scaled
+up to the whole window, the way perf scales multiplexed counters, and the
+record's "coverage" ({scope: {event: fraction}}) gets the fraction that
+was observed. A source that covered less than MIN_COVERAGE of a window
+(e.g. it stopped early) has its events left out and only marked in
+"coverage". Work per record is proportional to the
+windows it overlaps, whatever the number of sources.
+
+    aligner = Aligner(1.0)
+    aligner.add_source("system", offset=0.002)
+    aligner.add_source("cgroup", offset=0.004)
+    for record in aligner.push("system", sysrec): ...
+    for record in aligner.flush(): ...
+"""
+
+import math
+
+from samples import RESERVED_KEYS
+
+# Float noise in interval arithmetic
+EPSILON = 1e-9
+# Share of a window a source must cover to be scaled up to all of it
+MIN_COVERAGE = 0.5
+
+
+class _Window:
+    __slots__ = ("values", "missed", "covered")
+
+    def __init__(self):
+        # {scope: {event: counts}}
+        self.values = {}
+        # {scope: {event: seconds covered but not counted}}, multiplexed events only
+        self.missed = {}
+        # {source: seconds covered}
+        self.covered = {}
+
+
+class _Source:
+    __slots__ = ("offset", "end", "columns", "finished")
+
+    def __init__(self, offset):
+        self.offset = offset
+        # End of the last interval, on the common clock
+        self.end = offset
+        # {scope: {event: None}} seen so far, in order, to mark gaps
+        self.columns = {}
+        self.finished = False
+
+
+class Aligner:
+    """
+    Merges the records of any number of sources into one record per tick.
+
+    interval: tick length (seconds); origin: start of the grid on the
+    common clock. max_lag: emit windows that far (seconds) behind the
+    most advanced source even if a source has not reported yet, marking it
+    missing; None waits for every source until it is finished.
+    """
+    def __init__(self, interval, origin=0.0, max_lag=None):
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        self.interval = interval
+        self.origin = origin
+        self.max_lag = max_lag
+        self.sources = {}
+        # Counts of records that arrived for windows already emitted
+        self.late = 0
+        self._windows = {}
+        # Next window to emit
+        self._next = None
+
+    def add_source(self, name, offset=0.0):
+        """Register a source whose time 0 is `offset` on the common clock."""
+        self.sources[name] = _Source(offset)
+
+    def _index(self, t):
+        return math.floor((t - self.origin) / self.interval + EPSILON)
+
+    def push(self, name, record):
+        """
+        Add one record of a source. Returns the aligned records of every
+        window completed by it, oldest first.
+        """
+        source = self.sources[name]
+        start = source.end
+        end = record["timestamp"] + source.offset
+        if end <= start:
+            # Out of order or repeated: nothing left to split
+            self.late += 1
+            return []
+        source.end = end
+        length = end - start
+        coverage = record.get("coverage") or {}
+        interval = self.interval
+        first = self._index(start)
+        if self._next is None:
+            # The grid starts with the earliest source
+            self._next = self._index(min(s.offset for s in self.sources.values()))
+        if first < self._next:
+            self.late += 1
+        windows = self._windows
+        scopes = [(scope, values, coverage.get(scope, {})) for scope, values in record.items()
+                  if isinstance(values, dict) and (scope not in RESERVED_KEYS or scope == "system")]
+        for scope, values, _ in scopes:
+            source.columns.setdefault(scope, {}).update(dict.fromkeys(values))
+
+        k = max(first, self._next)
+        while True:
+            w_start = self.origin + k * interval
+            if w_start >= end:
+                break
+            overlap = min(end, w_start + interval) - max(start, w_start)
+            if overlap > 0:
+                window = windows.get(k)
+                if window is None:
+                    window = windows[k] = _Window()
+                window.covered[name] = window.covered.get(name, 0.0) + overlap
+                share = overlap / length
+                for scope, values, scope_coverage in scopes:
+                    acc = window.values.get(scope)
+                    if acc is None:
+                        window.values[scope] = {event: value * share for event, value in values.items()}
+                    else:
+                        for event, value in values.items():
+                            acc[event] = acc.get(event, 0.0) + value * share
+                    if scope_coverage:
+                        missed = window.missed.setdefault(scope, {})
+                        for event, fraction in scope_coverage.items():
+                            missed[event] = missed.get(event, 0.0) + overlap * (1.0 - fraction)
+            k += 1
+        return self._emit(self._limit())
+
+    def finish(self, name):
+        """A source ended: it no longer holds back windows. Returns completed records."""
+        self.sources[name].finished = True
+        return self._emit(self._limit())
+
+    def flush(self):
+        """
+        Emit every window up to the end of the most advanced source, marking
+        what the others did not cover. A last window no source got to the
+        end of is dropped.
+        """
+        ends = [s.end for s in self.sources.values()]
+        if not ends:
+            return []
+        return self._emit(max(ends))
+
+    def _limit(self):
+        """Common-clock time up to which windows are complete."""
+        active = [s.end for s in self.sources.values() if not s.finished]
+        ends = [s.end for s in self.sources.values()]
+        if not ends:
+            return None
+        limit = min(active) if active else max(ends)
+        if self.max_lag is not None:
+            limit = max(limit, max(ends) - self.max_lag)
+        return limit
+
+    def _emit(self, limit):
+        if limit is None or self._next is None:
+            return []
+        done = []
+        interval = self.interval
+        last = self._index(limit) - 1
+        while self._next <= last:
+            k = self._next
+            window = self._windows.pop(k, None) or _Window()
+            done.append(self._record(window, self.origin + (k + 1) * interval))
+            self._next = k + 1
+        return done
+
+    def _record(self, window, timestamp):
+        interval = self.interval
+        record = {"timestamp": timestamp}
+        coverage = {}
+        for name, source in self.sources.items():
+            covered = window.covered.get(name, 0.0)
+            if covered < interval * MIN_COVERAGE:
+                share = covered / interval
+                for scope, events in source.columns.items():
+                    marks = coverage.setdefault(scope, {})
+                    for event in events:
+                        marks[event] = share
+                continue
+            scale = interval / covered if covered < interval * (1 - EPSILON) else 1.0
+            for scope, events in source.columns.items():
+                acc = window.values.get(scope)
+                if acc is None:
+                    continue
+                values = record.setdefault(scope, {})
+                missed = window.missed.get(scope, {})
+                for event, value in acc.items():
+                    if event not in events:
+                        continue
+                    values[event] = value * scale
+                    share = (covered - missed.get(event, 0.0)) / interval
+                    if share < 1 - EPSILON:
+                        coverage.setdefault(scope, {})[event] = share
+        record["coverage"] = coverage
+        return record
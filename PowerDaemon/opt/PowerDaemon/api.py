@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+api.py - Local query and subscription API over a Unix domain socket
+
+Requests and responses are JSON, one object per line:
+
+    {"cmd": "latest"}                      newest sample with per-cgroup power
+    {"cmd": "range", "start": t0, "end": t1}  samples from the in-memory history
+    {"cmd": "subscribe"}                   every new sample as it is taken
+    {"cmd": "rollup", "start": t0, "end": t1, "resolution": s}
+                                           buckets from the on-disk rollups
+    {"cmd": "stats"}                       the daemon's own CPU, wakeups and
+                                           stage latency histograms
+
+The sensor thread calls publish() once per tick. The sample is serialized
+there once; "latest" replies and every subscriber get the same bytes, so
+the per-tick cost does not grow with the number of clients beyond one
+socket write each on the server's event loop. Subscribers that stop
+reading are dropped once MAX_BUFFER bytes are queued for them.
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+from power import cgroup_power
+
+SOCKET_PATH = "/run/powerdaemon/api.sock"
+
+# Bytes queued for one subscriber before it is considered stuck
+MAX_BUFFER = 1 << 20
+# Longest request line accepted
+MAX_REQUEST = 64 * 1024
+# Pending connections; a full Unix socket backlog fails connect() with EAGAIN
+BACKLOG = 1024
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+class ApiServer:
+    """
+    Serves the API from its own thread and event loop.
+
+    history(start, end) returns the records to answer range queries with;
+    it is run in a worker thread, as it may wait for the sensor lock.
+    rollups(start, end, resolution) returns (tier name, records) for rollup
+    queries (rollups.RollupStore.query), also from a worker thread.
+    stats() returns the daemon's self-accounting (sensor.PerfSensor.stats).
+    """
+    def __init__(self, path=SOCKET_PATH, history=None, rollups=None, stats=None):
+        self.path = path
+        self.history = history or (lambda start, end: [])
+        self.rollups = rollups
+        self.stats = stats or (lambda: {})
+        self.subscribers = set()
+        self.latest = None
+        self.published = 0
+        self.dropped = 0
+        self._prev_timestamp = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            # Left over from a previous run
+            os.unlink(self.path)
+        self._thread = threading.Thread(target=self._run, name="api", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        print(f"[*] API listening on {self.path}")
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_REQUEST,
+                                      backlog=BACKLOG))
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def publish(self, record):
+        """
+        Called by the sensor after every tick (from its thread): serialize
+        the sample once and hand it to the event loop for fan-out.
+        """
+        timestamp = record["timestamp"]
+        interval = timestamp - self._prev_timestamp if self._prev_timestamp else None
+        self._prev_timestamp = timestamp
+        payload = _encode({"type": "sample", "timestamp": timestamp, "interval": interval,
+                           "power": cgroup_power(record, interval), "record": record}).encode() + b"\n"
+        self.latest = payload
+        self.published += 1
+        if self._loop is not None and self.subscribers:
+            self._loop.call_soon_threadsafe(self._fanout, payload)
+
+    def _fanout(self, payload):
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self.subscribers.discard(writer)
+            elif writer.transport.get_write_buffer_size() > MAX_BUFFER:
+                # Not reading: drop it rather than buffer without bound
+                self.subscribers.discard(writer)
+                self.dropped += 1
+                writer.close()
+            else:
+                writer.write(payload)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Request line over MAX_REQUEST
+                    writer.write(_error("request too long"))
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    cmd = request["cmd"]
+                except (ValueError, KeyError, TypeError):
+                    writer.write(_error("expected {\"cmd\": ...}"))
+                    continue
+                if cmd == "latest":
+                    writer.write(self.latest or _error("no sample yet"))
+                elif cmd == "range":
+                    records = await self._loop.run_in_executor(
+                        None, self.history, request.get("start"), request.get("end"))
+                    writer.write(_encode({"type": "range", "records": records}).encode() + b"\n")
+                elif cmd == "rollup":
+                    if self.rollups is None:
+                        writer.write(_error("rollups are not enabled"))
+                    else:
+                        tier, records = await self._loop.run_in_executor(
+                            None, self.rollups, request.get("start"), request.get("end"),
+                            request.get("resolution"))
+                        writer.write(_encode({"type": "rollup", "tier": tier,
+                                              "records": records}).encode() + b"\n")
+                elif cmd == "stats":
+                    stats = {**self.stats(), "api": {"subscribers": len(self.subscribers),
+                                                     "published": self.published,
+                                                     "dropped": self.dropped}}
+                    writer.write(_encode({"type": "stats", **stats}).encode() + b"\n")
+                elif cmd == "subscribe":
+                    self.subscribers.add(writer)
+                elif cmd == "unsubscribe":
+                    self.subscribers.discard(writer)
+                else:
+                    writer.write(_error(f"unknown cmd '{cmd}'"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+
+def _error(message):
+    return _encode({"type": "error", "error": message}).encode() + b"\n"
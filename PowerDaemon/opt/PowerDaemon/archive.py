@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+archive.py - Compressed columnar archive of a finished measurement run
+
+A measurement file (JSON Lines, or the legacy indented JSON array) has to
+be parsed in full to answer "energy between t1 and t2". An archive keeps
+the same records in blocks of up to BLOCK_ROWS rows, and every block holds
+one column per (scope, event), each compressed on its own with a stdlib
+codec (zlib, lzma or bz2):
+
+    timestamps      IEEE 754 bit patterns, delta + zigzag varint; exact,
+                    and a few bytes per row on a regular grid
+    whole numbers   (counter deltas) delta + zigzag varint, as int or float
+    other numbers   float64, little endian
+    anything else   (coverage, overhead, processes, ...) one JSON object
+                    per row
+
+A column missing from some rows of a block starts with a presence bitmap.
+A footer indexes every block's offset and first and last timestamp, so a
+range query reads and decompresses only the blocks, and within them only
+the columns, it needs. Records are expected in time order, as every
+writer of measurement files produces them.
+
+Layout (little endian):
+
+    "PWRDARC1" u32 version, codec name (8 bytes, NUL padded)
+    block*      u32 header size, header (compressed JSON: rows, timestamp,
+                column and extra chunk [offset, size] relative to the
+                block's data), column chunks
+    index       compressed JSON {"blocks": [[offset, size, rows,
+                first timestamp, last timestamp], ...]}
+    trailer     u64 index offset, u32 index size, "PWRDARC1"
+
+    python3 archive.py pack measurement.jsonl run.pda [--codec lzma]
+    python3 archive.py unpack run.pda measurement.jsonl
+    python3 archive.py energy run.pda --start t1 --end t2
+"""
+
+import argparse
+import bisect
+import bz2
+import itertools
+import json
+import lzma
+import struct
+import zlib
+
+from power import cgroup_power, PKG, SHARE_EVENTS
+
+MAGIC = b"PWRDARC1"
+ARCHIVE_VERSION = 1
+BLOCK_ROWS = 1024
+
+FILE_HEADER = struct.Struct("<8sI8s")
+BLOCK_HEADER = struct.Struct("<I")
+TRAILER = struct.Struct("<QI8s")
+
+# name: (compress(data, level), decompress, default level)
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress, 9),
+}
+
+# Column kinds
+INTS = "i"
+WHOLE_FLOATS = "w"
+FLOATS = "d"
+JSON = "j"
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def encode_deltas(numbers):
+    """Varints of the zigzagged differences between successive integers."""
+    out = bytearray()
+    append = out.append
+    prev = 0
+    for n in numbers:
+        z = n - prev
+        z = z << 1 if z >= 0 else ((-z) << 1) - 1
+        prev = n
+        while z > 0x7f:
+            append((z & 0x7f) | 0x80)
+            z >>= 7
+        append(z)
+    return bytes(out)
+
+
+def decode_deltas(data):
+    deltas = []
+    append = deltas.append
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            append(-((n + 1) >> 1) if n & 1 else n >> 1)
+            n = shift = 0
+    return list(itertools.accumulate(deltas))
+
+
+def _float_bits(values):
+    return struct.unpack(f"<{len(values)}q", struct.pack(f"<{len(values)}d", *values))
+
+
+def _bits_float(bits):
+    return list(struct.unpack(f"<{len(bits)}d", struct.pack(f"<{len(bits)}q", *bits)))
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def _columnar(value):
+    """A top-level value stored as columns: a number, or a non-empty dict of numbers."""
+    if isinstance(value, dict):
+        return bool(value) and all(type(v) in (int, float) for v in value.values())
+    return _is_number(value)
+
+
+def _encode_column(values):
+    """(kind, data) for one column's present values."""
+    types = {type(v) for v in values}
+    if types == {int}:
+        return INTS, encode_deltas(values)
+    if types == {float} and all(v.is_integer() and abs(v) < 2 ** 53 for v in values):
+        return WHOLE_FLOATS, encode_deltas([int(v) for v in values])
+    if types == {float}:
+        return FLOATS, struct.pack(f"<{len(values)}d", *values)
+    # Ints and floats mixed: keep them apart exactly
+    return JSON, _encode(values).encode()
+
+
+def _decode_column(kind, data):
+    if kind == INTS:
+        return decode_deltas(data)
+    if kind == WHOLE_FLOATS:
+        return [float(v) for v in decode_deltas(data)]
+    if kind == FLOATS:
+        return list(struct.unpack(f"<{len(data) // 8}d", data))
+    return json.loads(data)
+
+
+def _bitmap(present):
+    bits = bytearray((len(present) + 7) // 8)
+    for i, there in enumerate(present):
+        if there:
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
+def _unbitmap(bits, rows):
+    return [bool(bits[i >> 3] >> (i & 7) & 1) for i in range(rows)]
+
+
+class ArchiveWriter:
+    """
+    Writes records to a new archive, a block at a time; close() writes the
+    index. An archive without its index (writer never closed) cannot be read.
+    """
+    def __init__(self, path, block_rows=BLOCK_ROWS, codec="zlib", level=None):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec!r}, one of {', '.join(CODECS)}")
+        self.path = path
+        self.block_rows = block_rows
+        self.codec = codec
+        compress, _, default = CODECS[codec]
+        self.level = default if level is None else level
+        self._compress = compress
+        self.rows = 0
+        self._blocks = []
+        self._pending = []
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(MAGIC, ARCHIVE_VERSION, codec.encode()))
+
+    def write(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= self.block_rows:
+            self._write_block()
+
+    def _write_block(self):
+        records = self._pending
+        self._pending = []
+        rows = len(records)
+        # {(scope, event): {row: value}}; event None for a top-level number
+        columns = {}
+        extras = [None] * rows
+        timestamps = []
+        for row, record in enumerate(records):
+            timestamps.append(float(record["timestamp"]))
+            for key, value in record.items():
+                if key == "timestamp":
+                    continue
+                if not _columnar(value):
+                    if extras[row] is None:
+                        extras[row] = {}
+                    extras[row][key] = value
+                elif isinstance(value, dict):
+                    for event, v in value.items():
+                        columns.setdefault((key, event), {})[row] = v
+                else:
+                    columns.setdefault((key, None), {})[row] = value
+
+        level = self.level
+        compress = self._compress
+        chunks = []
+        offset = 0
+
+        def add(data):
+            nonlocal offset
+            data = compress(data, level)
+            chunks.append(data)
+            entry = [offset, len(data)]
+            offset += len(data)
+            return entry
+
+        header = {"rows": rows, "timestamp": add(encode_deltas(_float_bits(timestamps))),
+                  "columns": [], "extra": None}
+        for (scope, event), by_row in columns.items():
+            values = list(by_row.values())
+            kind, data = _encode_column(values)
+            full = len(by_row) == rows
+            if not full:
+                data = _bitmap([row in by_row for row in range(rows)]) + data
+            header["columns"].append([scope, event, kind, full] + add(data))
+        if any(extra is not None for extra in extras):
+            lines = "\n".join(_encode(extra) if extra is not None else "" for extra in extras)
+            header["extra"] = add(lines.encode())
+
+        head = compress(_encode(header).encode(), level)
+        offset_in_file = self._file.tell()
+        self._file.write(BLOCK_HEADER.pack(len(head)))
+        self._file.write(head)
+        for data in chunks:
+            self._file.write(data)
+        size = self._file.tell() - offset_in_file
+        self._blocks.append([offset_in_file, size, rows, timestamps[0], timestamps[-1]])
+        self.rows += rows
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._pending:
+            self._write_block()
+        index = self._compress(_encode({"blocks": self._blocks}).encode(), self.level)
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(TRAILER.pack(offset, len(index), MAGIC))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """
+    Range queries on an archive. Records come back as written (key order
+    aside: column scopes first, then the JSON-kept keys).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        magic, version, codec = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        self.codec = codec.rstrip(b"\0").decode()
+        if magic != MAGIC or version != ARCHIVE_VERSION or self.codec not in CODECS:
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} PowerDaemon archive")
+        self._decompress = CODECS[self.codec][1]
+        self._file.seek(-TRAILER.size, 2)
+        offset, size, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} has no index (was the archive closed?)")
+        self._file.seek(offset)
+        index = json.loads(self._decompress(self._file.read(size)))
+        self.blocks = index["blocks"]
+        self.rows = sum(block[2] for block in self.blocks)
+        self._last = [block[4] for block in self.blocks]
+        # Blocks read by the last queries, for tests and benchmarks
+        self.blocks_read = 0
+
+    def time_range(self):
+        """(first, last) timestamp, None when empty."""
+        if not self.blocks:
+            return None
+        return self.blocks[0][3], self.blocks[-1][4]
+
+    def _blocks_in(self, start, end):
+        first = bisect.bisect_left(self._last, start) if start is not None else 0
+        for block in self.blocks[first:]:
+            if end is not None and block[3] > end:
+                break
+            yield block
+
+    def _read_block(self, block, wanted=None):
+        """
+        (timestamps, {(scope, event): values with None where missing}, extras).
+        wanted(scope, event) picks the columns to decode; extras only come
+        with every column.
+        """
+        offset, size, rows = block[:3]
+        self._file.seek(offset)
+        data = self._file.read(size)
+        self.blocks_read += 1
+        decompress = self._decompress
+        (head_size,) = BLOCK_HEADER.unpack_from(data)
+        base = BLOCK_HEADER.size + head_size
+        header = json.loads(decompress(data[BLOCK_HEADER.size:base]))
+
+        def chunk(entry):
+            return decompress(data[base + entry[0]:base + entry[0] + entry[1]])
+
+        timestamps = _bits_float(decode_deltas(chunk(header["timestamp"])))
+        columns = {}
+        for scope, event, kind, full, chunk_offset, chunk_size in header["columns"]:
+            if wanted is not None and not wanted(scope, event):
+                continue
+            raw = chunk([chunk_offset, chunk_size])
+            if full:
+                columns[(scope, event)] = _decode_column(kind, raw)
+            else:
+                nbytes = (rows + 7) // 8
+                present = _unbitmap(raw[:nbytes], rows)
+                values = iter(_decode_column(kind, raw[nbytes:]))
+                columns[(scope, event)] = [next(values) if there else None for there in present]
+        extras = None
+        if header["extra"] and wanted is None:
+            extras = [json.loads(line) if line else None
+                      for line in chunk(header["extra"]).decode().split("\n")]
+        return timestamps, columns, extras
+
+    def _rows(self, timestamps, start, end):
+        lo = bisect.bisect_left(timestamps, start) if start is not None else 0
+        hi = bisect.bisect_right(timestamps, end) if end is not None else len(timestamps)
+        return range(lo, hi)
+
+    def records(self, start=None, end=None, events=None):
+        """
+        Records with start <= timestamp <= end, oldest first. events: a
+        tuple of event name prefixes, to decode only those columns (and
+        none of coverage, overhead, ...).
+        """
+        wanted = None
+        if events is not None:
+            def wanted(scope, event):
+                return event is not None and event.startswith(events)
+        for block in self._blocks_in(start, end):
+            timestamps, columns, extras = self._read_block(block, wanted)
+            items = list(columns.items())
+            for row in self._rows(timestamps, start, end):
+                record = {"timestamp": timestamps[row]}
+                for (scope, event), values in items:
+                    value = values[row]
+                    if value is None:
+                        continue
+                    if event is None:
+                        record[scope] = value
+                    else:
+                        scope_values = record.get(scope)
+                        if scope_values is None:
+                            scope_values = record[scope] = {}
+                        scope_values[event] = value
+                if extras and extras[row]:
+                    record.update(extras[row])
+                yield record
+
+    def series(self, scope, event, start=None, end=None):
+        """(timestamps, values) of one column in range, decoding only that column."""
+        key = (scope, event)
+        times, values = [], []
+        for block in self._blocks_in(start, end):
+            timestamps, columns, _ = self._read_block(block, lambda *column: column == key)
+            column = columns.get(key)
+            if column is None:
+                continue
+            for row in self._rows(timestamps, start, end):
+                if column[row] is not None:
+                    times.append(timestamps[row])
+                    values.append(column[row])
+        return times, values
+
+    def energy(self, start=None, end=None):
+        """
+        {scope: joules} of the records with start <= timestamp <= end:
+        "system" from package energy, and each cgroup its share of every
+        record's package energy (power.cgroup_power over a 1 s interval is
+        that share in joules). Only the energy and share columns (per
+        package too) are decoded.
+        """
+        joules = {}
+        for record in self.records(start, end, events=(PKG,) + SHARE_EVENTS):
+            energy = record.get("system", {}).get(PKG)
+            if energy is not None:
+                joules["system"] = joules.get("system", 0.0) + energy
+            for scope, share in cgroup_power(record, 1.0).items():
+                joules[scope] = joules.get(scope, 0.0) + share
+        return joules
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_archive(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def pack(src, dst, block_rows=BLOCK_ROWS, codec="zlib", level=None):
+    """Archive a measurement file (JSON Lines or legacy JSON array). Returns the rows written."""
+    from writer import read_records
+    with ArchiveWriter(dst, block_rows=block_rows, codec=codec, level=level) as archive:
+        for record in read_records(src):
+            archive.write(record)
+    return archive.rows
+
+
+def unpack(src, dst):
+    """Write an archive back out as a JSON Lines measurement file. Returns the rows written."""
+    rows = 0
+    with ArchiveReader(src) as archive, open(dst, "w") as f:
+        for record in archive.records():
+            f.write(_encode(record) + "\n")
+            rows += 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar archives of measurement runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="Measurement file -> archive")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p.add_argument("--codec", choices=list(CODECS), default="zlib")
+    p.add_argument("--level", type=int, default=None)
+    p.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    p = sub.add_parser("unpack", help="Archive -> JSON Lines measurement file")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p = sub.add_parser("energy", help="Joules per scope in a time range")
+    p.add_argument("src")
+    p.add_argument("--start", type=float, default=None)
+    p.add_argument("--end", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        rows = pack(args.src, args.dst, block_rows=args.block_rows, codec=args.codec,
+                    level=args.level)
+        print(f"[*] {rows} records archived to {args.dst}")
+    elif args.command == "unpack":
+        rows = unpack(args.src, args.dst)
+        print(f"[*] {rows} records written to {args.dst}")
+    else:
+        with ArchiveReader(args.src) as archive:
+            for scope, joules in archive.energy(args.start, args.end).items():
+                print(f"{scope:>24} {joules:14.3f} J")
+
+
+if __name__ == "__main__":
+    main()
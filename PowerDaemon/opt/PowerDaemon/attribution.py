@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+attribution.py - Vectorized per-cgroup energy attribution
+
+A measurement run is loaded once into NumPy arrays (one (n,) array per
+system event, one (n, cgroups) array per cgroup event) and every model
+attributes a RAPL domain to all cgroups and intervals in one pass.
+
+Models:
+    InstructionShare - energy * cgroup instructions / system instructions
+    CycleShare       - energy * cgroup cycles / system cycles
+    CpuTimeShare     - energy * cgroup CPU time / system CPU time (cpu.stat,
+                       for runs recorded without a PMU)
+    LinearModel      - least-squares fit of power/energy-pkg/ against the
+                       system counters; each cgroup's share is the fitted
+                       dynamic energy of its own counters, so the intercept
+                       (idle/static energy) stays unattributed
+
+Intervals whose denominator is 0 attribute 0 instead of raising. Runs
+recorded with per-package columns (shards.py) are attributed per package
+by the share models and summed, so each socket's energy goes to the
+cgroups that ran there.
+
+Records taken by the daemon carry its own share of the system's CPU time
+("overhead"); with exclude_self every system column (energy and counters)
+is reduced by that share before attribution, so the meter's own energy is
+not in the system totals and the share models' ratios stay consistent.
+"""
+
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+from writer import read_records
+from samples import RESERVED_KEYS
+from power import PKG
+from shards import socket_event, is_socket_event, SOCKET_SEP
+
+CORES = "power/energy-cores/"
+DOMAINS = (PKG, CORES)
+
+INSTRUCTIONS = "cpu_core/instructions/"
+CYCLES = "cpu_core/cycles/"
+CPU_TIME = "cpu.stat/usage_usec"
+
+
+class Run:
+    """
+    A measurement run as arrays.
+
+    times:   (n,) timestamps
+    system:  {event: (n,) array}
+    groups:  {event: (n, len(cgroups)) array}; 0 where a cgroup had no value
+    self_share: (n,) the daemon's share of system energy, 0 where unknown
+    """
+    def __init__(self, times, system, groups, cgroups, self_share=None):
+        self.times = times
+        self.system = system
+        self.groups = groups
+        self.cgroups = list(cgroups)
+        self.self_share = self_share if self_share is not None else np.zeros(len(times))
+
+    def __len__(self):
+        return len(self.times)
+
+    def cgroup_index(self, name):
+        return self.cgroups.index(name)
+
+
+def load_run(path, cgroups=None, events=None, exclude_self=False):
+    """
+    Load a measurement file (JSON Lines or legacy JSON array) into a Run.
+    cgroups/events restrict what is kept, which bounds memory on long runs.
+    """
+    records = list(read_records(path))
+    return run_from_records(records, cgroups=cgroups, events=events, exclude_self=exclude_self)
+
+
+def _getter(keys):
+    """itemgetter returning a tuple even for one key."""
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda d: (d[key],)
+    return itemgetter(*keys)
+
+
+def _columns(dicts, wanted):
+    """
+    {event: (len(dicts),) array} of one scope's value dicts, 0 where the
+    dict or the event is missing.
+    """
+    m = len(dicts)
+    events = dict.fromkeys(chain.from_iterable(d for d in dicts if d))
+    return {event: np.fromiter((d.get(event, 0.0) if d else 0.0 for d in dicts),
+                               dtype=np.float64, count=m)
+            for event in events if wanted is None or event in wanted}
+
+
+def _group_columns(records, cgroups, wanted):
+    """
+    {event: (records, cgroups) array}. Records from one sensor run have
+    every cgroup with the same events: those are read in one flat pass.
+    Others (cgroups attached mid-run, events differing between cgroups)
+    are read column by column.
+    """
+    n, m = len(records), len(cgroups)
+    if not n or not m:
+        return {}
+    try:
+        dicts = list(chain.from_iterable(map(_getter(cgroups), records)))
+        events = list(dicts[0])
+        k = len(events)
+        if k and sum(map(len, dicts)) == n * m * k:
+            flat = np.fromiter(chain.from_iterable(map(_getter(events), dicts)),
+                               dtype=np.float64, count=n * m * k).reshape(n, m, k)
+            return {event: np.ascontiguousarray(flat[:, :, e]) for e, event in enumerate(events)
+                    if wanted is None or event in wanted}
+    except (KeyError, TypeError):
+        pass
+    groups = {}
+    for j, cg in enumerate(cgroups):
+        for event, values in _columns([r.get(cg) for r in records], wanted).items():
+            col = groups.get(event)
+            if col is None:
+                col = groups[event] = np.zeros((n, m))
+            col[:, j] = values
+    return groups
+
+
+def run_from_records(records, cgroups=None, events=None, exclude_self=False):
+    """
+    Build a Run from already parsed records. exclude_self removes the
+    daemon's own share from the system columns.
+    """
+    if cgroups is None:
+        # Records mostly share their keys: look at each distinct set once
+        shapes = dict.fromkeys(map(tuple, records))
+        cgroups = list(dict.fromkeys(key for shape in shapes for key in shape
+                                     if key not in RESERVED_KEYS))
+    wanted = set(events) if events is not None else None
+    n = len(records)
+
+    times = np.fromiter((r["timestamp"] for r in records), dtype=np.float64, count=n)
+    self_share = np.fromiter((r.get("overhead", {}).get("energy_share", 0.0) for r in records),
+                             dtype=np.float64, count=n)
+    system = _columns([r.get("system") for r in records], wanted)
+    groups = _group_columns(records, cgroups, wanted)
+    if exclude_self:
+        remaining = 1.0 - self_share
+        for col in system.values():
+            col *= remaining
+    return Run(times, system, groups, cgroups, self_share)
+
+
+def run_from_ring(ring, scope_system="system"):
+    """Build a Run from a samples.SampleRing without going through dicts."""
+    times = np.frombuffer(ring.times(), dtype=np.float64)
+    cgroups = [s for s in ring.schema.scopes() if s != scope_system]
+    index = {cg: j for j, cg in enumerate(cgroups)}
+    system = {}
+    groups = {}
+    for (scope, event), col in ring.columns().items():
+        # Columns of cgroups attached mid-window hold NaN before they existed
+        values = np.nan_to_num(np.frombuffer(col, dtype=np.float64), nan=0.0)
+        if scope == scope_system:
+            system[event] = values
+        else:
+            if event not in groups:
+                groups[event] = np.zeros((len(times), len(cgroups)))
+            groups[event][:, index[scope]] = values
+    return Run(times, system, groups, cgroups)
+
+
+def safe_divide(num, den):
+    """num / den with 0 wherever den is 0 (or not finite)."""
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=(den > 0) & np.isfinite(den))
+    return out
+
+
+class ShareModel:
+    """
+    Attribute a domain's energy by each cgroup's share of one counter.
+    """
+    event = None
+
+    def __init__(self, event=None):
+        if event is not None:
+            self.event = event
+
+    def fit(self, run, domain=PKG):
+        if self.event not in run.system or self.event not in run.groups:
+            raise KeyError(f"run has no '{self.event}' for system and cgroups")
+        return self
+
+    def shares(self, run):
+        """(n, cgroups) fraction of the system counter per cgroup."""
+        return run.groups[self.event] * safe_divide(1.0, run.system[self.event])[:, None]
+
+    def packages(self, run, domain):
+        """Packages with their own domain energy and counter columns, in the run."""
+        prefix = domain + SOCKET_SEP
+        packages = [name[len(prefix):] for name in run.system if name.startswith(prefix)]
+        return [p for p in packages
+                if socket_event(self.event, p) in run.system and socket_event(self.event, p) in run.groups]
+
+    def attribute(self, run, domain=PKG):
+        """(n, cgroups) energy in the domain's unit (Joules)."""
+        packages = self.packages(run, domain)
+        if not packages:
+            # energy / system counter per interval, then one multiply over (n, cgroups)
+            per_count = safe_divide(run.system[domain], run.system[self.event])
+            return run.groups[self.event] * per_count[:, None]
+        energy = np.zeros(run.groups[self.event].shape)
+        for package in packages:
+            event = socket_event(self.event, package)
+            per_count = safe_divide(run.system[socket_event(domain, package)], run.system[event])
+            energy += run.groups[event] * per_count[:, None]
+        return energy
+
+
+class InstructionShare(ShareModel):
+    event = INSTRUCTIONS
+
+
+class CycleShare(ShareModel):
+    event = CYCLES
+
+
+class CpuTimeShare(ShareModel):
+    event = CPU_TIME
+
+
+class LinearModel:
+    """
+    power/energy-pkg/ ~ intercept + sum_k coef_k * counter_k, fitted on the
+    system counters. A cgroup's share of an interval is the fitted dynamic
+    energy of its own counters over the fitted system energy; every domain
+    is split by that share.
+    """
+    def __init__(self, events=None, target=PKG):
+        self.events = events
+        self.target = target
+        self.coef = None
+        self.intercept = 0.0
+        self._shares = None
+
+    def _features(self, run):
+        if self.events is not None:
+            return list(self.events)
+        # Every counter recorded for both system and cgroups, minus energy itself
+        # and per-package columns (they add up to the summed ones)
+        return [e for e in run.system
+                if e in run.groups and not e.startswith("power/") and not is_socket_event(e)]
+
+    def fit(self, run, domain=None):
+        """Fit against the target domain (power/energy-pkg/ by default)."""
+        self.events = self._features(run)
+        if not self.events:
+            raise ValueError("no shared system/cgroup counters to fit on")
+        x = np.column_stack([run.system[e] for e in self.events])
+        # Column scaling keeps lstsq well conditioned with 1e9-sized counts
+        peak = x.max(axis=0)
+        scale = np.where(peak > 0, peak, 1.0)
+        a = np.column_stack([x / scale, np.ones(len(x))])
+        solution, *_ = np.linalg.lstsq(a, run.system[self.target], rcond=None)
+        self.coef = solution[:-1] / scale
+        self.intercept = float(solution[-1])
+        self._shares = None
+        return self
+
+    def predict(self, run):
+        """(n,) fitted system energy."""
+        predicted = np.full(len(run), self.intercept)
+        for event, coef in zip(self.events, self.coef):
+            predicted += coef * run.system[event]
+        return predicted
+
+    def shares(self, run):
+        """(n, cgroups) fitted dynamic energy of each cgroup over the fitted total."""
+        if self._shares is not None and self._shares[0] is run:
+            return self._shares[1]
+        if self.coef is None:
+            self.fit(run)
+        # Accumulate coef_k * counter_k in place, two passes per event
+        events = list(zip(self.events, self.coef))
+        dynamic = np.multiply(run.groups[events[0][0]], events[0][1])
+        tmp = np.empty_like(dynamic)
+        for event, coef in events[1:]:
+            np.multiply(run.groups[event], coef, out=tmp)
+            dynamic += tmp
+        np.clip(dynamic, 0.0, None, out=dynamic)
+        dynamic *= safe_divide(1.0, self.predict(run))[:, None]
+        self._shares = (run, dynamic)
+        return dynamic
+
+    def attribute(self, run, domain=None):
+        return self.shares(run) * run.system[domain or self.target][:, None]
+
+
+MODELS = {
+    "instructions": InstructionShare,
+    "cycles": CycleShare,
+    "cputime": CpuTimeShare,
+    "linear": LinearModel,
+}
+
+
+def attribute(run, model="instructions", domains=DOMAINS):
+    """
+    Attribute every available domain with one model, fitted once.
+    Returns {domain: (n, cgroups) array}.
+    """
+    if isinstance(model, str):
+        model = MODELS[model]()
+    model.fit(run)
+    return {domain: model.attribute(run, domain) for domain in domains if domain in run.system}
+
+
+def totals(run, energy):
+    """{cgroup: total Joules} from an (n, cgroups) attribution."""
+    return dict(zip(run.cgroups, energy.sum(axis=0).tolist()))
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+capping.py - Per-cgroup power budgets enforced through cgroup v2 cpu.max
+
+A PowerCapper is a sensor listener: every record it gets is one tick, and
+it acts on that tick's attributed power (power.cgroup_power) right away,
+with no timer or polling of its own. For a cgroup with a budget (watts):
+
+    free        over budget for engage_ticks ticks in a row: throttled
+                with a CPU limit of its CPU use * target / power
+    throttled   over budget, or below budget * (1 - hysteresis): the
+                limit is scaled by target / power (growing at most
+                MAX_STEP times per tick); once it reaches what the cgroup
+                had before, cpu.max is restored and the cgroup is free
+
+target is the middle of the band [budget * (1 - hysteresis), budget].
+Inside the band nothing changes, and cpu.max is only written when the
+quota does. CPU use at engagement comes
+from the record's cpu.stat/usage_usec (cpustat sensor), else from the
+cgroup's cpu.stat over the last tick in the band or the ticks spent over
+budget. A cgroup that jumps over budget from below the band is measured
+for one tick before it is throttled, even with engage_ticks=1. Without a
+readable cpu.stat, its share of the system counter times every CPU is
+used.
+
+    capper = PowerCapper({"batch.slice/*": 30.0}, hysteresis=0.1)
+    sensor.listeners.append(capper.update)
+    ...
+    capper.close()      # restores every cpu.max it changed
+"""
+
+import fnmatch
+import os
+
+from power import cgroup_power, SHARE_EVENTS
+from cgroups import CGROUP_ROOT
+from cpustat import CpuStatFile, CPU_USAGE
+
+# Release band below the budget, as a fraction of it
+HYSTERESIS = 0.1
+# Consecutive ticks over budget before a cgroup is throttled
+ENGAGE_TICKS = 2
+# Lowest CPU limit ever set
+MIN_CPUS = 0.01
+# Most the limit grows in one tick
+MAX_STEP = 2.0
+# Smallest quota the kernel accepts (microseconds)
+MIN_QUOTA = 1000
+DEFAULT_PERIOD = 100000
+
+
+class _Cap:
+    __slots__ = ("budget", "over", "limit", "max_cpus", "period", "original", "quota",
+                 "stat", "armed_at")
+
+    def __init__(self, budget):
+        self.budget = budget
+        # Consecutive ticks over budget while free
+        self.over = 0
+        # CPU limit while throttled, None while free
+        self.limit = None
+        self.max_cpus = None
+        self.period = DEFAULT_PERIOD
+        # cpu.max as found, restored on release
+        self.original = None
+        self.quota = None
+        # cpu.stat kept open while over budget, to measure CPU use
+        self.stat = None
+        self.armed_at = None
+
+
+class PowerCapper:
+    """
+    Throttles cgroups over their power budget through cpu.max.
+
+    budgets: {cgroup name or fnmatch glob: watts}, names as in the
+    records; default: budget of every other cgroup (None: not capped).
+    cpus: CPUs of a cgroup without a quota of its own (os.cpu_count()).
+    """
+    def __init__(self, budgets=None, default=None, hysteresis=HYSTERESIS,
+                 engage_ticks=ENGAGE_TICKS, min_cpus=MIN_CPUS, cgroup_root=CGROUP_ROOT,
+                 cpus=None):
+        if not 0 <= hysteresis < 1:
+            raise ValueError("hysteresis must be in [0, 1)")
+        self.budgets = dict(budgets or {})
+        self.default = default
+        self.hysteresis = hysteresis
+        self.engage_ticks = max(1, engage_ticks)
+        self.min_cpus = min_cpus
+        self.cgroup_root = cgroup_root
+        self.cpus = cpus or os.cpu_count() or 1
+        # {name: _Cap}; None for cgroups without a budget
+        self._caps = {}
+        self._prev = None
+        self._closed = False
+        self.engaged = 0
+        self.released = 0
+        self.writes = 0
+
+    def budget(self, name):
+        """Watts allowed to a cgroup, None if it is not capped."""
+        budget = self.budgets.get(name)
+        if budget is not None:
+            return budget
+        for pattern, watts in self.budgets.items():
+            if fnmatch.fnmatchcase(name, pattern):
+                return watts
+        return self.default
+
+    @property
+    def throttled(self):
+        """{name: CPU limit} of the cgroups throttled now."""
+        return {name: cap.limit for name, cap in self._caps.items()
+                if cap is not None and cap.limit is not None}
+
+    def update(self, record):
+        """Act on one sample (sensor listener); nothing once closed."""
+        if self._closed:
+            return
+        timestamp = record["timestamp"]
+        prev = self._prev
+        self._prev = timestamp
+        if prev is None or timestamp <= prev:
+            return
+        interval = timestamp - prev
+        caps = self._caps
+        for name, watts in cgroup_power(record, interval).items():
+            cap = caps.get(name, False)
+            if cap is False:
+                budget = self.budget(name)
+                cap = caps[name] = _Cap(budget) if budget is not None else None
+            if cap is not None:
+                self._step(name, cap, watts, record, timestamp, interval)
+
+    def _step(self, name, cap, watts, record, timestamp, interval):
+        budget = cap.budget
+        low = budget * (1 - self.hysteresis)
+        values = record[name]
+        if cap.limit is None:
+            if watts <= budget:
+                cap.over = 0
+                if watts <= low or CPU_USAGE in values:
+                    self._disarm(cap)
+                elif cap.stat is None:
+                    self._arm(name, cap, timestamp)
+                else:
+                    # Close to the budget: keep the last tick's CPU use at hand
+                    self._restart(cap, timestamp)
+                return
+            cap.over += 1
+            if cap.stat is None and CPU_USAGE not in values and self._arm(name, cap, timestamp):
+                # Throttle once there is a tick of CPU use to scale
+                return
+            if cap.over < self.engage_ticks:
+                return
+            self._engage(name, cap, watts, self._cpus(cap, record, name, timestamp, interval))
+            return
+
+        target = (budget + low) / 2
+        if watts > budget:
+            limit = cap.limit * target / watts
+        elif watts < low:
+            limit = cap.limit * (min(target / watts, MAX_STEP) if watts > 0 else MAX_STEP)
+            if limit >= cap.max_cpus:
+                self._release(name, cap, watts)
+                return
+        else:
+            return
+        self._set_limit(name, cap, limit)
+
+    def _arm(self, name, cap, timestamp):
+        """Start measuring the cgroup's CPU use; False if cpu.stat cannot be read."""
+        try:
+            cap.stat = CpuStatFile(os.path.join(self.cgroup_root, name)).open()
+            cap.armed_at = timestamp
+            return True
+        except OSError:
+            cap.stat = None
+            return False
+
+    def _restart(self, cap, timestamp):
+        try:
+            cap.stat.read()
+            cap.armed_at = timestamp
+        except OSError:
+            self._disarm(cap)
+
+    def _disarm(self, cap):
+        if cap.stat is not None:
+            cap.stat.close()
+            cap.stat = None
+
+    def _cpus(self, cap, record, name, timestamp, interval):
+        """CPUs the cgroup used lately, None if unknown."""
+        values = record[name]
+        usage = values.get(CPU_USAGE)
+        if usage is not None:
+            return usage / 1e6 / interval
+        if cap.stat is not None and timestamp > cap.armed_at:
+            try:
+                usage = cap.stat.read()[0]
+                if usage > 0:
+                    return usage / 1e6 / (timestamp - cap.armed_at)
+            except OSError:
+                pass
+            finally:
+                self._disarm(cap)
+        # No cpu.stat: at most its share of what the whole machine counted
+        system = record.get("system", {})
+        for event in SHARE_EVENTS:
+            total = system.get(event)
+            if total:
+                return min(values.get(event, 0.0) / total, 1.0) * self.cpus
+        return None
+
+    def _engage(self, name, cap, watts, cpus):
+        cap.over = 0
+        path = os.path.join(self.cgroup_root, name, "cpu.max")
+        try:
+            with open(path) as f:
+                cap.original = f.read().strip()
+        except OSError as e:
+            print(f"[!] Cannot cap {name}: {e}")
+            self._caps[name] = None
+            return
+        quota, _, period = cap.original.partition(" ")
+        cap.period = int(period) if period else DEFAULT_PERIOD
+        cap.max_cpus = self.cpus if quota == "max" else int(quota) / cap.period
+        cap.quota = None
+        if not cpus:
+            cpus = cap.max_cpus
+        cap.limit = cap.max_cpus
+        target = cap.budget * (1 - self.hysteresis / 2)
+        self._set_limit(name, cap, min(cpus, cap.max_cpus) * target / watts)
+        if self._caps.get(name) is cap:
+            self.engaged += 1
+            print(f"[*] Throttling {name}: {watts:.1f} W over its {cap.budget:g} W budget, "
+                  f"{cap.limit:.2f} CPUs")
+
+    def _set_limit(self, name, cap, limit):
+        limit = min(max(limit, self.min_cpus), cap.max_cpus)
+        cap.limit = limit
+        quota = max(MIN_QUOTA, int(limit * cap.period))
+        if quota != cap.quota:
+            self._write(name, cap, f"{quota} {cap.period}")
+            cap.quota = quota
+
+    def _release(self, name, cap, watts):
+        self._write(name, cap, cap.original)
+        cap.limit = None
+        cap.quota = None
+        self.released += 1
+        print(f"[*] Releasing {name}: {watts:.1f} W")
+
+    def _write(self, name, cap, value):
+        try:
+            with open(os.path.join(self.cgroup_root, name, "cpu.max"), "w") as f:
+                f.write(value + "\n")
+            self.writes += 1
+        except OSError as e:
+            # Gone, or not ours to change: stop trying
+            print(f"[!] Cannot write cpu.max of {name}: {e}")
+            self._disarm(cap)
+            self._caps[name] = None
+
+    def reset(self):
+        """
+        A new sensor run starts: its first sample has no interval. Throttled
+        cgroups stay throttled.
+        """
+        self._prev = None
+        for cap in self._caps.values():
+            if cap is not None:
+                cap.over = 0
+                self._disarm(cap)
+
+    def close(self):
+        """Restore the cpu.max of every throttled cgroup; later samples are ignored."""
+        self._closed = True
+        for name, cap in list(self._caps.items()):
+            if cap is None:
+                continue
+            self._disarm(cap)
+            if cap.limit is not None:
+                self._write(name, cap, cap.original)
+                cap.limit = None
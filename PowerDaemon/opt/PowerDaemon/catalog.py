@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+catalog.py - Cached catalog of the perf events to monitor
+
+The catalog is built once (from `perf list --json pmu`, or libpfm4 when
+perf is missing) and cached on disk under a fingerprint of the CPU model,
+microcode and kernel version, so a new kernel or microcode update
+rebuilds it and everything else loads the cached file in milliseconds.
+Events are stored as compact rows with their detail level for system and
+cgroup monitoring; collector.py, daemon.py and sensor.py all read from it.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+
+# Bumped whenever the on-disk layout changes
+CATALOG_VERSION = 1
+
+CACHE_DIR = "/var/cache/powerdaemon"
+USER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "powerdaemon")
+
+# /proc/cpuinfo fields identifying the CPU (x86 and arm64)
+CPU_FIELDS = ("vendor_id", "cpu family", "model", "model name", "stepping", "microcode",
+              "CPU implementer", "CPU architecture", "CPU variant", "CPU part", "CPU revision")
+
+# Detail level meaning "not monitored"
+NO_LEVEL = -1
+
+
+def fingerprint(cpuinfo="/proc/cpuinfo", release=None):
+    """
+    Short hash of the first CPU's identity and the kernel release.
+    """
+    fields = {}
+    try:
+        with open(cpuinfo) as f:
+            # Only the first processor block, the rest repeats it
+            for line in f:
+                if not line.strip():
+                    break
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key in CPU_FIELDS:
+                    fields[key] = value.strip()
+    except OSError:
+        pass
+    release = release or os.uname().release
+    text = json.dumps([CATALOG_VERSION, release, sorted(fields.items())])
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def default_cache_dir():
+    """System cache when writable (root), per-user cache otherwise."""
+    parent = CACHE_DIR if os.path.isdir(CACHE_DIR) else os.path.dirname(CACHE_DIR)
+    return CACHE_DIR if os.access(parent, os.W_OK) else USER_CACHE_DIR
+
+
+def catalog_path(cache_dir=None, fp=None):
+    return os.path.join(cache_dir or default_cache_dir(), f"events-{fp or fingerprint()}.json")
+
+
+class EventCatalog:
+    """
+    Event rows (name, unit, encoding, system level, group level); a level is
+    the lowest detail at which the event is monitored, NO_LEVEL for never.
+    """
+    def __init__(self, rows=(), fingerprint=None, source=None):
+        self.rows = [list(row) for row in rows]
+        self.fingerprint = fingerprint
+        self.source = source
+        self._index = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def index(self):
+        """{name: row}, built on first use."""
+        if self._index is None:
+            self._index = {row[0]: row for row in self.rows}
+        return self._index
+
+    def get(self, name):
+        return self.index.get(name)
+
+    def levels(self, detail=0):
+        """(system events, group events) monitored at this detail level."""
+        system = [row[0] for row in self.rows if NO_LEVEL < row[3] <= detail]
+        group = [row[0] for row in self.rows if NO_LEVEL < row[4] <= detail]
+        return system, group
+
+    @classmethod
+    def from_perf_list(cls, events_data, fp=None):
+        """
+        Build from `perf list --json pmu` output: power events are system
+        level 0, msr events level 1, cpu_core kernel PMU events level 1 for
+        both scopes with instructions already at level 0.
+        """
+        rows = {}
+        for event in events_data:
+            unit = event.get("Unit")
+            name = event.get("EventName")
+            encoding = event.get("Encoding")
+            if not name or not encoding:
+                continue
+            if unit == "cpu_core":
+                name = f"cpu_core/{name}/"
+            system = group = NO_LEVEL
+            if unit == "power":
+                system = 0
+            elif unit == "msr":
+                system = group = 1
+            elif unit == "cpu_core" and event.get("EventType") == "Kernel PMU event":
+                system = group = 0 if name == "cpu_core/instructions/" else 1
+            rows[name] = [name, unit, encoding, system, group]
+        return cls(rows.values(), fingerprint=fp, source="perf list")
+
+    @classmethod
+    def from_pc_info(cls, path):
+        """
+        Read an old pc_info.json, either the collector layout
+        ({"0": {"system": [...], "group": [...]}, "1": ...}) or the flat
+        init.py layout ({"system": [...], "group": [...]}, all level 0).
+        """
+        with open(path) as f:
+            data = json.load(f)
+        levels = {0: data} if "system" in data else {int(k): v for k, v in data.items()}
+        rows = {}
+        for level in sorted(levels):
+            for scope, col in (("system", 3), ("group", 4)):
+                for ev in levels[level].get(scope, []):
+                    row = rows.setdefault(ev["Name"], [ev["Name"], ev.get("Unit") or ev.get("Type"),
+                                                       ev.get("Encoding"), NO_LEVEL, NO_LEVEL])
+                    if row[col] == NO_LEVEL:
+                        row[col] = level
+        return cls(rows.values(), source=path)
+
+    def to_pc_info(self):
+        """The collector's pc_info.json layout, for older tooling."""
+        data = {}
+        for name, unit, encoding, system, group in self.rows:
+            for scope, level in (("system", system), ("group", group)):
+                if level != NO_LEVEL:
+                    entry = {"Unit": unit, "Name": name, "Encoding": encoding}
+                    data.setdefault(str(level), {"system": [], "group": []})[scope].append(entry)
+        return data
+
+    def save(self, path):
+        """Write atomically, so concurrent loaders never see a partial file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        units = sorted({row[1] or "" for row in self.rows})
+        unit_index = {unit: i for i, unit in enumerate(units)}
+        data = {"version": CATALOG_VERSION, "fingerprint": self.fingerprint, "source": self.source,
+                "units": units,
+                "events": [[name, unit_index[unit or ""], encoding, system, group]
+                           for name, unit, encoding, system, group in self.rows]}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != CATALOG_VERSION:
+            raise ValueError(f"{path}: catalog version {data.get('version')}, expected {CATALOG_VERSION}")
+        units = data["units"]
+        rows = [(name, units[unit] or None, encoding, system, group)
+                for name, unit, encoding, system, group in data["events"]]
+        return cls(rows, fingerprint=data.get("fingerprint"), source=data.get("source"))
+
+
+def build_catalog(fp=None):
+    """
+    Enumerate events with `perf list --json pmu`, falling back to libpfm4.
+    """
+    try:
+        result = subprocess.run(["perf", "list", "--json", "pmu"], capture_output=True, text=True)
+    except FileNotFoundError:
+        result = None
+    if result is not None and result.returncode == 0:
+        return EventCatalog.from_perf_list(json.loads(result.stdout.replace("\n", "")), fp=fp)
+
+    print("[!] 'perf list' unavailable, enumerating events with libpfm4")
+    # libpfm4 is only loaded when there is no cached catalog and no perf
+    from init import PerfInitializer
+    events = PerfInitializer().collect_events()
+    rows = [(ev["Name"], ev["Type"], None, 0, 0) for ev in events]
+    return EventCatalog(rows, fingerprint=fp, source="libpfm4")
+
+
+def load_catalog(cache_dir=None, rebuild=False):
+    """
+    The catalog for this machine: the cached one if its fingerprint
+    matches, otherwise a freshly built one that is cached for next time.
+    """
+    fp = fingerprint()
+    path = catalog_path(cache_dir, fp)
+    if not rebuild and os.path.exists(path):
+        try:
+            return EventCatalog.load(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"[!] Ignoring cached catalog {path}: {e}")
+
+    print("[*] Building event catalog")
+    catalog = build_catalog(fp)
+    try:
+        catalog.save(path)
+        # Catalogs of an older kernel/microcode are never read again
+        directory = os.path.dirname(path)
+        for entry in os.listdir(directory):
+            if entry.startswith("events-") and entry != os.path.basename(path):
+                os.unlink(os.path.join(directory, entry))
+        print(f"[*] Cached {len(catalog)} events in {path}")
+    except OSError as e:
+        print(f"[!] Cannot cache event catalog: {e}")
+    return catalog
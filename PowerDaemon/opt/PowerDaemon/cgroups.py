@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+cgroups.py - Resolve the cgroups to monitor from names, paths and globs
+"""
+
+import glob
+import os
+
+# cgroup v2 mount point
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_name(path, root=CGROUP_ROOT):
+    """
+    Name of a cgroup as perf and the output files use it: the path
+    relative to the cgroup root ('sensor', 'system.slice/foo.service').
+    """
+    return os.path.relpath(os.path.abspath(path), root)
+
+
+def expand_cgroups(patterns, root=CGROUP_ROOT):
+    """
+    Expand cgroup names, absolute paths, comma lists and globs
+    ('kubepods/*/pod*') into a sorted list of existing cgroup directories.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    paths = []
+    for entry in patterns:
+        for pattern in entry.split(","):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            if not os.path.isabs(pattern):
+                pattern = os.path.join(root, pattern)
+            if glob.has_magic(pattern):
+                matches = sorted(glob.glob(pattern))
+            else:
+                matches = [pattern]
+            for path in matches:
+                path = os.path.normpath(path)
+                if os.path.isdir(path) and path not in paths:
+                    paths.append(path)
+    return paths
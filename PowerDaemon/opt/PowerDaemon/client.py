@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+client.py - Command line client for the PowerDaemon API
+
+    python3 client.py latest
+    python3 client.py range --last 60
+    python3 client.py subscribe
+    python3 client.py rollup --last 86400 --resolution 60
+    python3 client.py stats
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+
+from api import SOCKET_PATH
+
+
+def connect(path=SOCKET_PATH):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+def request(sock, cmd, **params):
+    """Send one request and return the parsed reply."""
+    sock.sendall(json.dumps({"cmd": cmd, **params}).encode() + b"\n")
+    return json.loads(_readline(sock))
+
+
+def subscribe(sock):
+    """Yield every sample the daemon publishes."""
+    sock.sendall(b'{"cmd": "subscribe"}\n')
+    reader = sock.makefile("rb")
+    for line in reader:
+        yield json.loads(line)
+
+
+def _readline(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("daemon closed the connection")
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            return b"".join(chunks)
+
+
+def print_power(sample):
+    power = ", ".join(f"{cg}: {watts:.2f} W" for cg, watts in sorted(sample.get("power", {}).items()))
+    print(f"{sample['timestamp']:.3f}  {power or '(no power estimate)'}", flush=True)
+
+
+def print_stats(reply):
+    if "cpu" in reply:
+        print(f"uptime {reply['uptime']:.0f} s, {reply['samples']} samples, "
+              f"CPU {reply['cpu']:.2f} s ({reply['cpu_share'] * 100:.2f}% of a core), "
+              f"{reply['wakeups_per_sec']:.1f} wakeups/s")
+        for stage, hist in reply["stages"].items():
+            print(f"  {stage:>9}: mean {hist['mean_us']:8.1f} us, p50 < {hist['p50_us']:.0f} us, "
+                  f"p99 < {hist['p99_us']:.0f} us, max {hist['max_us']:.1f} us")
+    else:
+        print("sensor not running")
+    api = reply["api"]
+    print(f"api: {api['subscribers']} subscribers, {api['published']} published, "
+          f"{api['dropped']} dropped")
+
+
+def print_rollups(reply):
+    print(f"# tier {reply['tier']}")
+    for record in reply["records"]:
+        if reply["tier"] == "raw":
+            print(json.dumps(record))
+            continue
+        power = ", ".join(f"{scope}: {values['joules']:.1f} J ({values['power_mean']:.2f} W)"
+                          for scope, values in record.items()
+                          if isinstance(values, dict) and "joules" in values)
+        print(f"{record['timestamp']:.0f}  {power or '(no energy)'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--json", action="store_true", help="Print raw replies.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("latest", help="Newest sample and per-cgroup power")
+    range_parser = sub.add_parser("range", help="Samples from the in-memory history")
+    range_parser.add_argument("--start", type=float, help="Unix timestamp")
+    range_parser.add_argument("--end", type=float, help="Unix timestamp")
+    range_parser.add_argument("--last", type=float, help="Seconds back from now")
+    sub.add_parser("subscribe", help="Stream samples as they are taken")
+    sub.add_parser("stats", help="The daemon's own footprint and stage latencies")
+    rollup_parser = sub.add_parser("rollup", help="Aggregates from the on-disk rollups")
+    rollup_parser.add_argument("--start", type=float, help="Unix timestamp")
+    rollup_parser.add_argument("--end", type=float, help="Unix timestamp")
+    rollup_parser.add_argument("--last", type=float, help="Seconds back from now")
+    rollup_parser.add_argument("--resolution", type=float,
+                               help="Seconds per bucket at most (default: chosen from the range)")
+    args = parser.parse_args()
+
+    try:
+        sock = connect(args.socket)
+    except OSError as e:
+        sys.exit(f"Error: cannot connect to {args.socket}: {e}")
+
+    with sock:
+        if args.command == "latest":
+            reply = request(sock, "latest")
+            if args.json or reply["type"] == "error":
+                print(json.dumps(reply))
+            else:
+                print_power(reply)
+        elif args.command == "range":
+            start = time.time() - args.last if args.last else args.start
+            reply = request(sock, "range", start=start, end=args.end)
+            if args.json:
+                print(json.dumps(reply))
+            else:
+                for record in reply.get("records", []):
+                    print(json.dumps(record))
+        elif args.command == "stats":
+            reply = request(sock, "stats")
+            if args.json or reply["type"] == "error":
+                print(json.dumps(reply))
+            else:
+                print_stats(reply)
+        elif args.command == "rollup":
+            start = time.time() - args.last if args.last else args.start
+            reply = request(sock, "rollup", start=start, end=args.end, resolution=args.resolution)
+            if args.json or reply["type"] == "error":
+                print(json.dumps(reply))
+            else:
+                print_rollups(reply)
+        else:
+            try:
+                for sample in subscribe(sock):
+                    if args.json:
+                        print(json.dumps(sample), flush=True)
+                    else:
+                        print_power(sample)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
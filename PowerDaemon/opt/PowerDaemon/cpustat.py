@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+cpustat.py - CPU time of cgroups from cgroup v2 cpu.stat
+
+Fallback for hosts without a usable PMU (VMs, locked-down kernels). Each
+cgroup's cpu.stat stays open and is read with one short pread() per tick;
+only the first three fields are parsed. Values are reported as events
+named 'cpu.stat/<field>' so they drop into the same sample schema as perf
+counters and CPU-time share can replace instruction share for attribution.
+"""
+
+import os
+
+CPU_USAGE = "cpu.stat/usage_usec"
+CPU_USER = "cpu.stat/user_usec"
+CPU_SYSTEM = "cpu.stat/system_usec"
+CPU_STAT_EVENTS = [CPU_USAGE, CPU_USER, CPU_SYSTEM]
+
+# The kernel always prints usage_usec, user_usec and system_usec first;
+# 3 * (name + 20 digits) fits comfortably
+READ_SIZE = 128
+
+
+class CpuStatFile:
+    """
+    One kept-open cpu.stat; read() returns microseconds since the previous read.
+    """
+    def __init__(self, cgroup_path):
+        self.path = os.path.join(cgroup_path, "cpu.stat")
+        self.fd = None
+        self.prev = None
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        self.prev = self._read_usec()
+        return self
+
+    def _read_usec(self):
+        parts = os.pread(self.fd, READ_SIZE, 0).split(None, 6)
+        return int(parts[1]), int(parts[3]), int(parts[5])
+
+    def read(self):
+        """[usage, user, system] microseconds since the previous read."""
+        usage, user, system = self._read_usec()
+        prev_usage, prev_user, prev_system = self.prev
+        self.prev = (usage, user, system)
+        return [float(usage - prev_usage), float(user - prev_user), float(system - prev_system)]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
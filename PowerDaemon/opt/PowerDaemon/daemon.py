@@ -5,19 +5,67 @@ Watches a cgroup and starts/stops the sensor automatically
 """
 
 import signal
-import time
-import yaml
 import os
-from threading import Thread
+from threading import Thread, Lock
 
 from watch_cgroup import CgroupWatcher
-from sensor import PerfSensor
-from init import PerfInitializer  # your class from init.py
+from sensor import PerfSensor, CpuStatSensor
+from catalog import load_catalog
+from api import ApiServer
+from rollups import RollupStore
+from replay import Recorder
+from processes import PID_BUDGET
+from shm import ShmPublisher, SHM_PATH, HISTORY
+from cgroups import expand_cgroups
+from discovery import CgroupDiscovery
+from capping import PowerCapper, HYSTERESIS, ENGAGE_TICKS, MIN_CPUS
 
 # Globals for clean shutdown
 running = True
 sensor_thread = None
 sensor_instance = None
+sensor_lock = Lock()
+# Cgroups the sensor covers (fixed list plus discovered ones)
+monitored_cgroups = []
+# Event catalog shared by every sensor start
+catalog = None
+# Local socket API, serves whichever sensor is running
+api_server = None
+# On-disk raw samples and rollups, kept across sensor restarts
+rollup_store = None
+# Raw input recording for replay.py, when configured
+recorder = None
+# Latest samples in shared memory for local readers (shm.ShmReader)
+shm_publisher = None
+# Per-cgroup power budgets enforced through cpu.max, when configured
+power_capper = None
+# Seconds to wait for the sensor thread's last sample on stop
+SENSOR_JOIN_TIMEOUT = 5.0
+
+# Used for every key missing from config.yaml
+DEFAULT_CONFIG = {
+    "cgroups": ["/sys/fs/cgroup/sensor"],
+    "sampling_interval": 1.0,
+    "output_file": "/usr/local/bin/powerdaemon/measurement.jsonl",
+    # None: use the cached event catalog
+    "perf_event_file": None,
+    "retention_seconds": 3600,
+    "discovery": None,
+    "energy_source": "perf",
+    "sensor": "perf",
+    "adaptive": None,
+    "multiplex": "rotate",
+    "api_socket": "/run/powerdaemon/api.sock",
+    "rollups": None,
+    "record": None,
+    "account_self": True,
+    "self_cgroup": None,
+    "processes": None,
+    "sharding": "off",
+    "shared_memory": None,
+    "keep_warm": True,
+    "power_caps": None,
+}
 
 def load_config(config_file="config.yaml"):
     """
@@ -26,38 +74,153 @@ def load_config(config_file="config.yaml"):
     if not os.path.exists(config_file):
         raise FileNotFoundError(f"{config_file} not found")
 
+    # Only needed once at startup
+    import yaml
     with open(config_file) as f:
-        config = yaml.safe_load(f)
+        config = yaml.safe_load(f) or {}
+
+    # Single cgroup_path from older configs
+    if "cgroups" not in config and "cgroup_path" in config:
+        config["cgroups"] = [config["cgroup_path"]]
+    if isinstance(config.get("cgroups"), str):
+        config["cgroups"] = [config["cgroups"]]
 
-    # Defaults
-    cgroup = config.get("cgroup", "/sys/fs/cgroup/sensor")
-    interval = config.get("interval", 1.0)
-    output_file = config.get("output_file", "/usr/local/bin/powerdaemon/measurement.json")
+    # YAML reads a bare on/off as a boolean
+    if isinstance(config.get("sharding"), bool):
+        config["sharding"] = "on" if config["sharding"] else "off"
 
-    return cgroup, interval, output_file
+    return {**DEFAULT_CONFIG, **config}
 
-def start_sensor(interval, output_file):
+def start_sensor(config, cgroup_paths, catalog=None):
     """
     Starts the PerfSensor in a separate thread
     """
     global sensor_instance
-    sensor_instance = PerfSensor(interval_sec=interval, output_file=output_file)
+    # Back off toward max_interval while the cgroups are idle
+    adaptive = config["adaptive"] or {}
+    scheduling = {"max_interval": adaptive.get("max_interval"),
+                  "idle_threshold": adaptive.get("idle_threshold", 0.0)}
+    accounting = {"account_self": config["account_self"], "self_cgroup": config["self_cgroup"]}
+    # Per-process energy split inside each cgroup
+    processes = config["processes"] or {}
+    accounting["top_processes"] = processes.get("top", 0)
+    accounting["pid_budget"] = processes.get("pid_budget", PID_BUDGET)
+    if config["sensor"] == "cpustat":
+        # No PMU needed: cpu.stat CPU time plus RAPL energy
+        sensor_instance = CpuStatSensor(interval_sec=config["sampling_interval"],
+                                        cgroup_paths=cgroup_paths,
+                                        output_file=config["output_file"],
+                                        retention_sec=config["retention_seconds"],
+                                        recorder=recorder,
+                                        **scheduling, **accounting)
+    else:
+        sensor_instance = PerfSensor(interval_sec=config["sampling_interval"],
+                                     cgroup_paths=cgroup_paths,
+                                     output_file=config["output_file"],
+                                     event_file=config["perf_event_file"],
+                                     retention_sec=config["retention_seconds"],
+                                     energy_source=config["energy_source"],
+                                     catalog=catalog,
+                                     rotate=config["multiplex"] == "rotate",
+                                     recorder=recorder,
+                                     sharding=config["sharding"],
+                                     **scheduling, **accounting)
+    if power_capper:
+        # First, so throttling is not delayed by the other listeners
+        power_capper.reset()
+        sensor_instance.listeners.append(power_capper.update)
+    if api_server:
+        sensor_instance.listeners.append(api_server.publish)
+    if shm_publisher:
+        sensor_instance.listeners.append(shm_publisher.publish)
+    if rollup_store:
+        rollup_store.reset()
+        sensor_instance.listeners.append(rollup_store.add)
 
-    def run_sensor():
-        sensor_instance.read_counters()
-
-    t = Thread(target=run_sensor, daemon=True)
+    t = Thread(target=sensor_instance.read_counters, daemon=True)
     t.start()
     return t
 
+def update_sensor(config, cgroup_paths, watcher):
+    """
+    Start the sensor when the first cgroup gets a PID, stop it when all are empty.
+    With keep_warm the sensor is paused instead and resumed by the next PID.
+    """
+    global sensor_thread
+    with sensor_lock:
+        if watcher.is_populated():
+            if sensor_instance is None:
+                print("[*] PID detected, starting sensor...")
+                sensor_thread = start_sensor(config, cgroup_paths, catalog)
+            elif sensor_instance.paused:
+                print("[*] PID detected, resuming sensor...")
+                sensor_instance.resume()
+        elif watcher.is_empty() and sensor_instance is not None and not sensor_instance.paused:
+            if config["keep_warm"]:
+                print("[*] Cgroup empty, pausing sensor...")
+                sensor_instance.pause()
+            else:
+                print("[*] Cgroup empty, stopping sensor...")
+                stop_sensor()
+
+def attach_cgroup(config, path, watcher):
+    """
+    Add a discovered cgroup to the watcher and the running sensor
+    """
+    with sensor_lock:
+        if path in monitored_cgroups:
+            return
+        monitored_cgroups.append(path)
+        if sensor_instance is not None:
+            sensor_instance.add_cgroup(path)
+    try:
+        watcher.add(path)
+    except OSError as e:
+        print(f"[!] Cannot watch {path}: {e}")
+    update_sensor(config, monitored_cgroups, watcher)
+
+def detach_cgroup(config, path, watcher):
+    """
+    Drop a cgroup that went away or stopped matching the rules
+    """
+    with sensor_lock:
+        if path not in monitored_cgroups:
+            return
+        monitored_cgroups.remove(path)
+        if sensor_instance is not None:
+            sensor_instance.remove_cgroup(path)
+    watcher.remove(path)
+    update_sensor(config, monitored_cgroups, watcher)
+
+def query_history(start, end):
+    """
+    Range queries of the API: the running sensor's in-memory history
+    """
+    sensor = sensor_instance
+    return sensor.history(start, end) if sensor else []
+
+def sensor_stats():
+    """
+    Stats command of the API: the running sensor's own footprint
+    """
+    sensor = sensor_instance
+    return sensor.stats() if sensor else {}
+
 def stop_sensor():
     """
-    Stops the PerfSensor if running
+    Stops the PerfSensor if running and waits for its thread, so the last
+    sample has reached every listener (and the output file) before they
+    are closed
     """
-    global sensor_instance
+    global sensor_instance, sensor_thread
     if sensor_instance:
         sensor_instance.stop()
         sensor_instance = None
+    if sensor_thread:
+        sensor_thread.join(SENSOR_JOIN_TIMEOUT)
+        if sensor_thread.is_alive():
+            print(f"[!] Sensor thread still running after {SENSOR_JOIN_TIMEOUT:g}s")
+        sensor_thread = None
 
 def signal_handler(sig, frame):
     """
@@ -67,43 +230,92 @@ def signal_handler(sig, frame):
     running = False
     print("[*] Shutting down daemon...")
     stop_sensor()
+    if power_capper:
+        power_capper.close()
+    if api_server:
+        api_server.stop()
+    if shm_publisher:
+        shm_publisher.close()
+    if rollup_store:
+        rollup_store.close()
+    if recorder:
+        recorder.close()
     exit(0)
 
 def main():
-    global running, sensor_thread
+    global running, catalog, api_server, rollup_store, recorder, shm_publisher, power_capper
 
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
     # Load config
-    cgroup_path, interval, output_file = load_config()
+    config = load_config()
+    interval = config["sampling_interval"]
+    monitored_cgroups.extend(expand_cgroups(config["cgroups"]))
+    if not monitored_cgroups and not config["discovery"]:
+        raise FileNotFoundError(f"No cgroup matches {config['cgroups']}")
+
+    # Load (or build and cache) the event catalog once for every sensor start
+    if config["sensor"] == "perf" and not config["perf_event_file"]:
+        catalog = load_catalog()
+
+    print(f"[*] Monitoring {len(monitored_cgroups)} cgroups: {monitored_cgroups} with interval {interval}s")
+
+    if config["record"]:
+        recorder = Recorder(config["record"]).start()
+        print(f"[*] Recording raw inputs to {config['record']}")
+
+    # Bounded on-disk history: raw samples for a short window plus rollups
+    rollups = config["rollups"]
+    if rollups:
+        rollup_store = RollupStore(rollups.get("directory", "/var/lib/powerdaemon"),
+                                   retention=rollups.get("retention"),
+                                   interval=interval).start()
+
+    if config["api_socket"]:
+        api_server = ApiServer(config["api_socket"], history=query_history,
+                               rollups=rollup_store.query if rollup_store else None,
+                               stats=sensor_stats).start()
+
+    caps = config["power_caps"]
+    if caps:
+        power_capper = PowerCapper(caps.get("budgets"), default=caps.get("default"),
+                                   hysteresis=caps.get("hysteresis", HYSTERESIS),
+                                   engage_ticks=caps.get("engage_ticks", ENGAGE_TICKS),
+                                   min_cpus=caps.get("min_cpus", MIN_CPUS))
+        print(f"[*] Enforcing power budgets {power_capper.budgets}, default {power_capper.default}")
+
+    shared = config["shared_memory"]
+    if shared:
+        shm_publisher = ShmPublisher(shared.get("path", SHM_PATH),
+                                     history=shared.get("history", HISTORY)).start()
+        print(f"[*] Publishing samples to {shm_publisher.path}")
 
-    # Check for pc_info.json, run init if missing
-    if not os.path.exists("pc_info.json"):
-        print("[*] pc_info.json not found, running init...")
-        init_obj = PerfInitializer()
-        init_obj.run()  # or whatever method populates pc_info.json
+    # One sensor covers every cgroup; it runs while any of them has PIDs.
+    # The watcher thread calls back within milliseconds of a change.
+    def on_change(path):
+        if recorder:
+            recorder.cgroup_event(path, watcher.is_populated(path))
+        update_sensor(config, monitored_cgroups, watcher)
 
-    print(f"[*] Monitoring cgroup: {cgroup_path} with interval {interval}s")
+    watcher = CgroupWatcher(monitored_cgroups, on_pid_added=on_change, on_empty=on_change)
+    watcher.start()
 
-    watcher = CgroupWatcher(cgroup_path)
-    sensor_active = False
+    # Attach/detach cgroups under a subtree as they come and go
+    rules = config["discovery"]
+    if rules:
+        discovery = CgroupDiscovery(root=rules.get("root", "/sys/fs/cgroup"),
+                                    include=rules.get("include", ["*"]),
+                                    exclude=rules.get("exclude", []),
+                                    on_attach=lambda path: attach_cgroup(config, path, watcher),
+                                    on_detach=lambda path: detach_cgroup(config, path, watcher))
+        discovery.start()
+        print(f"[*] Discovery holds {discovery.watch_count} watches, "
+              f"{len(discovery.attached)} cgroups attached")
 
     while running:
-        events = watcher.check_events(timeout=1)
-        cgroup_empty = watcher.is_empty()
-
-        if not cgroup_empty and not sensor_active:
-            print("[*] PID detected, starting sensor...")
-            sensor_thread = start_sensor(interval, output_file)
-            sensor_active = True
-        elif cgroup_empty and sensor_active:
-            print("[*] Cgroup empty, stopping sensor...")
-            stop_sensor()
-            sensor_active = False
-
-        time.sleep(0.1)
+        signal.pause()
 
 if __name__ == "__main__":
     main()
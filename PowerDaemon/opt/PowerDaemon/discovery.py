@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+discovery.py - Recursive cgroup discovery with include/exclude rules
+
+Walks the cgroup hierarchy once, then keeps one inotify watch per cgroup
+directory and updates them incrementally: a new directory costs a scan of
+that directory's subtree only, a removed one drops its own watches. Every
+cgroup whose name (path relative to the root) matches an include pattern
+and no exclude pattern is attached through on_attach and detached through
+on_detach when it goes away.
+"""
+
+import fnmatch
+import os
+import threading
+
+from cgroups import CGROUP_ROOT, cgroup_name
+from notify import (Inotify, EventLoop, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO,
+                    IN_DELETE_SELF, IN_ONLYDIR, IN_ISDIR, IN_IGNORED, IN_Q_OVERFLOW)
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+
+
+class CgroupDiscovery:
+    """
+    Keeps track of every cgroup below root and the subset that matches the rules.
+
+    Patterns are fnmatch globs on the cgroup name, e.g. 'system.slice/*.service'
+    or 'kubepods.slice/*' ('*' also matches '/', so the latter covers the
+    whole kubepods subtree).
+    """
+    def __init__(self, root=CGROUP_ROOT, include=("*",), exclude=(), on_attach=None,
+                 on_detach=None, cgroup_root=None):
+        self.root = os.path.normpath(root)
+        # Names are relative to the cgroup mount even when discovery starts lower
+        self.cgroup_root = cgroup_root or (CGROUP_ROOT if self.root.startswith(CGROUP_ROOT) else self.root)
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        self.attached = set()
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+        # {path: set of child directory names}, for subtree removal
+        self._children = {}
+        self._lock = threading.Lock()
+        self._stop_flag = threading.Event()
+        self._thread = None
+        self._inotify = Inotify()
+        self._loop = EventLoop(self._inotify)
+
+    @property
+    def watch_count(self):
+        """Number of inotify watches currently held."""
+        return len(self._wd_to_path)
+
+    def matches(self, path):
+        name = cgroup_name(path, self.cgroup_root)
+        if not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.exclude)
+
+    def _add_tree(self, top):
+        """Watch and attach top and everything below it."""
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if path in self._path_to_wd:
+                continue
+            try:
+                # Watch before listing so children created meanwhile are not missed
+                wd = self._inotify.add_watch(path, WATCH_MASK)
+            except OSError:
+                # Removed already, or not a directory
+                continue
+            self._wd_to_path[wd] = path
+            self._path_to_wd[path] = wd
+            children = self._children.setdefault(path, set())
+            parent = os.path.dirname(path)
+            if path != self.root and parent in self._children:
+                self._children[parent].add(os.path.basename(path))
+            if path != self.root and self.matches(path) and path not in self.attached:
+                self.attached.add(path)
+                if self.on_attach:
+                    self.on_attach(path)
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            children.add(entry.name)
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def _remove_tree(self, top):
+        """Drop watches and detach top and everything below it."""
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            for child in self._children.pop(path, ()):
+                stack.append(os.path.join(path, child))
+            wd = self._path_to_wd.pop(path, None)
+            if wd is not None:
+                self._wd_to_path.pop(wd, None)
+                self._inotify.rm_watch(wd)
+            if path in self.attached:
+                self.attached.discard(path)
+                if self.on_detach:
+                    self.on_detach(path)
+        parent = os.path.dirname(top)
+        if parent in self._children:
+            self._children[parent].discard(os.path.basename(top))
+
+    def scan(self):
+        """Initial walk of the whole hierarchy."""
+        with self._lock:
+            self._add_tree(self.root)
+        return self
+
+    def resync(self):
+        """
+        Full rescan after an inotify queue overflow: attach what is new,
+        detach what disappeared.
+        """
+        with self._lock:
+            seen = set()
+            for dirpath, dirnames, _ in os.walk(self.root):
+                seen.add(os.path.normpath(dirpath))
+            for path in [p for p in self._path_to_wd if p not in seen]:
+                if path in self._path_to_wd:
+                    self._remove_tree(path)
+            for path in sorted(seen - set(self._path_to_wd)):
+                self._add_tree(path)
+
+    def check_events(self, timeout=-1):
+        """Wait up to timeout seconds for directory changes and apply them."""
+        events = self._loop.wait(timeout)
+        overflow = False
+        with self._lock:
+            for wd, mask, _, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                parent = self._wd_to_path.get(wd)
+                if parent is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_IGNORED):
+                    if parent in self._path_to_wd:
+                        self._remove_tree(parent)
+                    continue
+                if not mask & IN_ISDIR:
+                    continue
+                path = os.path.join(parent, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove_tree(path)
+        if overflow:
+            self.resync()
+
+    def start(self):
+        """Scan (if not done yet) and follow changes in a separate thread."""
+        if not self._path_to_wd:
+            self.scan()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop_flag.is_set():
+            self.check_events()
+
+    def stop(self):
+        self._stop_flag.set()
+        self._loop.wake()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self._loop.close()
+        self._inotify.close()
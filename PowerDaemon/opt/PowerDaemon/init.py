@@ -24,7 +24,6 @@ class PerfInitializer:
     """
     def __init__(self, output_file=PC_INFO_FILE):
         self.pc_info_file = output_file
-        os.makedirs(os.path.dirname(self.pc_info_file), exist_ok=True)
 
         # Load libpfm4
         try:
@@ -49,9 +48,9 @@ class PerfInitializer:
             ]
         self.pfm_event_info = pfm_event_info
 
-    def collect_perf_events(self):
+    def collect_events(self):
         """
-        Collect all available perf events and write to JSON file.
+        All available perf events as a list of {"Name", "Type", "Description"}.
         """
         event_count = self.lib.pfm_get_event_count()
         print(f"[*] Found {event_count} PMU events via libpfm4")
@@ -78,21 +77,29 @@ class PerfInitializer:
                 "Description": desc
             }
 
+        # Terminate libpfm4
+        self.lib.pfm_terminate()
+        return list(events.values())
+
+    def collect_perf_events(self):
+        """
+        Collect all available perf events and write to JSON file.
+        """
+        events = self.collect_events()
+
         # Save events into both system and group lists
         events_by_category = {
-            "system": list(events.values()),
-            "group": list(events.values())
+            "system": events,
+            "group": events
         }
 
         # Write JSON
+        os.makedirs(os.path.dirname(self.pc_info_file), exist_ok=True)
         with open(self.pc_info_file, "w") as f:
             json.dump(events_by_category, f, indent=2)
 
         print(f"[*] Saved {len(events)} perf events to {self.pc_info_file}")
 
-        # Terminate libpfm4
-        self.lib.pfm_terminate()
-
     def is_pc_info_populated(self):
         """
         Quick check if JSON file exists and has events.
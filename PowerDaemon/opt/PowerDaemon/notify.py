@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+notify.py - Minimal inotify binding for epoll-driven watchers
+
+Exposes the inotify fd so it can sit in a select.epoll set next to a
+wakeup pipe; nothing here sleeps or polls on a timer.
+"""
+
+import ctypes
+import os
+import select
+import struct
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """
+    One inotify instance; read_events() returns (wd, mask, cookie, name).
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        # The kernel drops watches of deleted files itself (IN_IGNORED)
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Drain every queued event without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class EventLoop:
+    """
+    epoll over an Inotify instance plus a wakeup pipe, so another thread
+    can interrupt wait() immediately (e.g. to stop the watcher).
+    """
+    def __init__(self, inotify):
+        self.inotify = inotify
+        self.epoll = select.epoll()
+        self._wake_r, self._wake_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.epoll.register(inotify.fileno(), select.EPOLLIN)
+        self.epoll.register(self._wake_r, select.EPOLLIN)
+
+    def wait(self, timeout=-1):
+        """
+        Block until inotify events arrive or wake() is called; returns the
+        drained events (empty when woken or timed out).
+        """
+        ready = self.epoll.poll(timeout)
+        for fd, _ in ready:
+            if fd == self._wake_r:
+                try:
+                    os.read(self._wake_r, 4096)
+                except BlockingIOError:
+                    pass
+        return self.inotify.read_events()
+
+    def wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.epoll.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+overhead.py - PowerDaemon's own footprint
+
+Measured every tick and added to the record under "overhead":
+
+    cpu          CPU seconds the daemon used since the previous tick (all
+                 threads, from getrusage(), or its own cgroup's cpu.stat,
+                 which also covers perf child processes)
+    cpu_share    cpu / wall seconds, i.e. fraction of one CPU
+    wakeups      voluntary context switches per second (every sleep of
+                 every thread ends in a wakeup)
+    energy_share cpu / CPU time of the whole system (root cgroup cpu.stat)
+    joules       package energy times energy_share, the daemon's estimated
+                 own energy; attribution can subtract it (exclude_self)
+    latency_us   last duration of each pipeline stage
+
+Stage latencies also go into log2 histograms, served in full by stats().
+"""
+
+import os
+import resource
+import time
+
+from cgroups import CGROUP_ROOT
+from cpustat import CpuStatFile
+from power import PKG
+
+# Pipeline stages timed per tick: counter read, turning values into the
+# record, listeners (API power split, rollups) and queueing for the writer
+STAGES = ("read", "parse", "attribute", "write")
+
+# Histogram buckets: [0, 1) us, [1, 2) us, [2, 4) us, ... up to ~16 s
+BUCKETS = 25
+
+
+class LatencyHistogram:
+    """Log2 histogram of durations; add() is a few integer operations."""
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.last = seconds
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.counts[min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, fraction):
+        """Upper bound (seconds) of the bucket holding the given fraction, at most max."""
+        target = fraction * self.count()
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min((1 << bucket) / 1e6, self.max)
+        return 0.0
+
+    def to_dict(self):
+        n = self.count()
+        return {"count": n, "mean_us": self.total / n * 1e6 if n else 0.0,
+                "p50_us": self.percentile(0.5) * 1e6, "p99_us": self.percentile(0.99) * 1e6,
+                "max_us": self.max * 1e6,
+                # Bucket i counts durations below 2**i us
+                "buckets": self.counts}
+
+
+def own_cgroup(proc_cgroup="/proc/self/cgroup", root=CGROUP_ROOT):
+    """Path of the cgroup v2 this process runs in, None if unknown."""
+    try:
+        with open(proc_cgroup) as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return os.path.join(root, line[3:].strip().lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+class Overhead:
+    """
+    Tracks the daemon's CPU time, wakeups and stage latencies.
+
+    self_cgroup: cgroup whose cpu.stat is the daemon's CPU time ("auto" for
+    the one it runs in); None uses getrusage() of this process.
+    system_cgroup: whose cpu.stat is the whole system's CPU time.
+    """
+    def __init__(self, self_cgroup=None, system_cgroup=CGROUP_ROOT, clock=time.monotonic):
+        self.clock = clock
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        if self_cgroup == "auto":
+            self_cgroup = own_cgroup()
+        self.self_stat = self._open_stat(self_cgroup) if self_cgroup else None
+        self.system_stat = self._open_stat(system_cgroup) if system_cgroup else None
+        self.cpu_total = 0.0
+        self.wakeups_total = 0
+        self.samples = 0
+        self.start = clock()
+        self._prev_time = self.start
+        self._prev_cpu, self._prev_wakeups = self._rusage()
+
+    @staticmethod
+    def _open_stat(path):
+        try:
+            return CpuStatFile(path).open()
+        except OSError as e:
+            print(f"[!] Cannot read {path}/cpu.stat for overhead accounting: {e}")
+            return None
+
+    @staticmethod
+    def _rusage():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime, usage.ru_nvcsw
+
+    def add(self, stage, seconds):
+        self.stages[stage].add(seconds)
+
+    def sample(self, record=None):
+        """
+        The "overhead" entry for one record: CPU, wakeups and energy since
+        the previous call. record supplies the package energy for joules.
+        """
+        now = self.clock()
+        elapsed = now - self._prev_time
+        self._prev_time = now
+        cpu_time, wakeups = self._rusage()
+        if self.self_stat:
+            cpu = self.self_stat.read()[0] / 1e6
+        else:
+            cpu = cpu_time - self._prev_cpu
+        woken = wakeups - self._prev_wakeups
+        self._prev_cpu, self._prev_wakeups = cpu_time, wakeups
+        self.cpu_total += cpu
+        self.wakeups_total += woken
+        self.samples += 1
+
+        entry = {"cpu": cpu, "cpu_share": cpu / elapsed if elapsed > 0 else 0.0,
+                 "wakeups": woken / elapsed if elapsed > 0 else 0.0}
+        if self.system_stat:
+            system_cpu = self.system_stat.read()[0] / 1e6
+            share = min(1.0, cpu / system_cpu) if system_cpu > 0 else 0.0
+            entry["energy_share"] = share
+            energy = record.get("system", {}).get(PKG) if record else None
+            if energy is not None:
+                entry["joules"] = energy * share
+        entry["latency_us"] = {stage: hist.last * 1e6 for stage, hist in self.stages.items()}
+        return entry
+
+    def stats(self):
+        """Totals since start and the full stage histograms."""
+        elapsed = self.clock() - self.start
+        return {"uptime": elapsed, "samples": self.samples, "cpu": self.cpu_total,
+                "cpu_share": self.cpu_total / elapsed if elapsed > 0 else 0.0,
+                "wakeups_per_sec": self.wakeups_total / elapsed if elapsed > 0 else 0.0,
+                "stages": {stage: hist.to_dict() for stage, hist in self.stages.items()}}
+
+    def close(self):
+        for stat in (self.self_stat, self.system_stat):
+            if stat:
+                stat.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+perf_csv.py - Parser for machine-readable `perf stat -x, -I <ms>` output
+
+Lines are grouped into intervals by their timestamp field rather than by
+counting lines, so a missing or extra line cannot shift later intervals.
+<not counted>, <not supported> and multiplexed (partially running)
+counters are reported explicitly through the record's "coverage" field.
+"""
+
+from shards import socket_event
+
+# perf stat -x field separator used by the collector
+SEPARATOR = ","
+
+NOT_COUNTED = "<not counted>"
+NOT_SUPPORTED = "<not supported>"
+
+
+class PerfCsvParser:
+    """
+    Incremental parser for `perf stat -I <ms> -x,` stderr.
+
+    Without cgroups a line is
+        timestamp,value,unit,event,run_time,pct_running[,metric,metric_unit]
+    and with --for-each-cgroup the cgroup follows the event:
+        timestamp,value,unit,event,cgroup,run_time,pct_running[,...]
+    With --per-socket the socket and its number of CPUs follow the timestamp:
+        timestamp,S1,cpus,value,unit,event,...
+    and every event is stored per socket ("<event>@1", see shards.py) and
+    summed under its own name.
+
+    Records have the collector's layout, {"timestamp": t, scope: {event: value}},
+    where scope is `scope` (e.g. "system") or the cgroup name, plus
+    "coverage": {scope: {event: fraction of the interval counted}} for the
+    events that were not counted for the whole interval.
+    """
+    def __init__(self, cgroups=False, scope="system", separator=SEPARATOR):
+        self.cgroups = cgroups
+        self.scope = scope
+        self.separator = separator
+        # Events perf reported as <not supported>; they never get a value
+        self.unsupported = set()
+        self.lines = 0
+        self._timestamp = None
+        self._record = None
+        # Cache of pct_running field -> fraction
+        self._pcts = {}
+
+    def feed_lines(self, lines):
+        """
+        Parse a batch of lines and return the records of every interval
+        that was completed by them. State carries over between calls.
+        """
+        done = []
+        sep = self.separator
+        cgroups = self.cgroups
+        default_scope = self.scope
+        # Field of the pct_running column (after the cgroup with --for-each-cgroup)
+        pct_field = 6 if cgroups else 5
+        unsupported = self.unsupported
+        pcts = self._pcts
+        timestamp = self._timestamp
+        record = self._record
+        coverage = record["coverage"] if record is not None else None
+        # perf prints a scope's events together: keep its dicts at hand
+        scope = values = marks = None
+        count = 0
+        for line in lines:
+            fields = line.split(sep, 7)
+            if len(fields) < 5 or line[0] == "#":
+                continue
+            value = fields[1]
+            kind = value[:1]
+            socket = None
+            if kind == "S":
+                # --per-socket: drop the socket and CPU count columns
+                fields = line.split(sep, 9)
+                socket = value[1:]
+                del fields[1:3]
+                value = fields[1]
+                kind = value[:1]
+            count += 1
+            if fields[0] != timestamp:
+                if record is not None:
+                    done.append(record)
+                timestamp = fields[0]
+                coverage = {}
+                record = {"timestamp": float(timestamp), "coverage": coverage}
+                scope = None
+
+            line_scope = fields[4] if cgroups else default_scope
+            if line_scope != scope:
+                scope = line_scope
+                values = record.get(scope)
+                if values is None:
+                    values = record[scope] = {}
+                    marks = coverage[scope] = {}
+                else:
+                    marks = coverage[scope]
+            event = fields[3]
+            if kind == "<":
+                if value == NOT_SUPPORTED:
+                    unsupported.add(event)
+                    continue
+                # <not counted>: the counter never ran this interval
+                if socket is not None:
+                    values.setdefault(event, 0.0)
+                    marks[event] = 0.0
+                    event = socket_event(event, socket)
+                values[event] = 0.0
+                marks[event] = 0.0
+                continue
+            # perf prints the share of the interval the counter ran and has
+            # already scaled the value by it; only partial coverage is stored
+            pct = fields[pct_field] if len(fields) > pct_field else ""
+            share = pcts.get(pct)
+            if share is None:
+                share = pcts[pct] = float(pct) / 100.0 if pct.strip() else 1.0
+            if socket is not None:
+                values[event] = values.get(event, 0.0) + float(value)
+                if share < marks.get(event, 1.0):
+                    marks[event] = share
+                event = socket_event(event, socket)
+            values[event] = float(value)
+            if share != 1.0:
+                marks[event] = share
+        self.lines += count
+        self._timestamp = timestamp
+        self._record = record
+        return done
+
+    def feed(self, line):
+        """
+        Parse one line. Returns the previous interval's record when this
+        line starts a new interval, otherwise None.
+        """
+        done = self.feed_lines((line.strip(),))
+        return done[0] if done else None
+
+    def flush(self):
+        """Return the last, still open interval (if any)."""
+        done = self._record
+        self._record = None
+        self._timestamp = None
+        return done
+
+    def parse(self, lines):
+        """
+        Yield one record per interval from an iterable of lines (e.g. a
+        perf stderr pipe); each record is yielded as soon as the next
+        interval starts.
+        """
+        feed_lines = self.feed_lines
+        for line in lines:
+            yield from feed_lines((line.strip(),))
+        record = self.flush()
+        if record is not None:
+            yield record
+
+
+def merge_records(sysrec, cgrec):
+    """
+    Merge the system and cgroup records of one interval.
+    """
+    if sysrec is None:
+        return cgrec
+    if cgrec is None:
+        return sysrec
+    coverage = {**sysrec["coverage"], **cgrec["coverage"]}
+    merged = {**sysrec, **cgrec}
+    merged["timestamp"] = sysrec["timestamp"]
+    merged["coverage"] = coverage
+    return merged
+
+
+def stat_command(events, interval_ms, cgroups=None, duration=None, per_socket=False):
+    """
+    Build the `perf stat` command line for CSV interval output.
+    """
+    cmd = ["perf", "stat", "-x", SEPARATOR, "-I", str(interval_ms), "-a", "-e", ",".join(events)]
+    if per_socket:
+        cmd.append("--per-socket")
+    if cgroups:
+        cmd += ["--for-each-cgroup", ",".join(cgroups)]
+    if duration is not None:
+        cmd += ["sleep", str(duration)]
+    return cmd
@@ -0,0 +1,730 @@
+#!/usr/bin/env python3
+"""
+perf_event.py - Native perf_event_open counters for PowerDaemon
+
+Opens system-wide and per-cgroup counters once, packs them into event
+groups and reads every group with a single read() using
+PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING.
+The syscalls go through a backend object so a fake backend can be used
+on machines without a PMU.
+
+Groups are sized to what the PMU can actually schedule: events are added to
+a trial group until the kernel rejects it (EINVAL from its group
+validation), up to MAX_GROUP_SIZE. When one PMU needs several groups they
+are either left to the kernel's multiplexing or, with rotate=True, enabled
+one slot per interval in round-robin order. Every value comes with a
+coverage figure (time_running / time_enabled, 0 for a slot that was not
+counted this interval, whose value is then extrapolated from its last
+measured rate).
+"""
+
+import ctypes
+import errno
+import fcntl
+import os
+import platform
+import struct
+import time
+
+# Where the kernel exposes PMUs, their types, events and formats
+SYSFS_PMU_PATH = "/sys/bus/event_source/devices"
+ONLINE_CPUS_FILE = "/sys/devices/system/cpu/online"
+
+# perf_event_attr.type
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+
+# perf_event_attr.read_format
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_ID = 1 << 2
+PERF_FORMAT_GROUP = 1 << 3
+READ_FORMAT = PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+
+# perf_event_attr flag bits
+ATTR_DISABLED = 1 << 0
+ATTR_INHERIT = 1 << 1
+
+# perf_event_open flags
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+PERF_FLAG_PID_CGROUP = 1 << 2
+
+# ioctls (_IO('$', n))
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_EVENT_IOC_RESET = 0x2403
+PERF_IOC_FLAG_GROUP = 1
+
+# __NR_perf_event_open per architecture
+PERF_EVENT_OPEN_NR = {
+    "x86_64": 298,
+    "i386": 336,
+    "i686": 336,
+    "aarch64": 241,
+    "riscv64": 241,
+    "armv7l": 364,
+    "ppc64le": 319,
+    "s390x": 331,
+}
+
+# Generic event names perf accepts without a PMU prefix
+HARDWARE_EVENTS = {
+    "cycles": 0,
+    "cpu-cycles": 0,
+    "instructions": 1,
+    "cache-references": 2,
+    "cache-misses": 3,
+    "branches": 4,
+    "branch-instructions": 4,
+    "branch-misses": 5,
+    "bus-cycles": 6,
+    "stalled-cycles-frontend": 7,
+    "stalled-cycles-backend": 8,
+    "ref-cycles": 9,
+}
+SOFTWARE_EVENTS = {
+    "cpu-clock": 0,
+    "task-clock": 1,
+    "page-faults": 2,
+    "context-switches": 3,
+    "cpu-migrations": 4,
+    "minor-faults": 5,
+    "major-faults": 6,
+}
+
+# Opened instead when no requested event can be opened (no PMU, VM, ...)
+SOFTWARE_FALLBACK = ["cpu-clock", "task-clock"]
+
+# Upper bound on events per group; the PMU's own limit is probed at open
+MAX_GROUP_SIZE = 8
+
+
+class PerfEventAttr(ctypes.Structure):
+    """
+    struct perf_event_attr (PERF_ATTR_SIZE_VER8).
+    """
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+        ("aux_sample_size", ctypes.c_uint32),
+        ("reserved_3", ctypes.c_uint32),
+        ("sig_data", ctypes.c_uint64),
+        ("config3", ctypes.c_uint64),
+    ]
+
+
+class PerfEvent:
+    """
+    A resolved event: what to put in perf_event_attr and where to open it.
+    """
+    def __init__(self, name, pmu, type_, config, config1=0, config2=0, scale=1.0, cpus=None):
+        self.name = name
+        self.pmu = pmu
+        self.type = type_
+        self.config = config
+        self.config1 = config1
+        self.config2 = config2
+        self.scale = scale
+        # None means "every online CPU"
+        self.cpus = cpus
+
+    def attr(self, leader=True):
+        """
+        Build the perf_event_attr for this event.
+        """
+        attr = PerfEventAttr()
+        attr.size = ctypes.sizeof(PerfEventAttr)
+        attr.type = self.type
+        attr.config = self.config
+        attr.config1 = self.config1
+        attr.config2 = self.config2
+        attr.read_format = READ_FORMAT
+        # Only the leader starts disabled, the group is enabled through it
+        attr.flags = ATTR_DISABLED if leader else 0
+        return attr
+
+    def __repr__(self):
+        return f"PerfEvent({self.name!r}, type={self.type}, config={self.config:#x})"
+
+
+def parse_cpu_list(text):
+    """
+    Parse a kernel cpu list such as '0-3,8,10-11'.
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class EventResolver:
+    """
+    Turns perf event names ('cpu_core/instructions/', 'power/energy-pkg/',
+    'cpu-clock', 'cpu_core/event=0xc0,umask=0x0/') into PerfEvent objects
+    using the PMU descriptions in sysfs.
+    """
+    def __init__(self, sysfs_root=SYSFS_PMU_PATH, online_cpus_file=ONLINE_CPUS_FILE):
+        self.sysfs_root = sysfs_root
+        self.online_cpus_file = online_cpus_file
+        self._pmus = {}
+
+    def online_cpus(self):
+        text = _read_text(self.online_cpus_file)
+        if text is None:
+            return list(range(os.cpu_count() or 1))
+        return parse_cpu_list(text)
+
+    def _pmu(self, pmu):
+        """
+        Cached per-PMU info: type, cpus and format fields.
+        """
+        if pmu in self._pmus:
+            return self._pmus[pmu]
+        base = os.path.join(self.sysfs_root, pmu)
+        type_text = _read_text(os.path.join(base, "type"))
+        if type_text is None:
+            raise ValueError(f"unknown PMU '{pmu}'")
+        # Uncore/RAPL PMUs list one CPU per package in cpumask,
+        # hybrid core PMUs list the CPUs they cover in cpus
+        cpus = None
+        for name in ("cpumask", "cpus"):
+            text = _read_text(os.path.join(base, name))
+            if text:
+                cpus = parse_cpu_list(text)
+                break
+        formats = {}
+        fmt_dir = os.path.join(base, "format")
+        if os.path.isdir(fmt_dir):
+            for field in os.listdir(fmt_dir):
+                formats[field] = _read_text(os.path.join(fmt_dir, field))
+        info = {"type": int(type_text), "cpus": cpus, "formats": formats, "base": base}
+        self._pmus[pmu] = info
+        return info
+
+    @staticmethod
+    def _apply_term(values, fmt, value):
+        """
+        Place a term value into config/config1/config2 following a sysfs
+        format string such as 'config:0-7' or 'config:0-7,21'.
+        """
+        target, bits = fmt.split(":")
+        shift = 0
+        for part in bits.split(","):
+            if "-" in part:
+                lo, hi = (int(b) for b in part.split("-"))
+            else:
+                lo = hi = int(part)
+            width = hi - lo + 1
+            values[target] |= ((value >> shift) & ((1 << width) - 1)) << lo
+            shift += width
+
+    def _encode(self, pmu_info, terms):
+        values = {"config": 0, "config1": 0, "config2": 0}
+        for term in terms.split(","):
+            term = term.strip()
+            if not term:
+                continue
+            key, _, raw = term.partition("=")
+            fmt = pmu_info["formats"].get(key)
+            if fmt is None:
+                # period=, name= etc. are not part of the config
+                continue
+            self._apply_term(values, fmt, int(raw, 0) if raw else 1)
+        return values
+
+    def resolve(self, name):
+        """
+        Resolve one event name, raising ValueError when it is unknown.
+        """
+        if name in SOFTWARE_EVENTS:
+            return PerfEvent(name, "software", PERF_TYPE_SOFTWARE, SOFTWARE_EVENTS[name])
+        if name in HARDWARE_EVENTS:
+            return PerfEvent(name, "cpu", PERF_TYPE_HARDWARE, HARDWARE_EVENTS[name])
+
+        parts = name.strip("/").split("/", 1)
+        if len(parts) != 2:
+            raise ValueError(f"cannot resolve event '{name}'")
+        pmu, event = parts
+        info = self._pmu(pmu)
+
+        scale = 1.0
+        if "=" in event:
+            # Raw encoding, e.g. cpu_core/event=0xd0,umask=0x83/
+            terms = event
+        else:
+            terms = _read_text(os.path.join(info["base"], "events", event))
+            if terms is None:
+                raise ValueError(f"event '{event}' not found on PMU '{pmu}'")
+            scale_text = _read_text(os.path.join(info["base"], "events", f"{event}.scale"))
+            if scale_text:
+                scale = float(scale_text)
+        values = self._encode(info, terms)
+        return PerfEvent(name, pmu, info["type"], values["config"], values["config1"],
+                         values["config2"], scale=scale, cpus=info["cpus"])
+
+
+class LinuxPerfBackend:
+    """
+    Real backend: perf_event_open(2) through libc syscall().
+    """
+    def __init__(self):
+        nr = PERF_EVENT_OPEN_NR.get(platform.machine())
+        if nr is None:
+            raise RuntimeError(f"perf_event_open not known for {platform.machine()}")
+        self.nr = nr
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.libc.syscall.restype = ctypes.c_long
+        # Probed group sizes, shared by every CounterSet using this backend
+        self.group_limits = {}
+
+    def open(self, attr, pid, cpu, group_fd, flags):
+        fd = self.libc.syscall(self.nr, ctypes.byref(attr), ctypes.c_int(pid), ctypes.c_int(cpu),
+                               ctypes.c_int(group_fd), ctypes.c_ulong(flags | PERF_FLAG_FD_CLOEXEC))
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return fd
+
+    def read(self, fd, size):
+        return os.read(fd, size)
+
+    def ioctl(self, fd, request, arg=0):
+        fcntl.ioctl(fd, request, arg)
+
+    def close(self, fd):
+        os.close(fd)
+
+
+class FakePerfBackend:
+    """
+    In-memory backend for machines without a PMU.
+
+    Every read advances each counter by its rate (counts per read, keyed by
+    (type, config) or by type), time_enabled by tick_ns and time_running by
+    tick_ns * running_ratio. Types listed in unsupported_types fail to open
+    with ENOENT, the way a missing PMU does. counters ({type: n}) limits the
+    group size per PMU type (EINVAL beyond it) and makes enabled groups of
+    the same PMU and CPU share time_running, like kernel multiplexing.
+    """
+    def __init__(self, rates=None, default_rate=1000, tick_ns=1000000,
+                 running_ratio=1.0, unsupported_types=(), counters=None):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.tick_ns = tick_ns
+        self.running_ratio = running_ratio
+        self.unsupported_types = set(unsupported_types)
+        self.counters = counters or {}
+        self.events = {}
+        self.group_limits = {}
+        self.reads = 0
+        self._next_fd = 1000
+
+    def _rate(self, attr):
+        key = (attr.type, attr.config)
+        if key in self.rates:
+            return self.rates[key]
+        return self.rates.get(attr.type, self.default_rate)
+
+    def open(self, attr, pid, cpu, group_fd, flags):
+        if attr.type in self.unsupported_types:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+        if group_fd != -1 and group_fd not in self.events:
+            raise OSError(errno.EBADF, os.strerror(errno.EBADF))
+        limit = self.counters.get(attr.type)
+        if limit and group_fd != -1 and len(self.events[group_fd]["members"]) + 1 >= limit:
+            # Group no longer fits the PMU's counters
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        fd = self._next_fd
+        self._next_fd += 1
+        self.events[fd] = {
+            "attr": attr, "pid": pid, "cpu": cpu, "flags": flags,
+            "leader": fd if group_fd == -1 else group_fd, "members": [],
+            "value": 0, "enabled": 0, "running": 0, "on": not (attr.flags & ATTR_DISABLED),
+        }
+        if group_fd != -1:
+            self.events[group_fd]["members"].append(fd)
+        return fd
+
+    def _share(self, leader):
+        """Fraction of time a group runs while sharing its PMU's counters."""
+        if leader["attr"].type not in self.counters:
+            return 1.0
+        key = (leader["attr"].type, leader["cpu"], leader["pid"])
+        active = sum(1 for fd, ev in self.events.items()
+                     if ev["leader"] == fd and ev["on"]
+                     and (ev["attr"].type, ev["cpu"], ev["pid"]) == key)
+        return 1.0 / max(1, active)
+
+    def read(self, fd, size):
+        self.reads += 1
+        leader = self.events[fd]
+        group = [fd] + leader["members"]
+        if leader["on"]:
+            ratio = self.running_ratio * self._share(leader)
+            leader["enabled"] += self.tick_ns
+            leader["running"] += int(self.tick_ns * ratio)
+            for member in group:
+                ev = self.events[member]
+                ev["value"] += int(self._rate(ev["attr"]) * ratio)
+        values = [self.events[m]["value"] for m in group]
+        return struct.pack(f"<{3 + len(values)}Q", len(values), leader["enabled"],
+                           leader["running"], *values)
+
+    def ioctl(self, fd, request, arg=0):
+        group = [fd] + self.events[fd]["members"] if arg & PERF_IOC_FLAG_GROUP else [fd]
+        for member in group:
+            ev = self.events[member]
+            if request == PERF_EVENT_IOC_ENABLE:
+                ev["on"] = True
+            elif request == PERF_EVENT_IOC_DISABLE:
+                ev["on"] = False
+            elif request == PERF_EVENT_IOC_RESET:
+                ev["value"] = 0
+
+    def close(self, fd):
+        ev = self.events.pop(fd, None)
+        if ev and ev["leader"] != fd and ev["leader"] in self.events:
+            self.events[ev["leader"]]["members"].remove(fd)
+
+
+def default_backend():
+    return LinuxPerfBackend()
+
+
+class CounterGroup:
+    """
+    One event group on one CPU: a leader fd plus members, read in one go.
+    """
+    def __init__(self, cpu, events, fds):
+        self.cpu = cpu
+        self.events = events
+        self.fds = fds
+        self.leader = fds[0]
+        self.read_size = 8 * (3 + len(fds))
+        self._unpack = struct.Struct(f"<{3 + len(fds)}Q").unpack_from
+        self.prev = None
+        # Rotation slot (the group's index among its PMU's groups)
+        self.slot = 0
+        # Filled in by CounterSet.open()
+        self.columns = []
+
+    def sample(self, backend):
+        """
+        Read the group and return (values, enabled, running) deltas since
+        the previous call.
+        """
+        raw = self._unpack(backend.read(self.leader, self.read_size))
+        prev = self.prev
+        self.prev = raw
+        if prev is None:
+            return raw[3:], raw[1], raw[2]
+        return ([cur - old for cur, old in zip(raw[3:], prev[3:])],
+                raw[1] - prev[1], raw[2] - prev[2])
+
+
+class CounterSet:
+    """
+    A set of events opened system-wide (cgroup_fd=-1) or for one cgroup.
+
+    Events are packed per PMU into the largest groups the PMU accepts and
+    opened on every CPU the PMU covers; read() returns per-event deltas
+    summed over CPUs, scaled for multiplexing and by the event's sysfs scale
+    (RAPL -> Joules). After each read, coverage holds the fraction of the
+    interval every event was actually counted.
+
+    With rotate=True, a PMU with more than one group enables only one of
+    them (on every CPU) per interval and its groups take turns; events of
+    idle groups report their last measured rate. PMUs whose events fit in
+    one group count continuously.
+
+    cpus restricts the set to those CPUs (e.g. one package's, see shards.py);
+    None opens every CPU the PMU covers.
+    """
+    def __init__(self, event_names, backend=None, resolver=None, cgroup_fd=-1,
+                 group_size=MAX_GROUP_SIZE, fallback=SOFTWARE_FALLBACK, rotate=False, cpus=None):
+        self.event_names = list(event_names)
+        self.backend = backend or default_backend()
+        self.resolver = resolver or EventResolver()
+        self.cgroup_fd = cgroup_fd
+        self.group_size = group_size
+        self.fallback = list(fallback or [])
+        self.rotate = rotate
+        self.cpus = set(cpus) if cpus is not None else None
+        self.groups = []
+        self.events = []
+        self.failed = {}
+        # {pmu: [groups of slot 0, groups of slot 1, ...]}; a PMU counts
+        # slot (self.slot % its number of slots) in the current interval
+        self.slots = {}
+        self.slot = 0
+        self.coverage = []
+        self._rates = []
+        self._group_counts = []
+        self._last_read = None
+
+    def _resolve(self, names):
+        events = []
+        for name in names:
+            try:
+                events.append(self.resolver.resolve(name))
+            except (ValueError, OSError) as e:
+                self.failed[name] = str(e)
+        return events
+
+    def _target(self):
+        if self.cgroup_fd != -1:
+            return self.cgroup_fd, PERF_FLAG_PID_CGROUP
+        return -1, 0
+
+    def _pack(self, events, cpu):
+        """
+        Split one PMU's events into groups the PMU can schedule, by growing
+        a trial group on `cpu` until the kernel refuses the next member.
+        """
+        limits = getattr(self.backend, "group_limits", {})
+        key = (self.cgroup_fd != -1,) + tuple((ev.type, ev.config, ev.config1, ev.config2) for ev in events)
+        if key in limits:
+            # Same events packed before by another set: reuse the layout
+            layout, failed = limits[key]
+            self.failed.update(failed)
+            return [[events[i] for i in chunk] for chunk in layout]
+
+        pid, flags = self._target()
+        layout, chunk, fds, failed = [], [], [], {}
+
+        def close_trial():
+            for fd in reversed(fds):
+                try:
+                    self.backend.close(fd)
+                except OSError:
+                    pass
+            fds.clear()
+
+        for i, ev in enumerate(events):
+            if len(chunk) == self.group_size:
+                close_trial()
+                layout.append(chunk)
+                chunk = []
+            try:
+                fd = self.backend.open(ev.attr(leader=not fds), pid, cpu, fds[0] if fds else -1, flags)
+            except OSError as e:
+                if e.errno != errno.EINVAL or not fds:
+                    failed[ev.name] = e.strerror or str(e)
+                    continue
+                # Group is full: this event leads the next one
+                close_trial()
+                layout.append(chunk)
+                chunk = []
+                try:
+                    fd = self.backend.open(ev.attr(leader=True), pid, cpu, -1, flags)
+                except OSError as e:
+                    failed[ev.name] = e.strerror or str(e)
+                    continue
+            fds.append(fd)
+            chunk.append(i)
+        close_trial()
+        if chunk:
+            layout.append(chunk)
+        limits[key] = (layout, failed)
+        self.failed.update(failed)
+        return [[events[i] for i in chunk] for chunk in layout]
+
+    def _open_group(self, cpu, events):
+        pid, flags = self._target()
+        opened, fds = [], []
+        for ev in events:
+            leader = not fds
+            try:
+                fd = self.backend.open(ev.attr(leader=leader), pid, cpu,
+                                       -1 if leader else fds[0], flags)
+            except OSError as e:
+                self.failed[ev.name] = e.strerror or str(e)
+                continue
+            opened.append(ev)
+            fds.append(fd)
+        if fds:
+            group = CounterGroup(cpu, opened, fds)
+            self.groups.append(group)
+            return group
+        return None
+
+    def _open_events(self, events):
+        online = self.resolver.online_cpus()
+        by_pmu = {}
+        for ev in events:
+            by_pmu.setdefault(ev.pmu, []).append(ev)
+        for pmu_events in by_pmu.values():
+            cpus = pmu_events[0].cpus or online
+            if self.cpus is not None:
+                cpus = [cpu for cpu in cpus if cpu in self.cpus]
+            if not cpus:
+                continue
+            for slot, chunk in enumerate(self._pack(pmu_events, cpus[0])):
+                for cpu in cpus:
+                    group = self._open_group(cpu, chunk)
+                    if group:
+                        group.slot = slot
+
+    def open(self):
+        """
+        Open every group; fall back to software events when nothing opens.
+        """
+        self._open_events(self._resolve(self.event_names))
+        if not self.groups and self.fallback:
+            print(f"[!] No hardware events could be opened, falling back to {self.fallback}")
+            self._open_events(self._resolve(self.fallback))
+        opened = {ev.name: ev for group in self.groups for ev in group.events}
+        self.events = list(opened.values())
+        # Column of each group member in read_values() output
+        positions = {name: i for i, name in enumerate(opened)}
+        self._group_counts = [0] * len(self.events)
+        for group in self.groups:
+            group.columns = [positions[ev.name] for ev in group.events]
+            for col in group.columns:
+                self._group_counts[col] += 1
+        self.slots = {}
+        for group in self.groups:
+            pmu_slots = self.slots.setdefault(group.events[0].pmu, [])
+            while len(pmu_slots) <= group.slot:
+                pmu_slots.append([])
+            pmu_slots[group.slot].append(group)
+        self.coverage = [1.0] * len(self.events)
+        self._rates = [None] * len(self.events)
+        for name, reason in self.failed.items():
+            if name not in opened:
+                print(f"[!] Could not open {name}: {reason}")
+        return self
+
+    @property
+    def rotating(self):
+        return self.rotate and any(len(pmu_slots) > 1 for pmu_slots in self.slots.values())
+
+    @property
+    def fd_count(self):
+        """perf fds held open."""
+        return sum(len(group.fds) for group in self.groups)
+
+    def _active(self, rotating_only=False):
+        """Groups counting in the current interval."""
+        groups = []
+        for pmu_slots in self.slots.values():
+            if len(pmu_slots) > 1 or not rotating_only:
+                groups.extend(pmu_slots[self.slot % len(pmu_slots)])
+        return groups
+
+    def _ioctl_all(self, request, groups=None):
+        for group in self.groups if groups is None else groups:
+            self.backend.ioctl(group.leader, request, PERF_IOC_FLAG_GROUP)
+
+    def enable(self):
+        # Rotation counts one slot at a time
+        self._ioctl_all(PERF_EVENT_IOC_ENABLE, self._active() if self.rotating else None)
+        self._last_read = time.monotonic_ns()
+
+    def disable(self):
+        self._ioctl_all(PERF_EVENT_IOC_DISABLE)
+
+    def reset(self):
+        self._ioctl_all(PERF_EVENT_IOC_RESET)
+
+    def read_values(self):
+        """
+        Read the counting groups once and return values in self.events order;
+        self.coverage is updated alongside.
+        """
+        now = time.monotonic_ns()
+        elapsed = now - self._last_read if self._last_read else 0
+        self._last_read = now
+        n = len(self.events)
+        totals = [0.0] * n
+        enabled_ns = [0] * n
+        running_ns = [0] * n
+        groups = self._active() if self.rotating else self.groups
+        interval_ns = 0
+        for group in groups:
+            values, enabled, running = group.sample(self.backend)
+            interval_ns = max(interval_ns, enabled)
+            for col in group.columns:
+                enabled_ns[col] += enabled
+                running_ns[col] += running
+            if running <= 0:
+                # Group never got a counter this interval
+                continue
+            ratio = enabled / running
+            for col, ev, value in zip(group.columns, group.events, values):
+                totals[col] += value * ratio * ev.scale
+
+        coverage, rates = self.coverage, self._rates
+        for col in range(n):
+            if running_ns[col] > 0:
+                coverage[col] = running_ns[col] / enabled_ns[col]
+                # Per ns of wall time, averaged over the event's CPUs
+                rates[col] = totals[col] * self._group_counts[col] / enabled_ns[col]
+            else:
+                # Not counted this interval: extrapolate, flagged by coverage 0
+                coverage[col] = 0.0
+                if rates[col] is not None:
+                    # Kernel time of the groups that did count, wall time otherwise
+                    totals[col] = rates[col] * (interval_ns or elapsed)
+
+        if self.rotating:
+            # Hand the counters to each multi-group PMU's next slot
+            self._ioctl_all(PERF_EVENT_IOC_DISABLE, self._active(rotating_only=True))
+            self.slot += 1
+            self._ioctl_all(PERF_EVENT_IOC_ENABLE, self._active(rotating_only=True))
+        return totals
+
+    def column_names(self):
+        """Names of the read_values() columns."""
+        return [ev.name for ev in self.events]
+
+    def partial_coverage(self):
+        """{event name: coverage} for events not fully counted last interval."""
+        return {ev.name: cov for ev, cov in zip(self.events, self.coverage) if cov < 1.0}
+
+    def read(self):
+        """
+        Read every group once and return {event name: value}.
+        """
+        return dict(zip((ev.name for ev in self.events), self.read_values()))
+
+    def close(self):
+        for group in self.groups:
+            # Members before the leader
+            for fd in reversed(group.fds):
+                try:
+                    self.backend.close(fd)
+                except OSError:
+                    pass
+        self.groups = []
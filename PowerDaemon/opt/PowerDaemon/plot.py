@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+plot.py - Headless, decimated plots of measurement files
+
+Records are streamed one line at a time and every requested series goes
+through a MinMaxDecimator, which keeps a fixed number of buckets however
+long the run is (doubling the bucket width when full) and emits each
+bucket's minimum and maximum in time order, at most `points` in all, so
+peaks survive. The result
+can be thinned further with LTTB (largest triangle three buckets). Only
+the decimated points reach matplotlib, which renders with the Agg
+backend to PNG or SVG: render time depends on `points`, not run length.
+
+A series is "scope:event", e.g. "system:power/energy-pkg/" or
+"tenant0:cpu_core/instructions/"; the event "power" is watts (package
+energy for system, the cgroup's share of it otherwise).
+
+    python3 plot.py measurement.jsonl -o run.png --cgroups tenant0,tenant1 --events power
+"""
+
+import argparse
+import os
+import sys
+from array import array
+
+from writer import read_records
+from power import cgroup_power, PKG
+
+# Points per series handed to matplotlib
+DEFAULT_POINTS = 2000
+
+POWER = "power"
+
+
+class MinMaxDecimator:
+    """
+    Streaming min/max downsampling to at most 2 * buckets points, in O(buckets)
+    memory. Buckets cover `width` samples; when all are used, neighbours
+    are merged pairwise and the width doubles.
+    """
+    def __init__(self, buckets=DEFAULT_POINTS // 2):
+        # Even, so every merge pairs up whole buckets
+        self.buckets = max(2, buckets + buckets % 2)
+        self.width = 1
+        # Per bucket: min time, min value, max time, max value
+        self.data = array("d")
+        self._fill = 0
+        self.count = 0
+
+    def add(self, t, value):
+        self.count += 1
+        data = self.data
+        if self._fill:
+            if value < data[-3]:
+                data[-4] = t
+                data[-3] = value
+            if value > data[-1]:
+                data[-2] = t
+                data[-1] = value
+            self._fill += 1
+        else:
+            if len(data) == 4 * self.buckets:
+                self._merge()
+            data.extend((t, value, t, value))
+            self._fill = 1
+        if self._fill == self.width:
+            self._fill = 0
+
+    def _merge(self):
+        old = self.data
+        merged = array("d")
+        for i in range(0, len(old), 8):
+            a = old[i:i + 4]
+            b = old[i + 4:i + 8] or a
+            low = a[0:2] if a[1] <= b[1] else b[0:2]
+            high = a[2:4] if a[3] >= b[3] else b[2:4]
+            merged.extend(low)
+            merged.extend(high)
+        self.data = merged
+        self.width *= 2
+
+    def points(self):
+        """(times, values) of every bucket's min and max, in time order."""
+        times, values = [], []
+        data = self.data
+        for i in range(0, len(data), 4):
+            t_min, v_min, t_max, v_max = data[i:i + 4]
+            if t_min == t_max:
+                times.append(t_min)
+                values.append(v_min)
+            elif t_min < t_max:
+                times += (t_min, t_max)
+                values += (v_min, v_max)
+            else:
+                times += (t_max, t_min)
+                values += (v_max, v_min)
+        return times, values
+
+
+def lttb(times, values, threshold):
+    """
+    Largest triangle three buckets: keep the first and last point and, per
+    bucket, the point forming the largest triangle with the previously kept
+    point and the next bucket's average.
+    """
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return list(times), list(values)
+    out_t, out_v = [times[0]], [values[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if end >= n - 1:
+            next_t, next_v = times[-1], values[-1]
+        else:
+            span = next_end - end
+            next_t = sum(times[end:next_end]) / span
+            next_v = sum(values[end:next_end]) / span
+        at, av = times[a], values[a]
+        best, best_area = start, -1.0
+        for j in range(start, min(end, n - 1)):
+            area = abs((at - next_t) * (values[j] - av) - (at - times[j]) * (next_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out_t.append(times[best])
+        out_v.append(values[best])
+        a = best
+    out_t.append(times[-1])
+    out_v.append(values[-1])
+    return out_t, out_v
+
+
+def parse_series(specs):
+    """["scope:event", ...] -> [(scope, event)]; the scope is up to the first ':'."""
+    series = []
+    for spec in specs:
+        scope, sep, event = spec.partition(":")
+        if not sep or not scope or not event:
+            raise ValueError(f"series '{spec}' is not scope:event")
+        series.append((scope, event))
+    return series
+
+
+def decimate_file(path, series, points=DEFAULT_POINTS):
+    """
+    Stream a measurement file once; returns {(scope, event): MinMaxDecimator}.
+    """
+    decimators = {key: MinMaxDecimator(points // 2) for key in series}
+    wants_power = any(event == POWER for _, event in series)
+    prev = None
+    for record in read_records(path):
+        timestamp = record["timestamp"]
+        watts = None
+        if wants_power:
+            interval = timestamp - prev if prev is not None else None
+            watts = cgroup_power(record, interval)
+            energy = record.get("system", {}).get(PKG)
+            if energy is not None and interval:
+                watts["system"] = energy / interval
+        prev = timestamp
+        for (scope, event), decimator in decimators.items():
+            if event == POWER:
+                value = watts.get(scope)
+            else:
+                value = record.get(scope, {}).get(event)
+            if value is not None and value == value:
+                decimator.add(timestamp, value)
+    return decimators
+
+
+def render(decimators, output, title=None, points=DEFAULT_POINTS, method="minmax"):
+    """
+    Draw one panel per event (series sharing an event share its axis) to
+    output; the format follows its extension (.png, .svg, .pdf).
+    """
+    import matplotlib
+    # Servers have no display
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    events = list(dict.fromkeys(event for _, event in decimators))
+    fig, axes = plt.subplots(len(events), 1, sharex=True, squeeze=False,
+                             figsize=(12, 3 * len(events)))
+    series = {}
+    for key, decimator in decimators.items():
+        times, values = decimator.points()
+        if method == "lttb":
+            times, values = lttb(times, values, points)
+        if times:
+            series[key] = (times, values)
+    # Seconds since the first sample of any series
+    start = min((times[0] for times, _ in series.values()), default=0.0)
+    for (scope, event), (times, values) in series.items():
+        ax = axes[events.index(event)][0]
+        ax.plot([t - start for t in times], values, linewidth=0.8, label=scope)
+    for ax, event in zip(axes[:, 0], events):
+        ax.set_ylabel("W" if event == POWER else event)
+        ax.grid(True, alpha=0.3)
+        ax.legend(loc="upper right", fontsize="small")
+    axes[-1][0].set_xlabel("Time (s)")
+    if title:
+        fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(output)
+    plt.close(fig)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="Measurement file (JSON Lines or legacy JSON array)")
+    parser.add_argument("-o", "--output", help="PNG/SVG/PDF to write (default: <file>.png)")
+    parser.add_argument("-s", "--series", action="append", default=[], help="scope:event, repeatable")
+    parser.add_argument("--cgroups", default="", help="Comma list of scopes, crossed with --events")
+    parser.add_argument("--events", default=POWER, help="Comma list of events (default: power)")
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS, help="Points per series")
+    parser.add_argument("--method", choices=["minmax", "lttb"], default="minmax")
+    args = parser.parse_args()
+
+    try:
+        series = parse_series(args.series)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    for scope in filter(None, args.cgroups.split(",")):
+        series += [(scope, event) for event in filter(None, args.events.split(","))]
+    if not series:
+        series = [("system", POWER)]
+    output = args.output or os.path.splitext(args.file)[0] + ".png"
+    decimators = decimate_file(args.file, series, args.points)
+    render(decimators, output, title=os.path.basename(args.file), points=args.points,
+           method=args.method)
+    samples = max(d.count for d in decimators.values())
+    print(f"[*] {samples} samples per series plotted as <= {args.points} points in {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+power.py - Per-cgroup power of one record
+
+Package energy is split by each cgroup's share of the first system
+counter present in SHARE_EVENTS. This is the split the API, the capper,
+rollups, shared-memory samples, replay and archives report; attribution.py
+fits richer models offline. Standard library only, so the daemon's
+modules can use it without loading the socket server or NumPy.
+"""
+
+from samples import RESERVED_KEYS
+from shards import socket_event, socket_values
+
+PKG = "power/energy-pkg/"
+# Counters the energy is split by, the first one present wins
+SHARE_EVENTS = ("cpu_core/instructions/", "cpu.stat/usage_usec")
+
+
+def cgroup_power(record, interval):
+    """
+    {cgroup: watts} for one record: package energy split by each cgroup's
+    share of the system counter, over the sampling interval. Records with
+    per-package columns (shards.py) are split per package and summed.
+    """
+    system = record.get("system", {})
+    energy = system.get(PKG)
+    if not energy or not interval or interval <= 0:
+        return {}
+    packages = socket_values(system, PKG)
+    if packages:
+        return _socket_power(record, system, packages, interval)
+    for event in SHARE_EVENTS:
+        total = system.get(event)
+        if total:
+            break
+    else:
+        return {}
+    watts = energy / interval / total
+    return {scope: values.get(event, 0.0) * watts
+            for scope, values in record.items()
+            if scope not in RESERVED_KEYS and isinstance(values, dict)}
+
+
+def _socket_power(record, system, packages, interval):
+    scopes = [(scope, values) for scope, values in record.items()
+              if scope not in RESERVED_KEYS and isinstance(values, dict)]
+    power = dict.fromkeys((scope for scope, _ in scopes), 0.0)
+    for package, energy in packages.items():
+        for event in SHARE_EVENTS:
+            column = socket_event(event, package)
+            total = system.get(column)
+            if total:
+                break
+        else:
+            # Idle package: nothing to split
+            continue
+        watts = energy / interval / total
+        for scope, values in scopes:
+            power[scope] += values.get(column, 0.0) * watts
+    return power
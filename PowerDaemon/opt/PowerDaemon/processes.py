@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+processes.py - Per-process split of a cgroup's energy
+
+Each monitored cgroup's attributed energy is split between its processes
+by their CPU time. Membership is tracked incrementally: cgroup.procs is
+re-read each tick through one kept-open fd and only PIDs that appeared or
+left cause work. Every tracked PID keeps its /proc/<pid>/stat open
+between ticks and is read with one pread(); a read failing with ESRCH
+means the process exited (a reused PID gets a new fd), so short-lived
+PIDs cost one open and one close each, not one per tick.
+
+Shares are taken of the cgroup's own CPU time (cpu.stat) where readable,
+so CPU of untracked or exited processes is not handed to the tracked
+ones. At most pid_budget stat files are open at a time, shared by all
+cgroups; PIDs over the budget are not tracked (their CPU time ends up in
+"other") until tracked ones exit.
+
+The result goes into the record as
+    "processes": {cgroup: {"top": [{"pid", "comm", "cpu", "joules"}, ...],
+                           "other": joules, "untracked": number of PIDs}}
+"""
+
+import errno
+import os
+
+from power import cgroup_power
+from cgroups import CGROUP_ROOT, cgroup_name
+from cpustat import CpuStatFile
+
+# Stat files open at most, over all cgroups
+PID_BUDGET = 1024
+# Processes listed per cgroup
+TOP_N = 10
+
+PROC_ROOT = "/proc"
+# /proc/<pid>/stat up to stime fits easily, even with a 64-byte comm
+STAT_READ_SIZE = 512
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class ProcStat:
+    """A kept-open /proc/<pid>/stat; read() returns CPU seconds since the last read."""
+    def __init__(self, pid, proc_root=PROC_ROOT):
+        self.pid = pid
+        self.fd = os.open(os.path.join(proc_root, str(pid), "stat"), os.O_RDONLY | os.O_CLOEXEC)
+        self.comm, self.prev = self._read()
+
+    def _read(self):
+        data = os.pread(self.fd, STAT_READ_SIZE, 0)
+        # comm may contain spaces and parentheses: it ends at the last ')'
+        end = data.rindex(b")")
+        comm = data[data.index(b"(") + 1:end].decode(errors="replace")
+        # state is field 3; utime and stime are fields 14 and 15
+        fields = data[end + 2:].split(None, 13)
+        return comm, int(fields[11]) + int(fields[12])
+
+    def read(self):
+        _, ticks = self._read()
+        delta = ticks - self.prev
+        self.prev = ticks
+        return delta / CLOCK_TICKS
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ProcessTracker:
+    """Processes of one cgroup, kept in sync with its cgroup.procs."""
+    def __init__(self, path, breakdown):
+        self.path = path
+        self.breakdown = breakdown
+        self.procs_fd = os.open(os.path.join(path, "cgroup.procs"), os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            self.cpu_stat = CpuStatFile(path).open()
+        except OSError:
+            # No cpu controller: shares of the tracked processes' CPU time
+            self.cpu_stat = None
+        self.pids = set()
+        self.stats = {}
+        self.untracked = 0
+        self._read_size = 4096
+
+    def members(self):
+        """PIDs currently in cgroup.procs."""
+        while True:
+            data = os.pread(self.procs_fd, self._read_size, 0)
+            if len(data) < self._read_size:
+                return set(map(int, data.split()))
+            # Grow until the whole list fits in one read
+            self._read_size *= 2
+
+    def sync(self):
+        """Open stat files for new PIDs (within budget), close them for gone ones."""
+        pids = self.members()
+        if pids == self.pids:
+            return
+        for pid in self.pids - pids:
+            self._drop(pid)
+        stats = self.stats
+        for pid in pids:
+            if pid not in stats and self.breakdown.take_slot():
+                try:
+                    stats[pid] = ProcStat(pid, self.breakdown.proc_root)
+                except OSError:
+                    # Exited between the listing and the open
+                    self.breakdown.free_slot()
+        self.pids = pids
+        self.untracked = len(pids) - len(stats)
+
+    def _drop(self, pid):
+        stat = self.stats.pop(pid, None)
+        if stat:
+            stat.close()
+            self.breakdown.free_slot()
+
+    def read(self):
+        """
+        ({pid: (comm, CPU seconds since the last tick)} of tracked
+        processes, CPU seconds of the whole cgroup or None).
+        """
+        usage = {}
+        for pid, stat in list(self.stats.items()):
+            try:
+                usage[pid] = (stat.comm, stat.read())
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+                # Exited: its last CPU time is lost with it
+                self._drop(pid)
+                self.pids.discard(pid)
+        cgroup_cpu = self.cpu_stat.read()[0] / 1e6 if self.cpu_stat else None
+        return usage, cgroup_cpu
+
+    def close(self):
+        for pid in list(self.stats):
+            self._drop(pid)
+        os.close(self.procs_fd)
+        if self.cpu_stat:
+            self.cpu_stat.close()
+
+
+class ProcessBreakdown:
+    """
+    Top-N per-process energy for every monitored cgroup, under a shared PID budget.
+    """
+    def __init__(self, top=TOP_N, pid_budget=PID_BUDGET, cgroup_root=CGROUP_ROOT,
+                 proc_root=PROC_ROOT):
+        self.top = top
+        self.pid_budget = pid_budget
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.open_slots = 0
+        # {cgroup path: ProcessTracker}
+        self.trackers = {}
+
+    def take_slot(self):
+        if self.open_slots >= self.pid_budget:
+            return False
+        self.open_slots += 1
+        return True
+
+    def free_slot(self):
+        self.open_slots -= 1
+
+    def _sync_cgroups(self, paths):
+        for path in set(self.trackers) - set(paths):
+            self.trackers.pop(path).close()
+        for path in paths:
+            if path not in self.trackers:
+                try:
+                    self.trackers[path] = ProcessTracker(path, self)
+                except OSError as e:
+                    print(f"[!] Cannot list processes of {path}: {e}")
+
+    def sample(self, record, interval, paths):
+        """
+        The "processes" entry for one record. interval is the seconds the
+        record covers (None for the first one: CPU baselines only).
+        """
+        self._sync_cgroups(paths)
+        watts = cgroup_power(record, interval) if interval else {}
+        result = {}
+        for path, tracker in self.trackers.items():
+            # Read before syncing, so PIDs that just left still get their last tick
+            usage, cgroup_cpu = tracker.read()
+            tracker.sync()
+            if not interval:
+                continue
+            name = cgroup_name(path, self.cgroup_root)
+            joules = watts.get(name, 0.0) * interval
+            total = sum(cpu for _, cpu in usage.values())
+            if cgroup_cpu is not None:
+                total = max(total, cgroup_cpu)
+            ranked = sorted(usage.items(), key=lambda item: item[1][1], reverse=True)
+            per_cpu = joules / total if total > 0 else 0.0
+            top = [{"pid": pid, "comm": comm, "cpu": cpu, "joules": cpu * per_cpu}
+                   for pid, (comm, cpu) in ranked[:self.top] if cpu > 0]
+            result[name] = {"top": top,
+                            "other": joules - sum(p["joules"] for p in top),
+                            "untracked": tracker.untracked}
+        return result
+
+    def close(self):
+        for tracker in self.trackers.values():
+            tracker.close()
+        self.trackers = {}
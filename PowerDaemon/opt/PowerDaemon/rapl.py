@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+rapl.py - Energy from the powercap/RAPL sysfs interface
+
+Keeps every /sys/class/powercap/intel-rapl:*/energy_uj file open and reads
+it with one pread() per tick, which is far cheaper than a perf process.
+Counter wraparound is handled with max_energy_range_uj. Values are
+reported under the perf names (power/energy-pkg/, power/energy-cores/, ...)
+so they drop into the same sample schema.
+"""
+
+import os
+
+from shards import socket_event
+
+POWERCAP_ROOT = "/sys/class/powercap"
+
+# powercap zone name -> perf power PMU event
+DOMAIN_EVENTS = {
+    "package": "power/energy-pkg/",
+    "core": "power/energy-cores/",
+    "uncore": "power/energy-gpu/",
+    "dram": "power/energy-ram/",
+    "psys": "power/energy-psys/",
+}
+
+
+def _read_text(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+class RaplDomain:
+    """
+    One powercap zone (a package or one of its subdomains).
+    """
+    def __init__(self, path, name, package, event, max_range):
+        self.path = path
+        self.name = name
+        self.package = package
+        self.event = event
+        self.max_range = max_range
+        self.fd = None
+        self.prev = None
+
+    def open(self):
+        self.fd = os.open(os.path.join(self.path, "energy_uj"), os.O_RDONLY | os.O_CLOEXEC)
+        self.prev = self._read_uj()
+        return self
+
+    def _read_uj(self):
+        return int(os.pread(self.fd, 32, 0))
+
+    def read(self):
+        """Joules used since the previous read."""
+        cur = self._read_uj()
+        delta = cur - self.prev
+        if delta < 0:
+            # Counter wrapped past max_energy_range_uj
+            delta += self.max_range
+        self.prev = cur
+        return delta / 1e6
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RaplReader:
+    """
+    Enumerates every package and subdomain below the powercap root and
+    reads them all per tick. Use either read()/read_values() or
+    read_packages() on one reader, each read consumes the delta.
+    """
+    def __init__(self, root=POWERCAP_ROOT):
+        self.root = root
+        self.domains = []
+        self.events = []
+        self._columns = []
+
+    def discover(self):
+        """Find intel-rapl:N (packages) and intel-rapl:N:M (subdomains)."""
+        domains = []
+        if not os.path.isdir(self.root):
+            return domains
+        for entry in sorted(os.listdir(self.root)):
+            # intel-rapl-mmio duplicates the MSR package zone
+            if not entry.startswith("intel-rapl:"):
+                continue
+            path = os.path.join(self.root, entry)
+            if not os.path.exists(os.path.join(path, "energy_uj")):
+                continue
+            parts = entry.split(":")
+            package = int(parts[1])
+            name = _read_text(os.path.join(path, "name"))
+            # 'package-0' -> 'package'
+            kind = name.split("-")[0]
+            event = DOMAIN_EVENTS.get(kind)
+            if event is None:
+                continue
+            max_range = int(_read_text(os.path.join(path, "max_energy_range_uj")))
+            domains.append(RaplDomain(path, name, package, event, max_range))
+        return domains
+
+    def open(self):
+        """Open every domain's energy_uj once."""
+        for domain in self.discover():
+            try:
+                self.domains.append(domain.open())
+            except OSError as e:
+                # energy_uj is root-only on recent kernels
+                print(f"[!] Cannot read {domain.path}: {e}")
+        self.events = list(dict.fromkeys(d.event for d in self.domains))
+        positions = {event: i for i, event in enumerate(self.events)}
+        self._columns = [positions[d.event] for d in self.domains]
+        return self
+
+    def read_values(self, packages=None):
+        """
+        Joules per event since the previous read (summed over packages), in
+        self.events order; with packages, followed by each package's values
+        (column_names(packages)).
+        """
+        n = len(self.events)
+        totals = [0.0] * n
+        if packages is None:
+            for col, domain in zip(self._columns, self.domains):
+                totals[col] += domain.read()
+            return totals
+        offsets = {package: n * (i + 1) for i, package in enumerate(packages)}
+        values = totals + [0.0] * (n * len(offsets))
+        for col, domain in zip(self._columns, self.domains):
+            joules = domain.read()
+            totals[col] += joules
+            if domain.package in offsets:
+                values[offsets[domain.package] + col] = joules
+        values[:n] = totals
+        return values
+
+    def column_names(self, packages=None):
+        if packages is None:
+            return list(self.events)
+        return self.events + [socket_event(event, package)
+                              for package in packages for event in self.events]
+
+    def read(self):
+        return dict(zip(self.events, self.read_values()))
+
+    def read_packages(self):
+        """{package: {event: Joules}} since the previous read."""
+        result = {}
+        for domain in self.domains:
+            result.setdefault(domain.package, {})[domain.event] = domain.read()
+        return result
+
+    def close(self):
+        for domain in self.domains:
+            domain.close()
+        self.domains = []
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+replay.py - Record raw collection inputs and replay them without hardware
+
+A Recorder captures what the pipeline reads from the machine, one JSON
+object per line with its monotonic offset "t":
+
+    {"kind": "stream", "stream": "system"|"cgroup",             a perf stat -x, output starts;
+     "interval": seconds}                                       interval for align.Aligner
+    {"kind": "perf", "stream": "system"|"cgroup", "line": ...}   one line of its stderr
+    {"kind": "schema", "columns": [[scope, event], ...]}        sensor column layout
+    {"kind": "sample", "timestamp": ..., "values": [...]}       one sensor read (counters,
+                                                                RAPL, cpu.stat) in that layout
+    {"kind": "cgroup", "path": ..., "populated": bool}          cgroup.events changes
+
+A Replayer pushes a recording through the same stages the collector and
+daemon use (perf CSV parsing, the sample ring, per-cgroup attribution and
+the JSONL writer), as fast as possible or at recorded speed, and times
+every stage. Runs need no root, PMU or cgroup, so they can be compared
+across commits.
+
+    python3 replay.py recording.jsonl [--realtime] [--speed 10] [--output out.jsonl]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from writer import JsonlWriter
+from perf_csv import PerfCsvParser, merge_records
+from align import Aligner
+from samples import SampleSchema, SampleRing
+from power import cgroup_power
+
+# Bumped whenever the event layout changes
+RECORDING_VERSION = 1
+
+# Samples kept in the replay ring
+REPLAY_CAPACITY = 3600
+
+STAGES = ("parse", "sample", "attribute", "write")
+
+
+class Recorder:
+    """
+    Appends raw inputs to a recording from any thread, through a
+    JsonlWriter (no fsync: a recording is not precious).
+    """
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self.writer = JsonlWriter(path, fsync=False)
+        self.start_time = None
+        self._schema = None
+
+    def start(self):
+        # A recording always starts from scratch
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        open(self.path, "w").close()
+        self.writer.start()
+        self.start_time = self.clock()
+        self.writer.write({"kind": "header", "version": RECORDING_VERSION, "time": time.time()})
+        return self
+
+    def _write(self, event):
+        event["t"] = self.clock() - self.start_time
+        self.writer.write(event)
+
+    def perf_line(self, stream, line):
+        self._write({"kind": "perf", "stream": stream, "line": line})
+
+    def stream(self, stream, interval=None):
+        """
+        Announce a perf output as it starts, so a replay knows which outputs
+        to merge, and from when, before the first line of either arrives.
+        """
+        event = {"kind": "stream", "stream": stream}
+        if interval is not None:
+            event["interval"] = interval
+        self._write(event)
+
+    def tee(self, stream, lines, interval=None):
+        """
+        Pass an iterable of perf stderr lines through, recording each. The
+        stream is announced right away.
+        """
+        self.stream(stream, interval)
+        return self._tee(stream, lines)
+
+    def _tee(self, stream, lines):
+        for line in lines:
+            self.perf_line(stream, line.rstrip("\n"))
+            yield line
+
+    def sample(self, timestamp, values, schema):
+        """One sensor read; the layout is recorded again whenever it changed."""
+        if self._schema != (id(schema), schema.version):
+            self._schema = (id(schema), schema.version)
+            self._write({"kind": "schema", "columns": [list(key) for key in schema.columns]})
+        self._write({"kind": "sample", "timestamp": timestamp, "values": list(values)})
+
+    def cgroup_event(self, path, populated):
+        self._write({"kind": "cgroup", "path": path, "populated": populated})
+
+    def close(self):
+        self.writer.close()
+
+
+def read_recording(path):
+    """Iterate over the events of a recording, header excluded."""
+    with open(path) as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("kind") != "header" or header.get("version") != RECORDING_VERSION:
+            raise ValueError(f"{path}: not a version {RECORDING_VERSION} recording")
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class StageTimer:
+    """Per-stage latencies of one replay."""
+    def __init__(self, stages=STAGES):
+        self.latencies = {stage: [] for stage in stages}
+
+    def add(self, stage, seconds):
+        self.latencies[stage].append(seconds)
+
+    def summary(self):
+        """{stage: {"count", "mean", "p50", "p99", "max"}} in seconds."""
+        result = {}
+        for stage, values in self.latencies.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            n = len(ordered)
+            result[stage] = {"count": n, "mean": sum(ordered) / n,
+                             "p50": ordered[n // 2], "p99": ordered[min(n - 1, int(n * 0.99))],
+                             "max": ordered[-1]}
+        return result
+
+
+class Replayer:
+    """
+    Replays a recording. realtime=True sleeps to keep the recorded pacing,
+    scaled by speed; otherwise events are processed back to back.
+    """
+    def __init__(self, path, realtime=False, speed=1.0, output=None):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.output = output
+        self.timer = StageTimer()
+        # Joules attributed per scope over the whole replay
+        self.energy = {}
+        self.records = 0
+        self.cgroup_events = 0
+        self.elapsed = 0.0
+        self._parsers = {}
+        self._pending = {}
+        # Recordings that give the perf interval are merged like the collector does
+        self._aligner = None
+        self._ring = None
+        self._prev_timestamp = None
+        self._writer = None
+
+    def run(self):
+        """Replay everything; returns summary()."""
+        if self.output:
+            self._writer = JsonlWriter(self.output, fsync=False).start()
+        start = time.perf_counter()
+        try:
+            for event in read_recording(self.path):
+                if self.realtime:
+                    delay = event["t"] / self.speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                kind = event["kind"]
+                if kind == "perf":
+                    self._perf_line(event["stream"], event["line"])
+                elif kind == "stream":
+                    self._stream(event["stream"], event["t"], event.get("interval"))
+                elif kind == "sample":
+                    self._sample(event["timestamp"], event["values"])
+                elif kind == "schema":
+                    self._schema(event["columns"])
+                elif kind == "cgroup":
+                    self.cgroup_events += 1
+            # Intervals still open when the recording ended
+            for stream, parser in self._parsers.items():
+                record = parser.flush()
+                if record is not None:
+                    self._pending[stream].append(record)
+            if self._aligner:
+                for stream in self._parsers:
+                    self._merge(stream)
+                for record in self._aligner.flush():
+                    self._emit(record)
+            else:
+                self._merge(final=True)
+        finally:
+            if self._writer:
+                self._writer.close()
+        self.elapsed = time.perf_counter() - start
+        return self.summary()
+
+    def _stream(self, stream, start=0.0, interval=None):
+        if stream not in self._parsers:
+            self._parsers[stream] = PerfCsvParser(cgroups=stream == "cgroup")
+            self._pending[stream] = deque()
+            if interval:
+                if self._aligner is None:
+                    self._aligner = Aligner(interval)
+                self._aligner.add_source(stream, offset=start)
+
+    def _perf_line(self, stream, line):
+        parser = self._parsers.get(stream)
+        if parser is None:
+            self._stream(stream)
+            parser = self._parsers[stream]
+        t0 = time.perf_counter()
+        done = parser.feed_lines((line,))
+        self.timer.add("parse", time.perf_counter() - t0)
+        if done:
+            self._pending[stream].extend(done)
+            self._merge(stream)
+
+    def _merge(self, stream=None, final=False):
+        if self._aligner:
+            # Rebinned onto the collector's tick grid (align.py)
+            queue = self._pending[stream]
+            while queue:
+                for record in self._aligner.push(stream, queue.popleft()):
+                    self._emit(record)
+            return
+        # Older recordings: the system and cgroup perf outputs paired by order
+        system = self._pending.get("system")
+        cgroup = self._pending.get("cgroup")
+        if system is not None and cgroup is not None:
+            while system and cgroup:
+                self._emit(merge_records(system.popleft(), cgroup.popleft()))
+            if not final:
+                return
+        # A single output, or what is left unpaired at the end (zip_longest)
+        for queue in self._pending.values():
+            while queue:
+                self._emit(queue.popleft())
+
+    def _schema(self, columns):
+        schema = SampleSchema(tuple(key) for key in columns)
+        self._ring = SampleRing(schema, REPLAY_CAPACITY)
+
+    def _sample(self, timestamp, values):
+        t0 = time.perf_counter()
+        self._ring.append(timestamp, values)
+        record = self._ring.record()
+        self.timer.add("sample", time.perf_counter() - t0)
+        self._emit(record)
+
+    def _emit(self, record):
+        timestamp = record["timestamp"]
+        t0 = time.perf_counter()
+        if self._prev_timestamp is not None and timestamp > self._prev_timestamp:
+            interval = timestamp - self._prev_timestamp
+            for scope, watts in cgroup_power(record, interval).items():
+                self.energy[scope] = self.energy.get(scope, 0.0) + watts * interval
+        self._prev_timestamp = timestamp
+        t1 = time.perf_counter()
+        self.timer.add("attribute", t1 - t0)
+        if self._writer:
+            self._writer.write(record)
+            self.timer.add("write", time.perf_counter() - t1)
+        self.records += 1
+
+    def summary(self):
+        return {"records": self.records, "elapsed": self.elapsed,
+                "records_per_sec": self.records / self.elapsed if self.elapsed else 0.0,
+                "cgroup_events": self.cgroup_events, "stages": self.timer.summary(),
+                "energy": self.energy}
+
+
+def print_summary(summary):
+    print(f"[*] {summary['records']} records in {summary['elapsed']:.3f} s "
+          f"({summary['records_per_sec']:,.0f}/s), {summary['cgroup_events']} cgroup events")
+    for stage, s in summary["stages"].items():
+        print(f"    {stage:>9}: {s['count']:8} calls, mean {s['mean'] * 1e6:8.1f} us, "
+              f"p99 {s['p99'] * 1e6:8.1f} us, max {s['max'] * 1e6:8.1f} us")
+    for scope, joules in sorted(summary["energy"].items()):
+        print(f"    {scope}: {joules:.3f} J")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="Keep the recorded pacing.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing factor with --realtime.")
+    parser.add_argument("--output", help="Write the records here (JSON Lines).")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args()
+    try:
+        summary = Replayer(args.recording, realtime=args.realtime, speed=args.speed,
+                           output=args.output).run()
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
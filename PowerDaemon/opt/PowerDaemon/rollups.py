@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+rollups.py - Bounded on-disk time series with multi-resolution rollups
+
+Every sample is appended to the raw tier, and 10 s, 1 min and 1 h rollups
+are maintained incrementally: each closed 10 s bucket is merged into the
+open 1 min bucket, each closed 1 min bucket into the open 1 h bucket. A
+bucket holds per scope (system and each cgroup) the joules attributed to
+it, min/max/mean power and the sum of every counter (instructions, CPU
+time, ...).
+
+Each tier is a directory of JSON Lines segment files named after the
+start of the span they cover. Whole segments are deleted once they are
+older than the tier's retention, so disk use is bounded by retention
+times data rate, and a query only opens the segments overlapping its
+range. Long ranges are answered from the coarse tiers and never read raw
+samples.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from power import cgroup_power, PKG
+from samples import RESERVED_KEYS
+
+ROLLUP_DIR = "/var/lib/powerdaemon"
+
+# (name, bucket seconds); raw keeps samples as taken
+TIERS = (("raw", None), ("10s", 10), ("1m", 60), ("1h", 3600))
+
+# Seconds each tier is kept by default
+RETENTION = {"raw": 6 * 3600, "10s": 7 * 86400, "1m": 31 * 86400, "1h": 5 * 365 * 86400}
+
+# Seconds of data per segment file: the unit in which data is expired
+SEGMENT = {"raw": 3600, "10s": 86400, "1m": 7 * 86400, "1h": 30 * 86400}
+
+# Most buckets a query should return when no resolution is given
+MAX_POINTS = 2000
+
+QUEUE_SIZE = 4096
+FLUSH_INTERVAL = 1.0
+
+_STOP = object()
+_RESET = object()
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+class Rollup:
+    """
+    One bucket: {scope: [joules, power min, power max, {event: sum}]} over
+    `seconds` of samples starting at `start`.
+    """
+    def __init__(self, start, resolution):
+        self.start = start
+        self.resolution = resolution
+        self.seconds = 0.0
+        self.scopes = {}
+
+    def add_sample(self, record, interval):
+        """Account one sample covering `interval` seconds."""
+        self.seconds += interval
+        watts = cgroup_power(record, interval)
+        energy = record.get("system", {}).get(PKG)
+        if energy is not None:
+            watts["system"] = energy / interval
+        for scope, values in record.items():
+            if (scope != "system" and scope in RESERVED_KEYS) or not isinstance(values, dict):
+                continue
+            entry = self.scopes.get(scope)
+            if entry is None:
+                entry = self.scopes[scope] = [0.0, None, None, {}]
+            sums = entry[3]
+            for event, value in values.items():
+                if value == value:  # NaN before a cgroup was attached
+                    sums[event] = sums.get(event, 0.0) + value
+            power = watts.get(scope)
+            if power is not None:
+                self._add_power(entry, power * interval, power, power)
+
+    def merge(self, other):
+        """Fold a finer (or duplicate) bucket into this one."""
+        self.seconds += other.seconds
+        for scope, (joules, pmin, pmax, sums) in other.scopes.items():
+            entry = self.scopes.get(scope)
+            if entry is None:
+                entry = self.scopes[scope] = [0.0, None, None, {}]
+            for event, value in sums.items():
+                entry[3][event] = entry[3].get(event, 0.0) + value
+            if pmin is not None:
+                self._add_power(entry, joules, pmin, pmax)
+
+    @staticmethod
+    def _add_power(entry, joules, pmin, pmax):
+        entry[0] += joules
+        entry[1] = pmin if entry[1] is None else min(entry[1], pmin)
+        entry[2] = pmax if entry[2] is None else max(entry[2], pmax)
+
+    def to_record(self):
+        record = {"timestamp": self.start, "resolution": self.resolution, "seconds": self.seconds}
+        for scope, (joules, pmin, pmax, sums) in self.scopes.items():
+            values = dict(sums)
+            if pmin is not None:
+                values.update(joules=joules, power_min=pmin, power_max=pmax,
+                              power_mean=joules / self.seconds if self.seconds else 0.0)
+            record[scope] = values
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        rollup = cls(record["timestamp"], record["resolution"])
+        rollup.seconds = record["seconds"]
+        for scope, values in record.items():
+            if not isinstance(values, dict):
+                continue
+            sums = {k: v for k, v in values.items() if not k.startswith("power_") and k != "joules"}
+            rollup.scopes[scope] = [values.get("joules", 0.0), values.get("power_min"),
+                                    values.get("power_max"), sums]
+        return rollup
+
+
+class Tier:
+    """
+    Segment files of one resolution and the bucket currently being filled.
+    """
+    def __init__(self, directory, name, resolution, retention, segment):
+        self.directory = os.path.join(directory, name)
+        self.name = name
+        self.resolution = resolution
+        self.retention = retention
+        self.segment = segment
+        self.bucket = None
+        self._file = None
+        self._segment_start = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def segments(self):
+        """[(segment start, path)] in time order."""
+        found = []
+        for entry in os.listdir(self.directory):
+            stem, ext = os.path.splitext(entry)
+            if ext == ".jsonl" and stem.isdigit():
+                found.append((int(stem), os.path.join(self.directory, entry)))
+        return sorted(found)
+
+    def append(self, timestamp, line):
+        start = int(timestamp // self.segment * self.segment)
+        if start != self._segment_start:
+            self._open_segment(start, timestamp)
+        self._file.write(line)
+
+    def _open_segment(self, start, now):
+        self.close()
+        self._segment_start = start
+        self._file = open(os.path.join(self.directory, f"{start}.jsonl"), "a")
+        # The only point where this tier grows, so expire old data here
+        for seg_start, path in self.segments():
+            if seg_start + self.segment <= now - self.retention:
+                os.unlink(path)
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._segment_start = None
+
+    def read(self, start=None, end=None):
+        """Records with start <= timestamp <= end, from overlapping segments only."""
+        records = []
+        for seg_start, path in self.segments():
+            if end is not None and seg_start > end:
+                break
+            if start is not None and seg_start + self.segment <= start:
+                continue
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if not line.endswith("\n"):
+                            # Being written right now
+                            break
+                        record = json.loads(line)
+                        timestamp = record["timestamp"]
+                        if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                            records.append(record)
+            except FileNotFoundError:
+                # Expired while we were listing
+                continue
+        return records
+
+
+class RollupStore:
+    """
+    Raw samples plus rollup tiers in one directory.
+
+    add() is called from the sensor thread with every record and only
+    queues it; a store thread writes raw lines and maintains the rollups.
+    """
+    def __init__(self, directory=ROLLUP_DIR, retention=None, interval=1.0,
+                 queue_size=QUEUE_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        # Nominal raw resolution, for choosing a tier
+        self.interval = interval
+        self.flush_interval = flush_interval
+        retention = {**RETENTION, **(retention or {})}
+        self.tiers = [Tier(directory, name, resolution, retention[name], SEGMENT[name])
+                      for name, resolution in TIERS]
+        self.dropped = 0
+        self.latest = None
+        self._prev_timestamp = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rollups", daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, record):
+        """Queue one sample; dropped (and counted) if the store falls behind."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def reset(self):
+        """
+        A new sensor run starts: its first sample has no previous one to
+        measure the interval from, so it is kept raw but not rolled up.
+        """
+        self._queue.put(_RESET)
+
+    def close(self):
+        """Write what is queued and the open buckets, then stop."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is _RESET:
+                    self._prev_timestamp = None
+                elif item is not None:
+                    self.ingest(item)
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    for tier in self.tiers:
+                        tier.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self._close_buckets()
+            for tier in self.tiers:
+                tier.close()
+
+    def ingest(self, record):
+        """Append one sample to the raw tier and update the rollups."""
+        timestamp = record["timestamp"]
+        self.latest = timestamp
+        raw = self.tiers[0]
+        raw.append(timestamp, _encode(record) + "\n")
+        prev, self._prev_timestamp = self._prev_timestamp, timestamp
+        if prev is None or timestamp <= prev:
+            return
+        tier = self.tiers[1]
+        start = timestamp // tier.resolution * tier.resolution
+        if tier.bucket is not None and tier.bucket.start != start:
+            self._close_bucket(1)
+        if tier.bucket is None:
+            tier.bucket = Rollup(start, tier.resolution)
+        tier.bucket.add_sample(record, timestamp - prev)
+
+    def _close_bucket(self, level):
+        """Write the open bucket of tier `level` and merge it into the next tier."""
+        tier = self.tiers[level]
+        bucket, tier.bucket = tier.bucket, None
+        tier.append(bucket.start, _encode(bucket.to_record()) + "\n")
+        if level + 1 == len(self.tiers):
+            return
+        coarser = self.tiers[level + 1]
+        start = bucket.start // coarser.resolution * coarser.resolution
+        if coarser.bucket is not None and coarser.bucket.start != start:
+            self._close_bucket(level + 1)
+        if coarser.bucket is None:
+            coarser.bucket = Rollup(start, coarser.resolution)
+        coarser.bucket.merge(bucket)
+
+    def _close_buckets(self):
+        # Partial buckets are written (and merged upward) too; a later run
+        # continuing the same bucket writes another line that query() merges
+        for level in range(1, len(self.tiers)):
+            if self.tiers[level].bucket is not None:
+                self._close_bucket(level)
+
+    def tier(self, start=None, end=None, resolution=None):
+        """
+        The tier a query should read: the coarsest one not coarser than
+        `resolution`, or else the finest one returning at most MAX_POINTS
+        buckets; either way one that still retains `start`.
+        """
+        now = self.latest if self.latest is not None else time.time()
+        start = now - self.tiers[0].retention if start is None else start
+        end = now if end is None else end
+        retained = [tier for tier in self.tiers if start >= now - tier.retention] or self.tiers[-1:]
+        if resolution is not None:
+            finer = [tier for tier in retained if (tier.resolution or self.interval) <= resolution]
+            return finer[-1] if finer else retained[0]
+        for tier in retained:
+            if (end - start) / (tier.resolution or self.interval) <= MAX_POINTS:
+                return tier
+        return retained[-1]
+
+    def query(self, start=None, end=None, resolution=None):
+        """
+        (tier name, records) for start <= timestamp <= end. Rollup records
+        carry per scope joules, power_min/max/mean and counter sums.
+        """
+        tier = self.tier(start, end, resolution)
+        records = tier.read(start, end)
+        if tier.resolution is None:
+            return tier.name, records
+        # One bucket can be split over several lines across restarts
+        merged = {}
+        for record in records:
+            bucket = Rollup.from_record(record)
+            if bucket.start in merged:
+                merged[bucket.start].merge(bucket)
+            else:
+                merged[bucket.start] = bucket
+        return tier.name, [merged[t].to_record() for t in sorted(merged)]
+
+    def disk_usage(self):
+        """{tier name: bytes on disk}."""
+        return {tier.name: sum(os.path.getsize(path) for _, path in tier.segments())
+                for tier in self.tiers}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+samples.py - Fixed-schema in-memory sample store
+
+Event names are interned once into column indices and values live in
+preallocated array('d') columns forming a bounded ring buffer, so memory
+stays flat however long the daemon runs. Consumers read whole columns
+(in time order) instead of per-sample dicts.
+"""
+
+from array import array
+from bisect import bisect_left
+
+# Default retention when nothing is configured
+RETENTION_SECONDS = 3600
+
+# Record keys that are not cgroup scopes
+RESERVED_KEYS = {"timestamp", "system", "coverage", "late", "overhead", "processes"}
+
+
+class SampleSchema:
+    """
+    Interns (scope, event) pairs such as ("system", "power/energy-pkg/")
+    into column indices.
+    """
+    def __init__(self, columns=()):
+        self.columns = []
+        self.index = {}
+        # Bumped on every change, so readers can tell the layout moved
+        self.version = 0
+        for scope, event in columns:
+            self.add(scope, event)
+
+    def add(self, scope, event):
+        key = (scope, event)
+        if key not in self.index:
+            self.index[key] = len(self.columns)
+            self.columns.append(key)
+            self.version += 1
+        return self.index[key]
+
+    def remove_scope(self, scope):
+        """Drop every column of a scope; returns their old indices."""
+        removed = [i for i, (s, _) in enumerate(self.columns) if s == scope]
+        self.columns = [key for key in self.columns if key[0] != scope]
+        self.index = {key: i for i, key in enumerate(self.columns)}
+        self.version += 1
+        return removed
+
+    def scopes(self):
+        """Scopes in column order, e.g. ['system', 'cgroup']."""
+        return list(dict.fromkeys(scope for scope, _ in self.columns))
+
+    def __len__(self):
+        return len(self.columns)
+
+
+class SampleRing:
+    """
+    Bounded ring buffer of samples with one array('d') per column.
+    """
+    def __init__(self, schema, capacity):
+        if capacity <= 0:
+            raise ValueError("capacity must be > 0")
+        self.schema = schema
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.data = [array("d", bytes(8 * capacity)) for _ in range(len(schema))]
+        # Next slot to write and number of valid samples
+        self.head = 0
+        self.count = 0
+
+    @classmethod
+    def for_retention(cls, schema, interval, retention=RETENTION_SECONDS):
+        """Size the ring to hold `retention` seconds at `interval`."""
+        return cls(schema, max(1, int(retention / interval)))
+
+    def append(self, timestamp, values):
+        """
+        Store one sample; values is a sequence in schema column order.
+        """
+        slot = self.head
+        self.timestamps[slot] = timestamp
+        for col, value in zip(self.data, values):
+            col[slot] = value
+        self.head = (slot + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def add_scope(self, scope, events):
+        """
+        Add columns for a new scope (e.g. a cgroup attached at runtime);
+        samples taken before it existed read as NaN in columns and are left
+        out of records.
+        """
+        for event in events:
+            if (scope, event) not in self.schema.index:
+                self.schema.add(scope, event)
+                self.data.append(array("d", [float("nan")]) * self.capacity)
+
+    def drop_scope(self, scope):
+        """Free the columns of a scope (e.g. a removed cgroup)."""
+        for i in reversed(self.schema.remove_scope(scope)):
+            del self.data[i]
+
+    def _ordered(self, col, last=None):
+        """Copy of a column, oldest sample first, optionally only the last n."""
+        n = self.count if last is None else min(last, self.count)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return col[start:start + n]
+        return col[start:] + col[:self.head]
+
+    def times(self, last=None):
+        return self._ordered(self.timestamps, last)
+
+    def column(self, scope, event, last=None):
+        """All retained values of one column, oldest first."""
+        return self._ordered(self.data[self.schema.index[(scope, event)]], last)
+
+    def columns(self, last=None):
+        """{(scope, event): array} for every column."""
+        return {key: self._ordered(col, last) for key, col in zip(self.schema.columns, self.data)}
+
+    def since(self, timestamp):
+        """Number of retained samples with a timestamp >= `timestamp`."""
+        if not self.count:
+            return 0
+        # Timestamps are appended in order: binary search the cut in place,
+        # in the older run of slots [start, capacity) or the newer [0, head)
+        times = self.timestamps
+        start = (self.head - self.count) % self.capacity
+        end = start + self.count
+        if end <= self.capacity:
+            return end - bisect_left(times, timestamp, start, end)
+        if timestamp <= times[self.capacity - 1]:
+            return end - bisect_left(times, timestamp, start, self.capacity)
+        return self.head - bisect_left(times, timestamp, 0, self.head)
+
+    def row(self, index=-1):
+        """Values of one sample in column order (index -1 is the newest)."""
+        if not self.count:
+            raise IndexError("ring is empty")
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("sample index out of range")
+        slot = (self.head - self.count + index) % self.capacity
+        return self.timestamps[slot], [col[slot] for col in self.data]
+
+    def record(self, index=-1):
+        """
+        One sample as the nested dict written to the output file:
+        {"timestamp": t, scope: {event: value}}. NaN cells (no value yet)
+        are skipped, as JSON has no NaN.
+        """
+        timestamp, values = self.row(index)
+        record = {"timestamp": timestamp}
+        for (scope, event), value in zip(self.schema.columns, values):
+            if value != value:
+                continue
+            record.setdefault(scope, {})[event] = value
+        return record
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+scheduler.py - Drift-free sampling ticks
+
+Ticks are computed from an absolute monotonic deadline (start + n * interval)
+instead of sleeping for the interval after the work, so the period does not
+grow by the time the work takes and the samples stay on a fixed grid. Each
+tick reports how late it actually fired; ticks missed entirely (e.g. after a
+stall) are skipped and counted rather than fired back to back.
+
+AdaptiveScheduler samples at the base interval while the monitored cgroups
+are busy and backs off, doubling the interval up to max_interval, while they
+are idle. Intervals stay multiples of the base, so ticks remain on the grid.
+"""
+
+import threading
+import time
+
+
+class TickScheduler:
+    """
+    Yields tick deadlines on the grid start + n * interval.
+    """
+    def __init__(self, interval, stop_event=None, clock=time.monotonic):
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        self.interval = interval
+        self.stop_event = stop_event or threading.Event()
+        self.clock = clock
+        self.start = clock()
+        # Maps monotonic deadlines to wall clock timestamps for the output
+        self.wall_offset = time.time() - self.start
+        self.deadline = self.start
+        self.ticks = 0
+        self.missed = 0
+        self.last_late = 0.0
+        self.max_late = 0.0
+        self._total_late = 0.0
+
+    def current_interval(self):
+        return self.interval
+
+    def restart(self):
+        """Start a new grid from now, e.g. after a pause; stats are kept."""
+        self.start = self.deadline = self.clock()
+        self.wall_offset = time.time() - self.start
+
+    def wait(self):
+        """
+        Sleep until the next tick. Returns the tick's deadline (monotonic),
+        or None once the stop event is set.
+        """
+        self.deadline += self.current_interval()
+        now = self.clock()
+        if now - self.deadline >= self.interval:
+            # Stalled past whole ticks: skip them and stay on the grid
+            skipped = int((now - self.deadline) // self.interval)
+            self.missed += skipped
+            self.deadline += skipped * self.interval
+        remaining = self.deadline - now
+        if remaining > 0 and self.stop_event.wait(remaining):
+            return None
+        if self.stop_event.is_set():
+            return None
+        late = max(0.0, self.clock() - self.deadline)
+        self.last_late = late
+        self.max_late = max(self.max_late, late)
+        self._total_late += late
+        self.ticks += 1
+        return self.deadline
+
+    def __iter__(self):
+        while True:
+            deadline = self.wait()
+            if deadline is None:
+                return
+            yield deadline
+
+    def wall(self, deadline):
+        """Wall clock timestamp of a tick deadline."""
+        return deadline + self.wall_offset
+
+    def stats(self):
+        """Tick count, lateness (seconds) and skipped ticks so far."""
+        return {"ticks": self.ticks, "missed": self.missed,
+                "late_max": self.max_late,
+                "late_mean": self._total_late / self.ticks if self.ticks else 0.0}
+
+
+class AdaptiveScheduler(TickScheduler):
+    """
+    Base interval while busy; after each idle tick the interval doubles, up
+    to max_interval. One busy tick returns to the base interval.
+    """
+    def __init__(self, interval, max_interval, stop_event=None, clock=time.monotonic):
+        super().__init__(interval, stop_event=stop_event, clock=clock)
+        # Largest power-of-two multiple of the base not above max_interval
+        self.max_factor = 1
+        while self.max_factor * 2 * interval <= max_interval:
+            self.max_factor *= 2
+        self.factor = 1
+
+    def current_interval(self):
+        return self.interval * self.factor
+
+    def restart(self):
+        super().restart()
+        self.factor = 1
+
+    def update(self, busy):
+        """Feed back whether the last tick saw activity."""
+        if busy:
+            self.factor = 1
+        elif self.factor < self.max_factor:
+            self.factor *= 2
@@ -1,42 +1,127 @@
 #!/usr/bin/env python3
 """
-sensor.py - Tracks perf events for system and cgroup using libpfm4
+sensor.py - Tracks perf events for system and cgroup using perf_event_open
 """
 
-import ctypes
+import errno
 import os
+import resource
+import threading
 import time
-import json
+
+from perf_event import CounterSet
+from writer import JsonlWriter
+from samples import SampleSchema, SampleRing, RETENTION_SECONDS
+from cgroups import CGROUP_ROOT, cgroup_name
+from rapl import RaplReader, POWERCAP_ROOT
+from cpustat import CpuStatFile, CPU_STAT_EVENTS
+from catalog import EventCatalog, load_catalog
+from scheduler import TickScheduler, AdaptiveScheduler
+from overhead import Overhead
+from processes import ProcessBreakdown, PID_BUDGET
+from shards import ShardedCounterSet, SocketWorkers, cpu_packages, CPU_ROOT
 
 # Paths & defaults
-LIBPFM4_PATH = "/usr/lib/libpfm.so.4"   # Adjust if needed
-OUTPUT_FILE = "/usr/local/bin/powerdaemon/measurement.json"
+OUTPUT_FILE = "/usr/local/bin/powerdaemon/measurement.jsonl"
 
 # Cgroup path (to be read from config.yaml)
 CGROUP_PATH = "/sys/fs/cgroup/sensor"
 
+# fds left to everything but perf counters (files, sockets, inotify)
+FD_RESERVE = 256
+
+
+def _raise_fd_limit():
+    """
+    Raise the soft RLIMIT_NOFILE to the hard limit, as every cgroup holds
+    about one fd per event group per CPU. Returns the soft limit in effect,
+    None if unlimited.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
 class PerfSensor:
     """
     PerfSensor: Tracks system and cgroup counters in parallel.
+
+    One system-wide counter set is shared by every monitored cgroup; each
+    cgroup adds one set of per-cgroup groups and one scope in the sample,
+    keyed by its name relative to the cgroup root.
     """
-    def __init__(self, interval_sec=1.0, cgroup_path=CGROUP_PATH, output_file=OUTPUT_FILE):
+    def __init__(self, interval_sec=1.0, cgroup_paths=(CGROUP_PATH,), output_file=OUTPUT_FILE,
+                 event_file=None, detail=0, backend=None, resolver=None,
+                 retention_sec=RETENTION_SECONDS, cgroup_root=CGROUP_ROOT,
+                 energy_source="perf", powercap_root=POWERCAP_ROOT, catalog=None,
+                 max_interval=None, idle_threshold=0.0, rotate=False, recorder=None,
+                 account_self=True, self_cgroup=None, top_processes=0, pid_budget=PID_BUDGET,
+                 sharding="off", cpu_root=CPU_ROOT):
         self.interval = interval_sec
-        self.cgroup_path = cgroup_path
+        # Adaptive sampling backs off toward max_interval while every cgroup
+        # value stays at or below idle_threshold
+        self.max_interval = max_interval
+        self.idle_threshold = idle_threshold
+        self.scheduler = None
+        # Take turns between counter groups per interval instead of kernel multiplexing
+        self.rotate = rotate
+        # Called with every record after it is taken (e.g. api.ApiServer.publish)
+        self.listeners = []
+        # replay.Recorder capturing every raw read, for replaying without hardware
+        self.recorder = recorder
+        # Own CPU, wakeups, energy and stage latencies in every record
+        # (overhead.Overhead); self_cgroup as there, None for getrusage()
+        self.account_self = account_self
+        self.self_cgroup = self_cgroup
+        self.overhead = None
+        # Energy of the top_processes busiest processes per cgroup
+        # (processes.ProcessBreakdown); 0 disables
+        self.top_processes = top_processes
+        self.pid_budget = pid_budget
+        self.processes = None
+        if isinstance(cgroup_paths, str):
+            cgroup_paths = [cgroup_paths]
+        self.cgroup_paths = list(cgroup_paths)
+        self.cgroup_root = cgroup_root
         self.output_file = output_file
-        self.lib = ctypes.CDLL(LIBPFM4_PATH)
-
-        # Initialize libpfm4
-        if self.lib.pfm_initialize() != 0:
-            raise RuntimeError("libpfm4 initialization failed")
-
-        # Define minimal pfm_event_info structure
-        class pfm_event_info(ctypes.Structure):
-            _fields_ = [
-                ("name", ctypes.c_char_p),
-                ("desc", ctypes.c_char_p),
-                ("pme_type", ctypes.c_uint)
-            ]
-        self.pfm_event_info = pfm_event_info
+        self.event_file = event_file
+        # catalog.EventCatalog; loaded from the cache unless passed in
+        self.catalog = catalog
+        self.detail = detail
+        # perf_event backend, perf_event.FakePerfBackend() for machines without a PMU
+        self.backend = backend
+        self.resolver = resolver
+        # "perf" reads power/ events through the perf PMU, "rapl" through powercap sysfs
+        self.energy_source = energy_source
+        self.powercap_root = powercap_root
+        self.rapl = None
+        # Per-package counters and energy (shards.py): "on", "off", or "auto"
+        # on hosts with more than one package
+        self.sharding = sharding
+        self.cpu_root = cpu_root
+        self.packages = None
+        self.workers = None
+        # In-memory history, created once the counters are open
+        self.retention = retention_sec
+        self.samples = None
+        self._stop_flag = threading.Event()
+        # Set while sampling; pause() clears it, _wake ends the current ticks
+        self._active = threading.Event()
+        self._active.set()
+        self._wake = threading.Event()
+        self._writer = None
+        self._prev_timestamp = None
+        # Guards the cgroup counter sets, which may change while running
+        self._lock = threading.Lock()
+        self.cgroup_counters = {}
+        # Soft RLIMIT_NOFILE and the fds our counters hold against it
+        self._fd_limit = None
+        self._perf_fds = 0
 
         # Prepare system and cgroup event lists
         self.system_events = []
@@ -46,65 +131,433 @@ class PerfSensor:
 
     def _collect_events(self):
         """
-        Collect events via libpfm4 and assign system and cgroup lists.
+        Load system and cgroup event names from the event catalog (or an
+        old pc_info.json when event_file is given).
+        """
+        if self.catalog is None:
+            if self.event_file:
+                self.catalog = EventCatalog.from_pc_info(self.event_file)
+            else:
+                self.catalog = load_catalog()
+        self.system_events, self.cgroup_events = self.catalog.levels(self.detail)
+
+        print(f"[*] Collected {len(self.system_events)} events for system and "
+              f"{len(self.cgroup_events)} for cgroup")
+
+    def _open_counters(self):
+        """
+        Open the system-wide and per-cgroup counter sets once.
         """
-        count = self.lib.pfm_get_event_count()
-        info = self.pfm_event_info()
+        perf_events = self.system_events
+        if self.energy_source == "rapl":
+            self.rapl = RaplReader(self.powercap_root).open()
+            if self.rapl.domains:
+                # Energy comes from powercap, keep the perf PMU for counters only
+                perf_events = [e for e in perf_events if not e.startswith("power/")]
+            else:
+                print("[!] No readable RAPL domains, using perf power events")
+                self.rapl = None
+        packages = cpu_packages(cpu_root=self.cpu_root) if self.sharding != "off" else {}
+        if self.sharding == "on" or len(packages) > 1:
+            self.packages = packages
+            self.system_counters = ShardedCounterSet(perf_events, packages, backend=self.backend,
+                                                     resolver=self.resolver,
+                                                     rotate=self.rotate).open()
+            # Each package's worker reads its shard of every set
+            self.workers = SocketWorkers(packages) if len(packages) > 1 else None
+            print(f"[*] Counters sharded over {len(packages)} packages")
+        else:
+            self.system_counters = CounterSet(perf_events, backend=self.backend,
+                                              resolver=self.resolver, rotate=self.rotate).open()
+        # Share one backend/resolver between both sets
+        self.backend = self.system_counters.backend
+        self.resolver = self.system_counters.resolver
 
-        for idx in range(count):
-            if self.lib.pfm_get_event_info(ctypes.c_int(idx), ctypes.byref(info)) != 0:
-                continue
-            name = info.name.decode() if info.name else f"event_{idx}"
-            event_type = "cpu_core" if info.pme_type == 0 else f"pmu_type_{info.pme_type}"
-            key = f"{event_type}/{name}/"
-            # Add all events to both system and cgroup lists for now
-            self.system_events.append(key)
-            self.cgroup_events.append(key)
+        schema = SampleSchema([("system", name) for name in self.system_counters.column_names()])
+        if self.rapl:
+            for event in self.rapl.column_names(self.packages):
+                schema.add("system", event)
+        self._system_columns = len(schema)
+        self.samples = SampleRing.for_retention(schema, self.interval, self.retention)
+        # {cgroup name: (cgroup fd, CounterSet)}
+        self.cgroup_counters = {}
+        self._fd_limit = _raise_fd_limit()
+        self._perf_fds = self.system_counters.fd_count
+        for path in list(self.cgroup_paths):
+            try:
+                self._open_cgroup(path)
+            except OSError as e:
+                if e.errno != errno.EMFILE:
+                    raise
+                print(f"[!] Could not monitor {path}: {e}")
+                self.cgroup_paths.remove(path)
 
-        print(f"[*] Collected {len(self.system_events)} events for system and cgroup")
+        self.system_counters.enable()
 
-    def _open_counter(self, event_name, pid=-1, cgroup_fd=-1):
+    def _check_fds(self, path):
         """
-        Placeholder for opening perf_event via perf_event_open.
-        Currently this is a stub: you can later implement using ctypes
-        and perf_event_attr struct to read the counters.
+        Refuse another cgroup once its counters, at the fds per cgroup so
+        far, would not fit under RLIMIT_NOFILE: past it, perf_event_open
+        fails for this and every later counter.
         """
-        # For simplicity, we won't implement perf_event_open directly now
-        # Instead, you can use libpfm4 to get encoding and perf counters via subprocess if needed
-        return event_name  # just a placeholder
+        if self._fd_limit is None or not self.cgroup_counters:
+            return
+        per_cgroup = (self._perf_fds - self.system_counters.fd_count) / len(self.cgroup_counters)
+        if self._perf_fds + per_cgroup > self._fd_limit - FD_RESERVE:
+            raise OSError(errno.EMFILE, f"{len(self.cgroup_counters)} cgroups already hold "
+                          f"{self._perf_fds} fds of the {self._fd_limit} allowed (RLIMIT_NOFILE)",
+                          path)
+
+    def _open_cgroup(self, path):
+        name = cgroup_name(path, self.cgroup_root)
+        self._check_fds(path)
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        if self.packages:
+            counters = ShardedCounterSet(self.cgroup_events, self.packages, backend=self.backend,
+                                         resolver=self.resolver, cgroup_fd=fd, rotate=self.rotate)
+        else:
+            counters = CounterSet(self.cgroup_events, backend=self.backend,
+                                  resolver=self.resolver, cgroup_fd=fd, rotate=self.rotate)
+        try:
+            counters.open()
+        except BaseException:
+            # e.g. EMFILE: nothing of this cgroup stays open
+            counters.close()
+            os.close(fd)
+            raise
+        self._perf_fds += counters.fd_count + 1
+        self.cgroup_counters[name] = (fd, counters)
+        self.samples.add_scope(name, counters.column_names())
+        # A paused sensor enables it on resume()
+        if self._active.is_set():
+            counters.enable()
+
+    def _close_cgroup(self, name):
+        fd, counters = self.cgroup_counters.pop(name)
+        self._perf_fds -= counters.fd_count + 1
+        counters.close()
+        os.close(fd)
+        self.samples.drop_scope(name)
+
+    def _close_counters(self):
+        with self._lock:
+            if self.workers:
+                self.workers.close()
+                self.workers = None
+            self.system_counters.close()
+            if self.rapl:
+                self.rapl.close()
+            for name in list(self.cgroup_counters):
+                self._close_cgroup(name)
+
+    def add_cgroup(self, path):
+        """
+        Start monitoring another cgroup, also while the sensor is running.
+        """
+        with self._lock:
+            if path in self.cgroup_paths:
+                return
+            self.cgroup_paths.append(path)
+            if self.samples is not None and not self._stop_flag.is_set():
+                try:
+                    self._open_cgroup(path)
+                except OSError as e:
+                    # Gone again before we got to it
+                    print(f"[!] Could not monitor {path}: {e}")
+                    self.cgroup_paths.remove(path)
+
+    def remove_cgroup(self, path):
+        """
+        Stop monitoring a cgroup and free its counters and history.
+        """
+        with self._lock:
+            if path not in self.cgroup_paths:
+                return
+            self.cgroup_paths.remove(path)
+            name = cgroup_name(path, self.cgroup_root)
+            if name in self.cgroup_counters:
+                self._close_cgroup(name)
+
+    def _read_values(self):
+        """
+        One row of values in schema order: system first, then each cgroup.
+        """
+        if self.workers:
+            # One round per tick, all packages at once
+            sets = [self.system_counters] + [counters for _, counters in self.cgroup_counters.values()]
+            rows = self.workers.read(sets)
+        else:
+            rows = [self.system_counters.read_values()]
+            rows += [counters.read_values() for _, counters in self.cgroup_counters.values()]
+        values = rows[0]
+        if self.rapl:
+            values += self.rapl.read_values(self.packages)
+        for row in rows[1:]:
+            values += row
+        return values
 
     def read_counters(self):
         """
-        Reads system and cgroup counters at each interval.
+        Reads system and cgroup counters at each interval, until stop().
+        While paused the thread waits with everything open.
         """
-        results = []
+        with self._lock:
+            self._open_counters()
+        # No flat file when output_file is None (e.g. samples go to a RollupStore listener)
+        self._writer = JsonlWriter(self.output_file).start() if self.output_file else None
+        # pause() and stop() end the current run of ticks through _wake
+        if self.max_interval and self.max_interval > self.interval:
+            self.scheduler = AdaptiveScheduler(self.interval, self.max_interval, self._wake)
+        else:
+            self.scheduler = TickScheduler(self.interval, self._wake)
+        if self.account_self:
+            self.overhead = Overhead(self.self_cgroup, system_cgroup=self.cgroup_root)
+        if self.top_processes:
+            self.processes = ProcessBreakdown(self.top_processes, self.pid_budget,
+                                              cgroup_root=self.cgroup_root)
+        self._prev_timestamp = None
 
-        # Example loop for tracking
-        while True:
-            timestamp = time.time()
-            system_values = {}
-            cgroup_values = {}
+        try:
+            first = True
+            while True:
+                self._active.wait()
+                self._wake.clear()
+                if self._stop_flag.is_set():
+                    break
+                if self._active.is_set():
+                    if not first:
+                        # Covers the pause: counters were off, RAPL kept counting
+                        self._sample(self.scheduler.clock())
+                    first = False
+                    # One sample per tick on a fixed monotonic grid, however long reading takes
+                    self.scheduler.restart()
+                    for deadline in self.scheduler:
+                        self._sample(deadline, self.scheduler.last_late)
+                    # The last, partial interval up to now
+                    self._sample(self.scheduler.clock())
+                    if self._stop_flag.is_set():
+                        break
+                with self._lock:
+                    if not self._active.is_set():
+                        self._set_counting(False)
+        finally:
+            self._close_counters()
+            if self._writer:
+                self._writer.close()
+            if self.overhead:
+                self.overhead.close()
+            if self.processes:
+                self.processes.close()
+            stats = self.scheduler.stats()
+            print(f"[*] {stats['ticks']} ticks, {stats['missed']} missed, "
+                  f"late by {stats['late_mean'] * 1000:.2f} ms mean, {stats['late_max'] * 1000:.2f} ms max")
 
-            # Fake reading values for demonstration
-            for ev in self.system_events:
-                system_values[ev] = 0  # replace with actual counter read
-            for ev in self.cgroup_events:
-                cgroup_values[ev] = 0  # replace with actual counter read
+    def _sample(self, deadline, late=0.0):
+        """Take, store and hand on one sample for the monotonic time deadline."""
+        overhead = self.overhead
+        clock = time.perf_counter
+        t0 = clock()
+        with self._lock:
+            values = self._read_values()
+            t1 = clock()
+            timestamp = self.scheduler.wall(deadline)
+            self.samples.append(timestamp, values)
+            if self.recorder:
+                self.recorder.sample(timestamp, values, self.samples.schema)
+            record = self.samples.record()
+            coverage = self._coverage()
+            paths = list(self.cgroup_paths)
+        if coverage:
+            record["coverage"] = coverage
+        record["late"] = late
+        if isinstance(self.scheduler, AdaptiveScheduler):
+            self.scheduler.update(self._is_busy(values))
+        if self.processes:
+            prev = self._prev_timestamp
+            interval = timestamp - prev if prev is not None else None
+            record["processes"] = self.processes.sample(record, interval, paths)
+        self._prev_timestamp = timestamp
+        if overhead:
+            # Write and attribute latencies are those of the previous tick
+            overhead.add("read", t1 - t0)
+            overhead.add("parse", clock() - t1)
+            record["overhead"] = overhead.sample(record)
 
-            results.append({
-                "timestamp": timestamp,
-                "system": system_values,
-                "cgroup": cgroup_values
-            })
+        # Appended by the writer thread, one line per sample
+        t2 = clock()
+        if self._writer:
+            self._writer.write(record)
+        t3 = clock()
+        for listener in self.listeners:
+            listener(record)
+        if overhead:
+            overhead.add("write", t3 - t2)
+            overhead.add("attribute", clock() - t3)
 
-            # Write incremental JSON output
-            with open(self.output_file, "w") as f:
-                json.dump(results, f, indent=2)
+    def _set_counting(self, on):
+        """Gate every counter set with enable/disable ioctls; they stay open."""
+        sets = [self.system_counters] + [counters for _, counters in self.cgroup_counters.values()]
+        for counters in sets:
+            if on:
+                counters.enable()
+            else:
+                counters.disable()
 
-            time.sleep(self.interval)
+    def history(self, start=None, end=None):
+        """
+        Records from the in-memory history with start <= timestamp <= end
+        (either bound may be None), oldest first.
+        """
+        with self._lock:
+            if self.samples is None:
+                return []
+            samples = self.samples
+            first = len(samples) - samples.since(start) if start is not None else 0
+            records = []
+            for index in range(first, len(samples)):
+                record = samples.record(index)
+                if end is not None and record["timestamp"] > end:
+                    break
+                records.append(record)
+            return records
+
+    def stats(self):
+        """Own footprint and stage latency histograms, plus the tick schedule."""
+        stats = self.overhead.stats() if self.overhead else {}
+        if self.scheduler:
+            stats["schedule"] = self.scheduler.stats()
+        return stats
+
+    def _coverage(self):
+        """
+        {scope: {event: fraction}} for values not counted over the whole
+        interval (multiplexed or extrapolated), as the CSV parser reports it.
+        """
+        coverage = {}
+        partial = self.system_counters.partial_coverage()
+        if partial:
+            coverage["system"] = partial
+        for name, (_, counters) in self.cgroup_counters.items():
+            partial = counters.partial_coverage()
+            if partial:
+                coverage[name] = partial
+        return coverage
+
+    def _is_busy(self, values):
+        """True if any cgroup value of this tick is above the idle threshold."""
+        threshold = self.idle_threshold
+        for value in values[self._system_columns:]:
+            if value > threshold:
+                return True
+        return False
+
+    @property
+    def paused(self):
+        return not self._active.is_set()
+
+    def pause(self):
+        """
+        Stop sampling but keep counters open (disabled) and the thread
+        waiting, for resume(). Takes a last sample up to now. Returns at once.
+        """
+        self._active.clear()
+        self._wake.set()
+
+    def resume(self):
+        """
+        Continue after pause(): counters are enabled before this returns,
+        and the first sample covers the pause, so none is lost.
+        """
+        with self._lock:
+            if self._active.is_set():
+                return
+            if self.samples is not None and not self._stop_flag.is_set():
+                self._set_counting(True)
+            self._active.set()
+            self._wake.set()
 
     def stop(self):
         """
-        Cleanup if needed.
+        Stop the read loop; counters are closed by the reading thread.
         """
-        self.lib.pfm_terminate()
+        self._stop_flag.set()
+        self._wake.set()
+        # Let a paused loop see the stop
+        self._active.set()
+
+
+class CpuStatSensor(PerfSensor):
+    """
+    CpuStatSensor: PMU-free variant of PerfSensor.
+
+    Reads cpu.stat of the root cgroup (system scope) and of every monitored
+    cgroup, plus RAPL energy from powercap when readable, into the same
+    samples and output records. No perf event is opened.
+    """
+    def __init__(self, interval_sec=1.0, cgroup_paths=(CGROUP_PATH,), output_file=OUTPUT_FILE,
+                 retention_sec=RETENTION_SECONDS, cgroup_root=CGROUP_ROOT,
+                 powercap_root=POWERCAP_ROOT, max_interval=None, idle_threshold=0.0,
+                 recorder=None, account_self=True, self_cgroup=None, top_processes=0,
+                 pid_budget=PID_BUDGET):
+        super().__init__(interval_sec=interval_sec, cgroup_paths=cgroup_paths,
+                         output_file=output_file, event_file=None,
+                         retention_sec=retention_sec, cgroup_root=cgroup_root,
+                         energy_source="rapl", powercap_root=powercap_root,
+                         max_interval=max_interval, idle_threshold=idle_threshold,
+                         recorder=recorder, account_self=account_self, self_cgroup=self_cgroup,
+                         top_processes=top_processes, pid_budget=pid_budget)
+
+    def _collect_events(self):
+        self.system_events = list(CPU_STAT_EVENTS)
+        self.cgroup_events = list(CPU_STAT_EVENTS)
+
+    def _open_counters(self):
+        self.system_stat = CpuStatFile(self.cgroup_root).open()
+        self.rapl = RaplReader(self.powercap_root).open()
+        if not self.rapl.domains:
+            print("[!] No readable RAPL domains, recording CPU time only")
+            self.rapl = None
+
+        schema = SampleSchema([("system", event) for event in self.system_events])
+        if self.rapl:
+            for event in self.rapl.events:
+                schema.add("system", event)
+        self._system_columns = len(schema)
+        self.samples = SampleRing.for_retention(schema, self.interval, self.retention)
+        # {cgroup name: CpuStatFile}
+        self.cgroup_counters = {}
+        for path in self.cgroup_paths:
+            self._open_cgroup(path)
+
+    def _open_cgroup(self, path):
+        name = cgroup_name(path, self.cgroup_root)
+        self.cgroup_counters[name] = CpuStatFile(path).open()
+        self.samples.add_scope(name, self.cgroup_events)
+
+    def _close_cgroup(self, name):
+        self.cgroup_counters.pop(name).close()
+        self.samples.drop_scope(name)
+
+    def _close_counters(self):
+        with self._lock:
+            self.system_stat.close()
+            if self.rapl:
+                self.rapl.close()
+            for name in list(self.cgroup_counters):
+                self._close_cgroup(name)
+
+    def _coverage(self):
+        # cpu.stat and RAPL are read in full every tick
+        return {}
+
+    def _set_counting(self, on):
+        # cpu.stat always counts; the next read covers the pause
+        pass
+
+    def _read_values(self):
+        values = self.system_stat.read()
+        if self.rapl:
+            values += self.rapl.read_values()
+        for stat in self.cgroup_counters.values():
+            values += stat.read()
+        return values
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+shards.py - Per-socket sharded counter collection
+
+On multi-socket hosts every package has its own RAPL domain, so one
+system-wide instruction share applied to the summed energy attributes a
+cgroup busy on socket 1 with socket 0's energy. Counters are instead
+opened per package (one CounterSet over that package's CPUs) and read by
+one worker thread per package, pinned to it, so a tick's reads run side by
+side instead of one CPU after another.
+
+Records keep the summed value of every event and add one column per
+package, named "<event>@<package>" (e.g. "power/energy-pkg/@1",
+"cpu_core/instructions/@1"), for system and cgroup scopes alike.
+power.cgroup_power and attribution split each package's energy by that
+package's counters and add the results up.
+"""
+
+import os
+import threading
+
+from perf_event import CounterSet, parse_cpu_list
+
+CPU_ROOT = "/sys/devices/system/cpu"
+
+# "<event>@<package>"
+SOCKET_SEP = "@"
+
+
+def socket_event(event, package):
+    """Name of one package's column of an event."""
+    return f"{event}{SOCKET_SEP}{package}"
+
+
+def socket_values(values, event):
+    """{package: value} of an event's per-package columns in one scope's values."""
+    prefix = event + SOCKET_SEP
+    return {int(name[len(prefix):]): value for name, value in values.items()
+            if name.startswith(prefix)}
+
+
+def is_socket_event(name):
+    return SOCKET_SEP in name
+
+
+def cpu_packages(online=None, cpu_root=CPU_ROOT):
+    """
+    {package id: [cpus]} of the online CPUs, from topology/physical_package_id;
+    everything is package 0 where the topology is not exposed.
+    """
+    if online is None:
+        try:
+            with open(os.path.join(cpu_root, "online")) as f:
+                online = parse_cpu_list(f.read())
+        except OSError:
+            online = list(range(os.cpu_count() or 1))
+    packages = {}
+    for cpu in online:
+        try:
+            with open(os.path.join(cpu_root, f"cpu{cpu}", "topology", "physical_package_id")) as f:
+                package = int(f.read())
+        except (OSError, ValueError):
+            package = 0
+        packages.setdefault(package, []).append(cpu)
+    return dict(sorted(packages.items()))
+
+
+class ShardedCounterSet:
+    """
+    A CounterSet per package, each opened on that package's CPUs only.
+
+    read_values() returns the per-event sums over packages followed by every
+    package's values, in column_names() order. Shards can also be read by
+    SocketWorkers and put together with combine().
+    """
+    def __init__(self, event_names, packages, backend=None, resolver=None, cgroup_fd=-1,
+                 rotate=False):
+        self.event_names = list(event_names)
+        self.packages = dict(packages)
+        self.backend = backend
+        self.resolver = resolver
+        self.cgroup_fd = cgroup_fd
+        self.rotate = rotate
+        # {package: CounterSet}
+        self.shards = {}
+        self.events = []
+        self.failed = {}
+        # {package: union column of each of the shard's events}
+        self._columns = {}
+
+    def open(self):
+        for package, cpus in self.packages.items():
+            shard = CounterSet(self.event_names, backend=self.backend, resolver=self.resolver,
+                               cgroup_fd=self.cgroup_fd, rotate=self.rotate, cpus=cpus).open()
+            # Shared by every shard
+            self.backend = shard.backend
+            self.resolver = shard.resolver
+            self.failed.update(shard.failed)
+            self.shards[package] = shard
+        # Union in first-seen order; packages normally open the same events
+        events = {}
+        for shard in self.shards.values():
+            for ev in shard.events:
+                events.setdefault(ev.name, ev)
+        self.events = list(events.values())
+        positions = {name: i for i, name in enumerate(events)}
+        self._columns = {package: [positions[ev.name] for ev in shard.events]
+                         for package, shard in self.shards.items()}
+        return self
+
+    def column_names(self):
+        names = [ev.name for ev in self.events]
+        return names + [socket_event(name, package) for package in self.shards for name in names]
+
+    def combine(self, shard_values):
+        """{package: that shard's read_values()} -> one row in column_names() order."""
+        n = len(self.events)
+        totals = [0.0] * n
+        rows = []
+        for package, columns in self._columns.items():
+            row = [0.0] * n
+            for col, value in zip(columns, shard_values[package]):
+                row[col] = value
+                totals[col] += value
+            rows += row
+        return totals + rows
+
+    def read_values(self):
+        return self.combine({package: shard.read_values() for package, shard in self.shards.items()})
+
+    def partial_coverage(self):
+        """{event name: coverage} of the least covered package, where below 1."""
+        coverage = {}
+        for shard in self.shards.values():
+            for name, cov in shard.partial_coverage().items():
+                coverage[name] = min(cov, coverage.get(name, 1.0))
+        return coverage
+
+    @property
+    def fd_count(self):
+        return sum(shard.fd_count for shard in self.shards.values())
+
+    def enable(self):
+        for shard in self.shards.values():
+            shard.enable()
+
+    def disable(self):
+        for shard in self.shards.values():
+            shard.disable()
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+        self.shards = {}
+
+
+class SocketWorkers:
+    """
+    One thread per package, pinned to its CPUs. read(sets) has each thread
+    read its package's shard of every ShardedCounterSet, all packages at
+    once, and returns every set's combined row.
+    """
+    def __init__(self, packages, pin=True):
+        self.packages = dict(packages)
+        self.pin = pin
+        self._start = threading.Barrier(len(self.packages) + 1)
+        self._done = threading.Barrier(len(self.packages) + 1)
+        self._sets = []
+        self._results = {}
+        self._errors = []
+        self._closing = False
+        self._threads = [threading.Thread(target=self._run, args=(package, cpus),
+                                          name=f"socket{package}", daemon=True)
+                         for package, cpus in self.packages.items()]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, package, cpus):
+        if self.pin:
+            try:
+                # pid 0 is the calling thread
+                os.sched_setaffinity(0, cpus)
+            except OSError:
+                # CPUs outside our cpuset
+                pass
+        while True:
+            self._start.wait()
+            if self._closing:
+                return
+            try:
+                self._results[package] = [s.shards[package].read_values() for s in self._sets]
+            except Exception as e:
+                self._errors.append(e)
+            self._done.wait()
+
+    def read(self, sets):
+        self._sets = sets
+        self._start.wait()
+        self._done.wait()
+        if self._errors:
+            error = self._errors[0]
+            self._errors.clear()
+            raise error
+        results = self._results
+        return [s.combine({package: results[package][i] for package in s.shards})
+                for i, s in enumerate(sets)]
+
+    def close(self):
+        self._closing = True
+        self._start.wait()
+        for thread in self._threads:
+            thread.join()
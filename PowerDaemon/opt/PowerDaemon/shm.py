@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+shm.py - Latest samples in shared memory, with lock-free readers
+
+ShmPublisher (a sensor listener) writes every record into a memory-mapped
+file, by default under /dev/shm, as one row of float64 columns: every
+(scope, event) of the record plus the estimated watts of each scope as
+(scope, "power"). The last `history` rows are kept in a ring. Readers
+map the file and copy rows out with no syscall, no serialization and no
+coordination with the sampling thread; ShmReader does this for Python
+consumers.
+
+Consistency is a seqlock: the writer makes seq odd, changes the file and
+makes seq even again. A reader notes seq (retrying while odd), copies
+what it needs and retries when seq has moved meanwhile. The writer never
+waits for readers. Stores and loads go through the mmap in program order,
+which x86 keeps; readers in other languages on weakly ordered CPUs need
+acquire loads of seq.
+
+Layout (little endian), header at offset 0:
+
+    0   magic       8s  b"PWRDSHM1"
+    8   layout      u32 LAYOUT_VERSION
+    12  flags       u32 STALE once the file was replaced (reopen the path)
+    16  seq         u64 seqlock, odd while writing
+    24  head        u64 rows written since the columns last changed
+    32  capacity    u32 rows in the ring
+    36  max_columns u32 values per row slot
+    40  columns     u32 values in use
+    44  schema      u32 bumped whenever the columns change
+    48  names_off   u32 JSON list of [scope, event], one per column, the
+                        columns of a scope next to each other
+    52  names_size  u32
+    56  names_cap   u32
+    60  data_off    u32 ring of slots: timestamp, then max_columns values
+
+Row i (0 = oldest written) lives in slot i % capacity. When the columns
+change the ring starts over (head 0); when they no longer fit, a larger
+file replaces the old one and the old one is marked STALE.
+
+    reader = ShmReader()
+    reader.power()        # {"system": W, "tenant0": W, ...}
+    reader.history(100)   # last 100 records, oldest first
+"""
+
+import json
+import mmap
+import os
+import struct
+
+from power import cgroup_power, PKG
+from samples import RESERVED_KEYS
+
+SHM_PATH = "/dev/shm/powerdaemon"
+MAGIC = b"PWRDSHM1"
+LAYOUT_VERSION = 1
+STALE = 1
+
+# Rows kept
+HISTORY = 256
+# Column slots of a new file; grows (new file) when exceeded
+MAX_COLUMNS = 256
+# JSON bytes per column slot reserved for the names
+NAME_BYTES = 96
+
+HEADER = struct.Struct("<8sIIQQIIIIIIII")
+U64 = struct.Struct("<Q")
+SEQ_OFFSET = 16
+HEAD_OFFSET = 24
+FLAGS_OFFSET = 12
+
+# Reads seeing the writer busy this many times in a row give up
+MAX_RETRIES = 100000
+
+POWER = "power"
+
+
+def _page_align(size):
+    return (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+
+class ShmPublisher:
+    """
+    Writes the latest records into SHM_PATH; publish() is a sensor listener.
+    """
+    def __init__(self, path=SHM_PATH, history=HISTORY, max_columns=MAX_COLUMNS):
+        self.path = path
+        self.history = history
+        self.max_columns = max_columns
+        self.map = None
+        self.columns = []
+        self.published = 0
+        self._seq = 0
+        self._head = 0
+        self._schema = 0
+        self._prev_timestamp = None
+        self._row = None
+        self._names_offset = 0
+        self._names_cap = 0
+        self._data_offset = 0
+        self._slot_size = 0
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create(self.max_columns)
+        return self
+
+    def _create(self, max_columns):
+        """Map a new file for max_columns and put it in place of the old one."""
+        names_cap = _page_align(max_columns * NAME_BYTES)
+        names_offset = _page_align(HEADER.size)
+        data_offset = names_offset + names_cap
+        slot_size = 8 * (1 + max_columns)
+        size = data_offset + slot_size * self.history
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            new = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(new, 0, MAGIC, LAYOUT_VERSION, 0, self._seq, 0, self.history,
+                         max_columns, 0, self._schema, names_offset, 0, names_cap, data_offset)
+        os.replace(tmp, self.path)
+        old = self.map
+        self.map = new
+        self.max_columns = max_columns
+        self._names_offset = names_offset
+        self._names_cap = names_cap
+        self._data_offset = data_offset
+        self._slot_size = slot_size
+        if old is not None:
+            # Readers of the old file reopen the path
+            struct.pack_into("<I", old, FLAGS_OFFSET, STALE)
+            old.close()
+
+    def _set_columns(self, columns):
+        names = json.dumps(columns, separators=(",", ":")).encode()
+        if len(columns) > self.max_columns or len(names) > self._names_cap:
+            grow = max(len(columns), len(names) // NAME_BYTES + 1)
+            self._create(max(2 * self.max_columns, grow))
+        names_offset = self._names_offset
+        self.columns = columns
+        self._head = 0
+        self._schema += 1
+        self._row = struct.Struct(f"<{1 + len(columns)}d")
+        m = self.map
+        self._begin()
+        m[names_offset:names_offset + len(names)] = names
+        HEADER.pack_into(m, 0, MAGIC, LAYOUT_VERSION, 0, self._seq, 0, self.history,
+                         self.max_columns, len(columns), self._schema, names_offset, len(names),
+                         self._names_cap, self._data_offset)
+        self._end()
+
+    def _begin(self):
+        self._seq += 1
+        U64.pack_into(self.map, SEQ_OFFSET, self._seq)
+
+    def _end(self):
+        self._seq += 1
+        U64.pack_into(self.map, SEQ_OFFSET, self._seq)
+
+    def publish(self, record):
+        """Called by the sensor after every tick, from its thread."""
+        timestamp = record["timestamp"]
+        interval = timestamp - self._prev_timestamp if self._prev_timestamp else None
+        self._prev_timestamp = timestamp
+        watts = cgroup_power(record, interval)
+        energy = record.get("system", {}).get(PKG)
+        if energy is not None and interval:
+            watts["system"] = energy / interval
+        columns = []
+        values = []
+        for scope, scope_values in record.items():
+            if not isinstance(scope_values, dict) or (scope in RESERVED_KEYS and scope != "system"):
+                continue
+            for event, value in scope_values.items():
+                columns.append((scope, event))
+                values.append(value)
+            if scope in watts:
+                columns.append((scope, POWER))
+                values.append(watts[scope])
+
+        if columns != self.columns:
+            self._set_columns(columns)
+        slot = self._head % self.history
+        self._begin()
+        self._row.pack_into(self.map, self._data_offset + slot * self._slot_size, timestamp, *values)
+        self._head += 1
+        U64.pack_into(self.map, HEAD_OFFSET, self._head)
+        self._end()
+        self.published += 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class ShmReader:
+    """
+    Reads consistent snapshots of a ShmPublisher's file. Not thread-safe:
+    use one reader per thread.
+    """
+    def __init__(self, path=SHM_PATH):
+        self.path = path
+        self.map = None
+        self.columns = []
+        self.retries = 0
+        self._schema = None
+        # {columns: struct of a row}
+        self._rows = {}
+        self._open()
+
+    def _open(self):
+        if self.map is not None:
+            self.map.close()
+        fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            self.map = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        magic, layout = struct.unpack_from("<8sI", self.map, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            raise ValueError(f"{self.path} is not a PowerDaemon shared memory file (v{LAYOUT_VERSION})")
+        self._schema = None
+
+    def rows(self, count=1):
+        """
+        (columns, rows) of the newest `count` rows, oldest first; a row is
+        (timestamp, value, ...) in column order; no rows before the first
+        record.
+        """
+        m = self.map
+        for _ in range(MAX_RETRIES):
+            seq = U64.unpack_from(m, SEQ_OFFSET)[0]
+            if seq & 1:
+                self.retries += 1
+                # The writer may be preempted mid-write: let it finish
+                os.sched_yield()
+                continue
+            (_, _, flags, _, head, capacity, max_columns, columns, schema, names_offset,
+             names_size, _, data_offset) = HEADER.unpack_from(m, 0)
+            if flags & STALE:
+                self._open()
+                m = self.map
+                continue
+            try:
+                names = bytes(m[names_offset:names_offset + names_size]) if schema != self._schema else None
+                n = min(count, head, capacity)
+                row = self._rows.get(columns)
+                if row is None:
+                    row = self._rows[columns] = struct.Struct(f"<{1 + columns}d")
+                slot_size = 8 * (1 + max_columns)
+                rows = [row.unpack_from(m, data_offset + (i % capacity) * slot_size)
+                        for i in range(head - n, head)]
+            except (struct.error, ValueError, ZeroDivisionError):
+                # Header read halfway through a change; seq will differ
+                rows = None
+            if rows is not None and U64.unpack_from(m, SEQ_OFFSET)[0] == seq:
+                if names is not None:
+                    self.columns = [tuple(column) for column in json.loads(names or b"[]")]
+                    self._schema = schema
+                return self.columns, rows
+            self.retries += 1
+        raise TimeoutError(f"{self.path} stayed busy for {MAX_RETRIES} attempts")
+
+    def _record(self, row):
+        record = {"timestamp": row[0]}
+        for (scope, event), value in zip(self.columns, row[1:]):
+            record.setdefault(scope, {})[event] = value
+        return record
+
+    def latest(self):
+        """The newest record as {"timestamp": t, scope: {event: value}}, None if there is none."""
+        _, rows = self.rows(1)
+        return self._record(rows[-1]) if rows else None
+
+    def history(self, count=None):
+        """Up to `count` (default: all kept) newest records, oldest first."""
+        _, rows = self.rows(count if count is not None else 1 << 62)
+        return [self._record(row) for row in rows]
+
+    def power(self):
+        """{scope: watts} of the newest record."""
+        columns, rows = self.rows(1)
+        if not rows:
+            return {}
+        return {scope: value for (scope, event), value in zip(columns, rows[-1][1:])
+                if event == POWER}
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
@@ -1,68 +1,177 @@
-import inotify.adapters
 import os
 import threading
-import time
+
+from notify import Inotify, EventLoop, IN_MODIFY, IN_DELETE_SELF, IN_IGNORED, IN_Q_OVERFLOW
 
 class CgroupWatcher:
     """
-    Watches a single cgroup for PID changes and triggers callbacks.
+    Watches cgroups for their first PID arriving and their last one leaving.
+
+    Uses the cgroup v2 'populated' flag in cgroup.events: the kernel sends
+    IN_MODIFY on that file whenever the flag flips, the watcher thread
+    blocks in epoll until then, and each change costs one pread() no
+    matter how many PIDs the cgroup holds.
     """
 
-    def __init__(self, cgroup_path, on_pid_added=None, on_empty=None, poll_interval=1.0):
+    def __init__(self, cgroup_path, on_pid_added=None, on_empty=None):
         """
-        :param cgroup_path: Path to the cgroup (e.g., '/sys/fs/cgroup/sensor')
-        :param on_pid_added: Callback when a PID is added: f(cgroup_path)
-        :param on_empty: Callback when cgroup becomes empty: f(cgroup_path)
-        :param poll_interval: Seconds to wait between empty checks
+        :param cgroup_path: Path to the cgroup (e.g., '/sys/fs/cgroup/sensor') or a list of paths
+        :param on_pid_added: Callback when a cgroup becomes populated: f(cgroup_path)
+        :param on_empty: Callback when a cgroup becomes empty: f(cgroup_path)
         """
-        self.cgroup_path = cgroup_path
+        if isinstance(cgroup_path, str):
+            cgroup_path = [cgroup_path]
+        self.cgroup_paths = list(cgroup_path)
         self.on_pid_added = on_pid_added
         self.on_empty = on_empty
-        self.poll_interval = poll_interval
         self._stop_flag = threading.Event()
         self._thread = None
+        self._lock = threading.Lock()
+        # {cgroup path: populated}
+        self.populated = {}
+        # {watch descriptor: (cgroup path, cgroup.events fd)}
+        self._watches = {}
+        self._inotify = Inotify()
+        self._loop = EventLoop(self._inotify)
+        for path in self.cgroup_paths:
+            self.add(path)
+
+    def add(self, cgroup_path):
+        """Start watching another cgroup; returns its current populated state."""
+        events_file = os.path.join(cgroup_path, "cgroup.events")
+        if not os.path.exists(events_file):
+            raise FileNotFoundError(f"Not a cgroup v2 directory: {cgroup_path}")
+        fd = os.open(events_file, os.O_RDONLY | os.O_CLOEXEC)
+        wd = self._inotify.add_watch(events_file, IN_MODIFY | IN_DELETE_SELF)
+        with self._lock:
+            if wd in self._watches:
+                # Already watched (the kernel hands back the same wd)
+                os.close(fd)
+                return self.populated[self._watches[wd][0]]
+            self._watches[wd] = (cgroup_path, fd)
+            self.populated[cgroup_path] = self._read_populated(fd)
+            if cgroup_path not in self.cgroup_paths:
+                self.cgroup_paths.append(cgroup_path)
+            return self.populated[cgroup_path]
+
+    def remove(self, cgroup_path):
+        """Stop watching a cgroup."""
+        with self._lock:
+            for wd, (path, fd) in list(self._watches.items()):
+                if path == cgroup_path:
+                    self._inotify.rm_watch(wd)
+                    self._forget(wd)
+
+    def _forget(self, wd):
+        path, fd = self._watches.pop(wd)
+        os.close(fd)
+        self.populated.pop(path, None)
+        if path in self.cgroup_paths:
+            self.cgroup_paths.remove(path)
+
+    @staticmethod
+    def _read_populated(fd):
+        """Parse 'populated 0|1' from cgroup.events."""
+        try:
+            data = os.pread(fd, 256, 0)
+        except OSError:
+            return False
+        start = data.find(b"populated ")
+        return start != -1 and data[start + 10:start + 11] == b"1"
+
+    def is_populated(self, cgroup_path=None):
+        """True if the cgroup (or, without a path, any watched cgroup) has PIDs."""
+        if cgroup_path is None:
+            return any(self.populated.values())
+        return self.populated.get(cgroup_path, False)
+
+    def is_empty(self, cgroup_path=None):
+        return not self.is_populated(cgroup_path)
 
     def start(self):
-        """Start watching the cgroup in a separate thread."""
+        """Start watching the cgroups in a separate thread."""
         self._thread = threading.Thread(target=self._watch_cgroup, daemon=True)
         self._thread.start()
 
     def stop(self):
-        """Stop watching the cgroup."""
+        """Stop watching the cgroups."""
         self._stop_flag.set()
+        self._loop.wake()
         if self._thread:
             self._thread.join()
+            self._thread = None
 
-    def _watch_cgroup(self):
-        """Internal method to watch the cgroup using inotify."""
-        if not os.path.exists(self.cgroup_path):
-            raise FileNotFoundError(f"Cgroup path does not exist: {self.cgroup_path}")
-
-        previous_count = 0
-        i = inotify.adapters.Inotify()
-        procs_file = os.path.join(self.cgroup_path, "cgroup.procs")
-        i.add_watch(procs_file)
-
-        while not self._stop_flag.is_set():
-            for event in i.event_gen(yield_nones=False):
-                (_, type_names, path, filename) = event
-                if filename == "cgroup.procs" and "IN_MODIFY" in type_names:
-                    current_count = self._count_pids(procs_file)
+    def close(self):
+        self.stop()
+        with self._lock:
+            for wd in list(self._watches):
+                self._forget(wd)
+        self._loop.close()
+        self._inotify.close()
 
-                    if current_count > previous_count and self.on_pid_added:
-                        self.on_pid_added(self.cgroup_path)
+    def check_events(self, timeout=-1):
+        """
+        Wait up to timeout seconds (-1 = forever) for changes and apply them.
+        Returns a list of (cgroup_path, populated) transitions.
+        """
+        events = self._loop.wait(timeout)
+        changes = []
+        overflow = False
+        with self._lock:
+            for wd, mask, _, _ in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if wd not in self._watches:
+                    continue
+                path, fd = self._watches[wd]
+                if mask & (IN_DELETE_SELF | IN_IGNORED):
+                    # cgroup was removed, so it is empty for good
+                    was = self.populated.get(path, False)
+                    self._forget(wd)
+                    if was:
+                        changes.append((path, False))
+                    continue
+                now = self._read_populated(fd)
+                if now != self.populated.get(path):
+                    self.populated[path] = now
+                    changes.append((path, now))
+        if overflow:
+            changes.extend(self.resync())
+        return changes
 
-                    elif current_count == 0 and previous_count > 0 and self.on_empty:
-                        self.on_empty(self.cgroup_path)
+    def resync(self):
+        """
+        Re-read every watched cgroup after an inotify queue overflow, whose
+        lost events may have included flips and removals. Returns the
+        (cgroup_path, populated) transitions found.
+        """
+        changes = []
+        with self._lock:
+            for wd, (path, fd) in list(self._watches.items()):
+                if not os.path.exists(os.path.join(path, "cgroup.events")):
+                    was = self.populated.get(path, False)
+                    self._inotify.rm_watch(wd)
+                    self._forget(wd)
+                    if was:
+                        changes.append((path, False))
+                    continue
+                now = self._read_populated(fd)
+                if now != self.populated.get(path):
+                    self.populated[path] = now
+                    changes.append((path, now))
+        return changes
 
-                    previous_count = current_count
-            #time.sleep(self.poll_interval)
+    def _watch_cgroup(self):
+        """Internal event loop: block in epoll and fire callbacks on transitions."""
+        # Report cgroups that already have PIDs when watching starts
+        for path, populated in list(self.populated.items()):
+            if populated and self.on_pid_added:
+                self.on_pid_added(path)
 
-    @staticmethod
-    def _count_pids(procs_file):
-        """Return the number of PIDs currently in the cgroup."""
-        try:
-            with open(procs_file, "r") as f:
-                return len([line for line in f if line.strip()])
-        except FileNotFoundError:
-            return 0
+        while not self._stop_flag.is_set():
+            for path, populated in self.check_events():
+                if populated and self.on_pid_added:
+                    self.on_pid_added(path)
+                elif not populated and self.on_empty:
+                    self.on_empty(path)
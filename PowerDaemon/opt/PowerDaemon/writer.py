@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+writer.py - Append-only JSON Lines output for PowerDaemon
+
+Samples are handed to a dedicated writer thread through a bounded queue
+and appended one record per line, so each tick costs O(1) no matter how
+long the run is. Flush/fsync is batched by record count or elapsed time.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+# Defaults for batching
+QUEUE_SIZE = 1024
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 1.0
+# Seconds between checks that the writer thread is alive while the queue is full
+PUT_TIMEOUT = 0.1
+
+_STOP = object()
+
+
+class JsonlWriter:
+    """
+    Background JSON Lines writer.
+
+    write() only enqueues; if the queue is full it blocks (backpressure)
+    unless block=False, in which case the record is dropped and counted.
+    """
+    def __init__(self, path, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, fsync=True):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        """Open the file and start the writer thread."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a")
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, record, block=True):
+        """Queue one record for writing."""
+        if self._error:
+            raise RuntimeError(f"writer for {self.path} failed: {self._error}")
+        if not block:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+        elif not self._put(record):
+            raise RuntimeError(f"writer for {self.path} failed: {self._error}")
+
+    def _put(self, item):
+        """Blocking put that gives up (False) once the writer thread is gone."""
+        while True:
+            try:
+                self._queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                if not self._thread.is_alive():
+                    return False
+
+    def close(self):
+        """Flush everything still queued and stop the thread."""
+        if self._thread is None:
+            return
+        # A dead thread (e.g. disk full) drains nothing: do not wait on it
+        if self._thread.is_alive():
+            self._put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _run(self):
+        dumps = json.JSONEncoder(separators=(",", ":")).encode
+        pending = 0
+        last_flush = time.monotonic()
+        try:
+            while True:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+                try:
+                    record = self._queue.get(timeout=timeout if pending else None)
+                except queue.Empty:
+                    record = None
+                if record is _STOP:
+                    break
+                if record is not None:
+                    self._file.write(dumps(record))
+                    self._file.write("\n")
+                    self.written += 1
+                    pending += 1
+                if pending and (pending >= self.batch_size
+                                or time.monotonic() - last_flush >= self.flush_interval):
+                    self._flush()
+                    pending = 0
+                    last_flush = time.monotonic()
+        except Exception as e:
+            self._error = e
+            raise
+        finally:
+            # After a failed write the flush fails the same way; the file is
+            # closed regardless and the first error is the one reported
+            try:
+                self._flush()
+            except (OSError, ValueError) as e:
+                self._error = self._error or e
+            try:
+                self._file.close()
+            except OSError:
+                pass
+
+
+def read_records(path):
+    """
+    Iterate over records of a measurement file, either JSON Lines, a
+    legacy JSON array written by older versions or an archive (archive.py).
+    """
+    from archive import ArchiveReader, is_archive
+    if is_archive(path):
+        with ArchiveReader(path) as archive:
+            yield from archive.records()
+        return
+    with open(path) as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == "[":
+            f.seek(0)
+            yield from json.load(f)
+            return
+        f.seek(0)
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
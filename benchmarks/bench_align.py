@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+bench_align.py - Positional pairing against align.Aligner on drifting outputs
+
+Synthesizes the two `perf stat -x, -I` outputs of a collector run: the
+system-wide one (energy, instructions) and the --for-each-cgroup one,
+started --skew seconds later, whose intervals run --drift seconds long or
+short each and which drops one interval every --drop intervals. The load
+alternates every --phase seconds between busy (the cgroup runs most
+instructions, power is high) and idle. Both outputs go through
+PerfCsvParser, then are merged by position (zip_longest + merge_records,
+the old collector) and by an Aligner. Reports the cgroup's attributed
+energy against exact counts on the same tick grid.
+
+Then times Aligner.push per record for growing numbers of sources.
+
+    python3 benchmarks/bench_align.py --seconds 600 --drift 0.002 --drop 50
+"""
+
+import argparse
+import time
+from itertools import zip_longest
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from align import Aligner
+from power import cgroup_power, PKG
+from perf_csv import PerfCsvParser, merge_records
+
+INSTRUCTIONS = "cpu_core/instructions/"
+CGROUP = "tenant"
+
+
+def busy(t, phase):
+    return int(t // phase) % 2 == 0
+
+
+def rates(t, phase):
+    """(watts, system instructions/s, cgroup instructions/s) at time t."""
+    if busy(t, phase):
+        return 90.0, 4e9, 3e9
+    return 50.0, 1e9, 0.1e9
+
+
+def integrate(start, end, phase):
+    """Exact counts over [start, end): energy, system and cgroup instructions."""
+    totals = [0.0, 0.0, 0.0]
+    t = start
+    while t < end:
+        # Up to the next phase change or the end
+        step = min(end, (t // phase + 1) * phase) - t
+        for i, rate in enumerate(rates(t, phase)):
+            totals[i] += rate * step
+        t += step
+    return totals
+
+
+def outputs(seconds, interval, skew, drift, drop, phase):
+    """perf stat -x, lines of the system and cgroup outputs, times relative to their start."""
+    sys_lines = []
+    prev = 0.0
+    t = interval
+    while t <= seconds:
+        energy, ins, _ = integrate(prev, t, phase)
+        sys_lines.append(f"{t:.9f},{energy:.2f},Joules,{PKG},{int(interval * 1e9)},100.00,,")
+        sys_lines.append(f"{t:.9f},{ins:.0f},,{INSTRUCTIONS},{int(interval * 1e9)},100.00,,")
+        prev, t = t, t + interval
+    cg_lines = []
+    prev = 0.0
+    n = 1
+    t = interval + drift
+    while t + skew <= seconds:
+        _, _, ins = integrate(prev + skew, t + skew, phase)
+        if not drop or n % drop:
+            cg_lines.append(f"{t:.9f},{ins:.0f},,{INSTRUCTIONS},{CGROUP},{int(interval * 1e9)},100.00,,")
+            prev = t
+        n += 1
+        t += interval + drift
+    return sys_lines, cg_lines
+
+
+def attributed(records):
+    """Joules attributed to the cgroup over a record stream."""
+    energy = 0.0
+    prev = None
+    for record in records:
+        timestamp = record["timestamp"]
+        if prev is not None and timestamp > prev and CGROUP in record and "system" in record:
+            interval = timestamp - prev
+            energy += cgroup_power(record, interval).get(CGROUP, 0.0) * interval
+        prev = timestamp
+    return energy
+
+
+def exact(start, end, interval, phase):
+    """
+    The cgroup's energy from exact counts on the tick grid from start to
+    end: the best any merge of interval counters can do.
+    """
+    energy = 0.0
+    t = start
+    while t < end - interval / 2:
+        joules, ins, cg = integrate(t, t + interval, phase)
+        energy += joules * cg / ins
+        t += interval
+    return energy
+
+
+def accuracy(args):
+    sys_lines, cg_lines = outputs(args.seconds, args.interval, args.skew, args.drift, args.drop,
+                                  args.phase)
+    sys_records = list(PerfCsvParser().parse(sys_lines))
+    cg_records = list(PerfCsvParser(cgroups=True).parse(cg_lines))
+    positional = [merge_records(s, c) for s, c in zip_longest(sys_records, cg_records)]
+
+    aligner = Aligner(args.interval)
+    aligner.add_source("system", offset=0.0)
+    aligner.add_source("cgroup", offset=args.skew)
+    aligned = []
+    # Interleaved by arrival, as the reader threads would see them
+    arrivals = sorted([(r["timestamp"], "system", r) for r in sys_records]
+                      + [(r["timestamp"] + args.skew, "cgroup", r) for r in cg_records],
+                      key=lambda a: a[0])
+    for _, name, record in arrivals:
+        aligned += aligner.push(name, record)
+    aligned += aligner.flush()
+    gaps = sum(1 for r in aligned if r["coverage"].get(CGROUP))
+
+    # Both runs attribute from the end of their first record on
+    truth_positional = exact(positional[0]["timestamp"], positional[-1]["timestamp"],
+                             args.interval, args.phase)
+    truth_aligned = exact(aligned[0]["timestamp"], aligned[-1]["timestamp"], args.interval,
+                          args.phase)
+    print(f"{args.seconds:g} s, {args.interval:g} s ticks, cgroup output {args.skew * 1000:g} ms late, "
+          f"drifting {args.drift * 1000:g} ms/interval, one interval in {args.drop} dropped")
+    print(f"{'merge':>11} {'records':>8} {'marked':>7} {'cgroup J':>10} {'exact J':>10} {'error':>8}")
+    for name, records, truth, marked in (("positional", positional, truth_positional, "-"),
+                                         ("aligned", aligned, truth_aligned, gaps)):
+        energy = attributed(records)
+        print(f"{name:>11} {len(records):8} {marked:>7} {energy:10.1f} {truth:10.1f} "
+              f"{(energy - truth) / truth:8.2%}")
+
+
+def throughput(args):
+    print()
+    print(f"{'sources':>8} {'us/record':>10}")
+    events = {f"event{i}": 1000.0 for i in range(4)}
+    for sources in args.sources:
+        aligner = Aligner(args.interval)
+        for i in range(sources):
+            aligner.add_source(f"s{i}", offset=i * 0.0001)
+        records = [[{"timestamp": n * args.interval * (1 + 0.0001 * i), f"scope{i}": dict(events),
+                     "coverage": {}} for n in range(1, args.records + 1)]
+                   for i in range(sources)]
+        start = time.perf_counter()
+        for n in range(args.records):
+            for i in range(sources):
+                aligner.push(f"s{i}", records[i][n])
+        aligner.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{sources:>8} {elapsed / (sources * args.records) * 1e6:10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=600.0)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--skew", type=float, default=0.004)
+    parser.add_argument("--drift", type=float, default=0.002)
+    parser.add_argument("--drop", type=int, default=50)
+    parser.add_argument("--phase", type=float, default=2.5)
+    parser.add_argument("--sources", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+    accuracy(args)
+    throughput(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+bench_api.py - Load test of the daemon's socket API
+
+Starts an ApiServer on a temporary socket, connects N subscribers and M
+pollers (sending "latest" every --poll-ms) from a separate process, then
+publishes --ticks samples of --cgroups cgroups at --rate Hz. Reports the
+cost publish() adds to the sampling thread, the fan-out time on the server
+loop and how many samples the clients received. publish() itself is O(1);
+its measured time also includes waiting for the GIL while the server
+thread fans out, which dominates when the clients share the same CPU.
+
+    python3 benchmarks/bench_api.py --subscribers 0,100,500 --pollers 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from api import ApiServer
+
+
+def make_record(timestamp, cgroups):
+    record = {"timestamp": timestamp,
+              "system": {"power/energy-pkg/": 30.0, "cpu_core/instructions/": 1e10}}
+    for i in range(cgroups):
+        record[f"tenant{i}"] = {"cpu_core/instructions/": 1e10 / cgroups}
+    return record
+
+
+async def clients(path, subscribers, pollers, poll_ms, duration):
+    received = {"samples": 0, "latest": 0}
+
+    async def subscriber():
+        reader, writer = await asyncio.open_unix_connection(path, limit=1 << 22)
+        writer.write(b'{"cmd": "subscribe"}\n')
+        try:
+            while await reader.readline():
+                received["samples"] += 1
+        finally:
+            writer.close()
+
+    async def poller():
+        reader, writer = await asyncio.open_unix_connection(path, limit=1 << 22)
+        while True:
+            writer.write(b'{"cmd": "latest"}\n')
+            if not await reader.readline():
+                break
+            received["latest"] += 1
+            await asyncio.sleep(poll_ms / 1000)
+
+    tasks = [asyncio.create_task(subscriber()) for _ in range(subscribers)]
+    tasks += [asyncio.create_task(poller()) for _ in range(pollers)]
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    print(json.dumps(received), flush=True)
+
+
+def run(path, args, subscribers):
+    server = ApiServer(path).start()
+    fanout = server._fanout
+    fanout_time = [0.0]
+
+    def timed_fanout(payload):
+        start = time.perf_counter()
+        fanout(payload)
+        fanout_time[0] += time.perf_counter() - start
+    server._fanout = timed_fanout
+
+    duration = args.ticks / args.rate
+    proc = subprocess.Popen([sys.executable, __file__, "--client", path, "--subscribers", str(subscribers),
+                             "--pollers", str(args.pollers), "--poll-ms", str(args.poll_ms),
+                             "--duration", str(duration + 1.0)], stdout=subprocess.PIPE, text=True)
+    # Let the clients connect
+    deadline = time.monotonic() + 10
+    while len(server.subscribers) < subscribers and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+
+    publish_time = 0.0
+    next_tick = time.monotonic()
+    for tick in range(args.ticks):
+        record = make_record(time.time(), args.cgroups)
+        start = time.perf_counter()
+        server.publish(record)
+        publish_time += time.perf_counter() - start
+        next_tick += 1 / args.rate
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    received = json.loads(proc.communicate()[0])
+    server.stop()
+    print(f"{subscribers:5d} subscribers, {args.pollers} pollers: "
+          f"publish {publish_time / args.ticks * 1e6:7.1f} us/tick, "
+          f"fan-out {fanout_time[0] / args.ticks * 1e6:8.1f} us/tick, "
+          f"{received['samples'] / max(1, subscribers):6.1f}/{args.ticks} samples per subscriber, "
+          f"{received['latest']} latest replies, {server.dropped} dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", default="0,100,500")
+    parser.add_argument("--pollers", type=int, default=100)
+    parser.add_argument("--poll-ms", type=float, default=100.0)
+    parser.add_argument("--cgroups", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=10.0)
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--duration", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        asyncio.run(clients(args.client, int(args.subscribers), args.pollers, args.poll_ms, args.duration))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for subscribers in (int(n) for n in args.subscribers.split(",")):
+            run(os.path.join(tmp, "api.sock"), args, subscribers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+bench_archive.py - Archive size and range queries against JSON measurement files
+
+Synthesizes --hours of sensor records at --hz (system events, --cgroups
+cgroups with perf counters and cpu.stat, coverage and lateness, overhead
+every 100 records) and writes them as JSON Lines, as the legacy indented
+JSON array and as archives with each codec. Reports the sizes, the time
+to pack and unpack, and the latency of "energy of every scope over
+--window seconds in the middle of the run": parsing the whole JSON file
+against ArchiveReader.energy, and of one event's series against
+ArchiveReader.series.
+
+    python3 benchmarks/bench_archive.py --hours 2 --hz 1 --cgroups 20
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from power import cgroup_power, PKG
+from archive import CODECS, ArchiveReader, pack, unpack
+from writer import read_records
+
+INSTRUCTIONS = "cpu_core/instructions/"
+
+
+def synthesize(path, hours, hz, cgroups):
+    random.seed(0)
+    interval = 1.0 / hz
+    timestamp = 1700000000.0
+    rows = int(hours * 3600 * hz)
+    with open(path, "w") as f:
+        for n in range(rows):
+            timestamp += interval + random.gauss(0, 2e-4)
+            record = {"timestamp": timestamp, "late": abs(random.gauss(0, 5e-4))}
+            total = 0
+            for i in range(cgroups):
+                ins = random.randint(0, 2 * 10 ** 9) if i % 3 else 0
+                total += ins
+                record[f"tenant{i}"] = {INSTRUCTIONS: ins,
+                                        "cpu_core/cycles/": int(ins * 1.3),
+                                        "cpu_core/cache-misses/": ins // 500,
+                                        "cpu.stat/usage_usec": float(ins // 4000)}
+            record["system"] = {PKG: round(40 + total / 1e9 * 2 * interval, 6),
+                                "power/energy-ram/": round(5 + random.random(), 6),
+                                INSTRUCTIONS: total + random.randint(0, 10 ** 8)}
+            record["coverage"] = ({"tenant1": {INSTRUCTIONS: 0.5}} if n % 250 == 0 else {})
+            if n % 100 == 0:
+                record["overhead"] = {"cpu_share": random.random() / 100,
+                                      "stages": {"read": {"mean": random.random() / 1e4}}}
+            f.write(json.dumps(record) + "\n")
+    return rows
+
+
+def json_energy(path, start, end):
+    """What answering the query from a JSON file costs: every record parsed."""
+    joules = {}
+    for record in read_records(path):
+        if start <= record["timestamp"] <= end:
+            energy = record.get("system", {}).get(PKG)
+            if energy is not None:
+                joules["system"] = joules.get("system", 0.0) + energy
+            for scope, share in cgroup_power(record, 1.0).items():
+                joules[scope] = joules.get(scope, 0.0) + share
+    return joules
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--hz", type=float, default=1.0)
+    parser.add_argument("--cgroups", type=int, default=20)
+    parser.add_argument("--window", type=float, default=300.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        jsonl = os.path.join(root, "measurement.jsonl")
+        rows = synthesize(jsonl, args.hours, args.hz, args.cgroups)
+        legacy = os.path.join(root, "measurement.json")
+        with open(legacy, "w") as f:
+            json.dump(list(read_records(jsonl)), f, indent=4)
+        print(f"{rows} records, {args.cgroups} cgroups, query over {args.window:g} s mid-run")
+
+        with open(jsonl) as f:
+            first = json.loads(f.readline())["timestamp"]
+        start = first + args.hours * 1800
+        end = start + args.window
+
+        print(f"{'format':>12} {'MB':>8} {'ratio':>6} {'pack s':>7} {'unpack s':>9} "
+              f"{'energy ms':>10} {'series ms':>10}")
+        base = os.path.getsize(jsonl)
+        truth = None
+        for name, path in (("json array", legacy), ("jsonl", jsonl)):
+            elapsed, joules = timed(json_energy, path, start, end, repeat=1)
+            truth = truth or joules
+            size = os.path.getsize(path)
+            print(f"{name:>12} {size / 1e6:8.2f} {base / size:6.1f} {'-':>7} {'-':>9} "
+                  f"{elapsed * 1000:10.1f} {'-':>10}")
+        for codec in CODECS:
+            path = os.path.join(root, f"run-{codec}.pda")
+            pack_s, _ = timed(lambda: pack(jsonl, path, codec=codec), repeat=1)
+            unpack_s, _ = timed(unpack, path, os.path.join(root, "back.jsonl"), repeat=1)
+            with ArchiveReader(path) as archive:
+                energy_s, joules = timed(archive.energy, start, end)
+                series_s, _ = timed(archive.series, "system", PKG, start, end)
+            if any(abs(joules[s] - truth[s]) > 1e-6 * max(1.0, abs(truth[s])) for s in truth):
+                print(f"[!] {codec}: energy differs from the JSON answer")
+            size = os.path.getsize(path)
+            print(f"{codec:>12} {size / 1e6:8.2f} {base / size:6.1f} {pack_s:7.2f} {unpack_s:9.2f} "
+                  f"{energy_s * 1000:10.1f} {series_s * 1000:10.2f}")
+        if list(read_records(os.path.join(root, "back.jsonl"))) != list(read_records(jsonl)):
+            print("[!] unpacked records differ from the original")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+bench_attribution.py - Time to attribute a long run to many cgroups
+
+Builds a synthetic run (default: one day at 1 Hz, 300 cgroups) directly as
+arrays and times every attribution model over both RAPL domains. Before
+that, times loading: --load-intervals of those intervals turned into
+records (as read_records returns them) and back through run_from_records.
+
+    python3 benchmarks/bench_attribution.py --intervals 86400 --cgroups 300
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from attribution import (Run, MODELS, DOMAINS, INSTRUCTIONS, CYCLES, CPU_TIME, attribute,
+                         run_from_records)
+
+EXTRA_EVENTS = ["cpu_core/cache-misses/", "cpu_core/branch-misses/"]
+
+
+def synthetic_run(n, cgroups, seed=0):
+    rng = np.random.default_rng(seed)
+    events = [INSTRUCTIONS, CYCLES] + EXTRA_EVENTS
+    groups = {e: rng.uniform(0, 1e8, size=(n, cgroups)) for e in events}
+    # cpu.stat CPU time (usec per 1 s interval), for the cputime model
+    groups[CPU_TIME] = rng.uniform(0, 1e6, size=(n, cgroups))
+    system = {e: groups[e].sum(axis=1) * 1.2 for e in [*events, CPU_TIME]}
+    # Some idle intervals with nothing counted
+    system[INSTRUCTIONS][::1000] = 0.0
+    dynamic = system[INSTRUCTIONS] * 2e-9 + system["cpu_core/cache-misses/"] * 5e-8
+    system["power/energy-pkg/"] = 5.0 + dynamic
+    system["power/energy-cores/"] = 2.0 + 0.7 * dynamic
+    return Run(np.arange(n, dtype=np.float64), system, groups, [f"tenant{i}" for i in range(cgroups)])
+
+
+def records_of(run, n):
+    """The first n intervals of a run as sensor records."""
+    records = []
+    for i in range(n):
+        record = {"timestamp": float(run.times[i]),
+                  "system": {e: float(col[i]) for e, col in run.system.items()}}
+        for j, cg in enumerate(run.cgroups):
+            record[cg] = {e: float(col[i, j]) for e, col in run.groups.items()}
+        records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--intervals", type=int, default=86400)
+    parser.add_argument("--cgroups", type=int, default=300)
+    parser.add_argument("--load-intervals", type=int, default=3600)
+    args = parser.parse_args()
+
+    run = synthetic_run(args.intervals, args.cgroups)
+    records = records_of(run, min(args.load_intervals, args.intervals))
+    for label, cgroups in (("discovered", None), ("given", run.cgroups)):
+        start = time.perf_counter()
+        loaded = run_from_records(records, cgroups=cgroups)
+        elapsed = time.perf_counter() - start
+        if not np.array_equal(loaded.groups[INSTRUCTIONS], run.groups[INSTRUCTIONS][:len(records)]):
+            print("[!] loaded run differs from the records")
+        print(f"load {len(records)} records, cgroups {label}: {elapsed * 1000:8.1f} ms")
+    del records
+    print(f"{args.intervals} intervals x {args.cgroups} cgroups, domains {', '.join(DOMAINS)}")
+    for name in sorted(MODELS):
+        start = time.perf_counter()
+        result = attribute(run, name)
+        elapsed = time.perf_counter() - start
+        pkg = result["power/energy-pkg/"]
+        print(f"{name:>13}: {elapsed * 1000:8.1f} ms  "
+              f"(attributed {pkg.sum() / run.system['power/energy-pkg/'].sum() * 100:5.1f}% of pkg energy)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+bench_capping.py - Power-cap enforcement on a synthetic power trace
+
+A fake cgroupfs tree (cpu.max, cpu.stat) and a plant standing in for the
+kernel and the hardware: every tick each cgroup uses its demand (CPUs,
+with --noise relative jitter) up to the limit in its cpu.max, the package
+draws --idle W plus --watts-per-cpu W per busy CPU, and cpu.stat and a
+sensor record (energy, instructions) are written from that. The record
+goes to PowerCapper.update as the sensor's listener would hand it on.
+
+tenant0 has a --budget W budget; its demand steps from 1 CPU to --high
+CPUs and back, the others run 1 CPU each. Reports, per hysteresis: ticks
+from the step up until tenant0 is back under budget, ticks over budget
+after that, cpu.max writes, and ticks from the step down until the
+throttle is released. Then times update() per tick with --cgroups capped
+cgroups.
+
+    python3 benchmarks/bench_capping.py --high 6 --budget 30 --hysteresis 0 0.1 0.2
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import fakes
+from power import PKG
+from capping import PowerCapper
+
+INSTRUCTIONS = "cpu_core/instructions/"
+# Instructions per CPU second
+IPS = 2e9
+
+
+class Plant:
+    """cgroups sharing a package; step() runs one tick and returns its record."""
+    def __init__(self, root, names, interval, idle, watts_per_cpu, noise, cpus):
+        self.root = root
+        self.names = names
+        self.interval = interval
+        self.idle = idle
+        self.watts_per_cpu = watts_per_cpu
+        self.noise = noise
+        self.cpus = cpus
+        self.usage = dict.fromkeys(names, 0)
+        self.timestamp = 1700000000.0
+        fakes.make_cgroup_tree(root, names)
+        for name in names:
+            self._write(name, "cpu.max", "max 100000\n")
+            self._write_stat(name)
+
+    def _write(self, name, filename, text):
+        with open(os.path.join(self.root, name, filename), "w") as f:
+            f.write(text)
+
+    def _write_stat(self, name):
+        usage = self.usage[name]
+        self._write(name, "cpu.stat", f"usage_usec {usage}\nuser_usec {usage}\nsystem_usec 0\n")
+
+    def limit(self, name):
+        with open(os.path.join(self.root, name, "cpu.max")) as f:
+            quota, period = f.read().split()
+        return self.cpus if quota == "max" else int(quota) / int(period)
+
+    def step(self, demand):
+        """demand: {name: CPUs wanted}. Returns (record, {name: CPUs used})."""
+        used = {}
+        for name in self.names:
+            wanted = demand[name] * (1 + random.uniform(-self.noise, self.noise))
+            used[name] = max(0.0, min(wanted, self.limit(name)))
+            self.usage[name] += int(used[name] * self.interval * 1e6)
+            self._write_stat(name)
+        self.timestamp += self.interval
+        busy = sum(used.values())
+        record = {"timestamp": self.timestamp,
+                  "system": {PKG: (self.idle + self.watts_per_cpu * busy) * self.interval,
+                             INSTRUCTIONS: int(busy * IPS * self.interval) + 1}}
+        for name in self.names:
+            record[name] = {INSTRUCTIONS: int(used[name] * IPS * self.interval)}
+        return record, used
+
+
+def attributed(record, name, interval):
+    system = record["system"]
+    return system[PKG] / interval * record[name][INSTRUCTIONS] / system[INSTRUCTIONS]
+
+
+def control(args, hysteresis):
+    random.seed(1)
+    names = [f"tenant{i}" for i in range(4)]
+    with tempfile.TemporaryDirectory() as root:
+        plant = Plant(root, names, args.interval, args.idle, args.watts_per_cpu, args.noise,
+                      args.cpus)
+        capper = PowerCapper({"tenant0": args.budget}, hysteresis=hysteresis,
+                             engage_ticks=args.engage_ticks, cgroup_root=root, cpus=args.cpus)
+        up, down = args.ticks, 3 * args.ticks
+        settled = released = None
+        over = 0
+        writes = 0
+        for tick in range(4 * args.ticks):
+            high = up <= tick < down
+            demand = {name: 1.0 for name in names}
+            demand["tenant0"] = args.high if high else 1.0
+            record, _ = plant.step(demand)
+            watts = attributed(record, "tenant0", args.interval)
+            if high:
+                if settled is None and watts <= args.budget:
+                    settled = tick - up
+                elif settled is not None and watts > args.budget:
+                    over += 1
+            if tick == down:
+                writes = capper.writes
+            if tick >= down and released is None and not capper.throttled:
+                released = tick - down
+            capper.update(record)
+        capper.close()
+        return settled, over, writes, released, capper.writes
+
+
+def throughput(args):
+    names = [f"cg{i}" for i in range(args.cgroups)]
+    with tempfile.TemporaryDirectory() as root:
+        plant = Plant(root, names, args.interval, args.idle, 1.0, args.noise, args.cpus)
+        # Steady demands of 0.5 to 3 CPUs against a budget of about 1.5:
+        # half the cgroups end up throttled
+        demand = {name: random.uniform(0.5, 3.0) for name in names}
+        capper = PowerCapper(default=(args.idle / len(names) + 1.0) * 1.5, cgroup_root=root,
+                             cpus=args.cpus)
+        elapsed = 0.0
+        steady = 0
+        for tick in range(args.ticks):
+            record, _ = plant.step(demand)
+            writes = capper.writes
+            start = time.perf_counter()
+            capper.update(record)
+            if tick >= args.ticks // 2:
+                elapsed += time.perf_counter() - start
+                steady += capper.writes - writes
+        ticks = args.ticks - args.ticks // 2
+        print(f"\n{args.cgroups} capped cgroups, {len(capper.throttled)} throttled: "
+              f"{capper.writes} cpu.max writes in {args.ticks} ticks, {steady} in the last {ticks}, "
+              f"update() {elapsed / ticks * 1e6:.0f} us per tick there")
+        capper.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--ticks", type=int, default=60, help="Ticks per phase")
+    parser.add_argument("--budget", type=float, default=30.0)
+    parser.add_argument("--high", type=float, default=6.0)
+    parser.add_argument("--idle", type=float, default=20.0)
+    parser.add_argument("--watts-per-cpu", type=float, default=8.0)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--cpus", type=int, default=16)
+    parser.add_argument("--engage-ticks", type=int, default=2)
+    parser.add_argument("--hysteresis", type=float, nargs="+", default=[0.0, 0.1, 0.2])
+    parser.add_argument("--cgroups", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"tenant0: 1 -> {args.high:g} -> 1 CPUs, {args.budget:g} W budget, "
+          f"{args.noise:.0%} noise, engage after {args.engage_ticks} ticks over")
+    print(f"{'hysteresis':>10} {'settle ticks':>13} {'over after':>11} {'writes':>7} "
+          f"{'release ticks':>14}")
+    for hysteresis in args.hysteresis:
+        settled, over, writes, released, _ = control(args, hysteresis)
+        print(f"{hysteresis:10g} {settled if settled is not None else '-':>13} {over:11} "
+              f"{writes:7} {released if released is not None else '-':>14}")
+    throughput(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+bench_cgroups.py - Cost of each additional monitored cgroup
+
+Runs PerfSensor's counter setup and per-tick read against FakePerfBackend
+and fake sysfs/cgroup trees for increasing cgroup counts, and reports
+open time, per-tick read time and counter fds, in total and per cgroup.
+
+    python3 benchmarks/bench_cgroups.py --cgroups 1 50 300 --cpus 16
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import fakes
+from perf_event import EventResolver, FakePerfBackend
+from sensor import PerfSensor
+
+SYSTEM_EVENTS = ["cpu_core/instructions/", "power/energy-pkg/", "power/energy-cores/"]
+GROUP_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/"]
+
+
+def measure(root, ncgroups, cpus, ticks):
+    pmu_root, online = fakes.make_pmu_tree(root, cpus=cpus)
+    event_file = fakes.make_event_file(os.path.join(root, "pc_info.json"), SYSTEM_EVENTS, GROUP_EVENTS)
+    cg_root = os.path.join(root, "cgroup")
+    paths = fakes.make_cgroup_tree(cg_root, [f"tenant{i}" for i in range(ncgroups)])
+
+    backend = FakePerfBackend()
+    sensor = PerfSensor(interval_sec=1.0, cgroup_paths=paths, output_file=os.path.join(root, "out.jsonl"),
+                        event_file=event_file, backend=backend,
+                        resolver=EventResolver(pmu_root, online), cgroup_root=cg_root)
+    start = time.perf_counter()
+    sensor._open_counters()
+    open_time = time.perf_counter() - start
+    fds = len(backend.events)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sensor.samples.append(0.0, sensor._read_values())
+    tick_time = (time.perf_counter() - start) / ticks
+    sensor._close_counters()
+    return open_time, tick_time, fds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cgroups", type=int, nargs="+", default=[1, 10, 50, 100, 300])
+    parser.add_argument("--cpus", type=int, default=8)
+    parser.add_argument("--ticks", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'cgroups':>8} {'open ms':>9} {'tick ms':>9} {'fds':>7} {'tick us/cg':>11} {'fds/cg':>7}")
+    base = None
+    for n in args.cgroups:
+        with tempfile.TemporaryDirectory() as root:
+            open_time, tick_time, fds = measure(root, n, args.cpus, args.ticks)
+        if base is None:
+            base = (n, tick_time, fds)
+        extra = max(n - base[0], 1)
+        per_cg = (tick_time - base[1]) / extra if n != base[0] else tick_time
+        fds_per_cg = (fds - base[2]) / extra if n != base[0] else fds
+        print(f"{n:>8} {open_time * 1000:>9.1f} {tick_time * 1000:>9.3f} {fds:>7} "
+              f"{per_cg * 1e6:>11.1f} {fds_per_cg:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+bench_collector.py - Draining the collector's perf outputs
+
+Puts fake_perf.py on PATH as `perf` and runs the collector's two CSV
+outputs (system-wide and --for-each-cgroup with --cgroups cgroups) for
+--intervals intervals at --hz, two ways: the old loop, which paired the
+outputs with zip_longest over blocking reads, and collector.run_sources
+(asyncio, both pipes read at once, aligned). --rate 0 has both fake
+perfs write as fast as they are read. Reports the wall time, records
+written, the input rate and how long each perf spent blocked in write()
+on a full pipe, which a real perf would spend late.
+
+    python3 benchmarks/bench_collector.py --cgroups 10 50 --hz 100 --intervals 2000 --rate 0
+"""
+
+import argparse
+import json
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import zip_longest
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from perf_csv import PerfCsvParser, stat_command, merge_records
+from writer import JsonlWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from collector import run_sources  # noqa: E402
+
+FAKE_PERF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_perf.py")
+SYSTEM_EVENTS = ["power/energy-pkg/", "power/energy-ram/", "cpu_core/instructions/",
+                 "cpu_core/cycles/"]
+GROUP_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/", "cpu_core/branches/",
+                "cpu_core/cache-misses/"]
+
+
+def install_perf(root):
+    """A `perf` on PATH that runs fake_perf.py."""
+    path = os.path.join(root, "perf")
+    with open(path, "w") as f:
+        f.write(f"#!/bin/sh\nexec {sys.executable} {FAKE_PERF} \"$@\"\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ["PATH"] = root + os.pathsep + os.environ["PATH"]
+
+
+def commands(cgroups, interval_ms, duration):
+    names = [f"tenant{i}" for i in range(cgroups)]
+    return [("system", stat_command(SYSTEM_EVENTS, interval_ms, duration=duration)),
+            ("cgroup", stat_command(GROUP_EVENTS, interval_ms, cgroups=names, duration=duration))]
+
+
+def run_zip(cmds, writer):
+    # What run_csv_monitor did before: one blocking read after the other
+    sysproc = subprocess.Popen(cmds[0][1], stderr=subprocess.PIPE, text=True)
+    groupproc = subprocess.Popen(cmds[1][1], stderr=subprocess.PIPE, text=True)
+    sys_records = PerfCsvParser().parse(sysproc.stderr)
+    cg_records = PerfCsvParser(cgroups=True).parse(groupproc.stderr)
+    for sysrec, cgrec in zip_longest(sys_records, cg_records):
+        writer.write(merge_records(sysrec, cgrec))
+    sysproc.wait()
+    groupproc.wait()
+
+
+def run_async(cmds, writer, interval):
+    parsers = {"system": PerfCsvParser(), "cgroup": PerfCsvParser(cgroups=True)}
+    run_sources([(name, cmd, parsers[name]) for name, cmd in cmds], interval, writer)
+
+
+def run(root, mode, cgroups, hz, intervals, rate):
+    interval_ms = int(round(1000 / hz))
+    stats = os.path.join(root, f"{mode}-{cgroups}.stats")
+    os.environ["FAKE_PERF_STATS"] = stats
+    os.environ["FAKE_PERF_RATE"] = str(rate if rate is not None else hz)
+    cmds = commands(cgroups, interval_ms, intervals * interval_ms / 1000)
+    output = os.path.join(root, "out.jsonl")
+    open(output, "w").close()
+    writer = JsonlWriter(output, fsync=False).start()
+    start = time.perf_counter()
+    if mode == "zip":
+        run_zip(cmds, writer)
+    else:
+        run_async(cmds, writer, interval_ms / 1000)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    with open(output) as f:
+        records = sum(1 for _ in f)
+    with open(stats) as f:
+        perfs = {("cgroup" if s["cgroup"] else "system"): s for s in map(json.loads, f)}
+    size = sum(s["bytes"] for s in perfs.values())
+    return elapsed, records, size, perfs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cgroups", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--hz", type=float, default=100.0)
+    parser.add_argument("--intervals", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Intervals/s each fake perf writes (0: as fast as read; "
+                             "default: real time at --hz)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        install_perf(root)
+        rate = args.rate if args.rate is not None else args.hz
+        print(f"{args.intervals} intervals at {args.hz:g} Hz, fake perf writing "
+              f"{'as fast as read' if not rate else f'{rate:g} intervals/s'}")
+        print(f"{'cgroups':>8} {'mode':>6} {'seconds':>8} {'records':>8} {'MB/s':>7} "
+              f"{'sys blocked s':>14} {'cg blocked s':>13}")
+        for cgroups in args.cgroups:
+            for mode in ("zip", "async"):
+                elapsed, records, size, perfs = run(root, mode, cgroups, args.hz, args.intervals,
+                                                    args.rate)
+                print(f"{cgroups:>8} {mode:>6} {elapsed:8.2f} {records:8} {size / elapsed / 1e6:7.1f} "
+                      f"{perfs['system']['blocked']:14.2f} {perfs['cgroup']['blocked']:13.2f}")
+
+
+if __name__ == "__main__":
+    main()
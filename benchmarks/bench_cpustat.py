@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+bench_cpustat.py - Per-tick cost of the PMU-free cpu.stat sensor
+
+Opens cpu.stat for N fake cgroups (plus RAPL energy from a fake powercap
+tree) and times one sensor tick: read every cgroup and append the row to
+the sample ring. cpu.stat on cgroupfs is generated on every read, so the
+real cost is somewhat higher than on the tmpfs used here.
+
+    python3 benchmarks/bench_cpustat.py --cgroups 1000 --ticks 200
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import fakes
+from sensor import CpuStatSensor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cgroups", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cgroot = os.path.join(tmp, "cgroup")
+        paths = fakes.make_cgroup_tree(cgroot, [f"tenant{i}" for i in range(args.cgroups)])
+        powercap = fakes.make_powercap_tree(os.path.join(tmp, "powercap"))
+        sensor = CpuStatSensor(cgroup_paths=paths, output_file=os.devnull,
+                               cgroup_root=cgroot, powercap_root=powercap)
+        sensor._open_counters()
+        print(f"{args.cgroups} cgroups, {len(sensor.samples.schema)} columns")
+
+        start = time.perf_counter()
+        for tick in range(args.ticks):
+            sensor.samples.append(float(tick), sensor._read_values())
+        elapsed = (time.perf_counter() - start) / args.ticks
+        sensor._close_counters()
+
+    print(f"per tick:   {elapsed * 1000:7.2f} ms")
+    print(f"per cgroup: {elapsed / args.cgroups * 1e6:7.2f} us")
+
+
+if __name__ == "__main__":
+    main()
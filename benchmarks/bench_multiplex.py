@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+bench_multiplex.py - Kernel multiplexing vs per-interval group rotation
+
+Requests more events than the (fake) PMU has counters and compares, per
+tick: group reads, time, and how the values are covered. With kernel
+multiplexing every group is read and each is counted for a fraction of
+the interval; with rotation one slot is read per tick, counted fully, and
+the other slots are extrapolated from their last measurement. Times are
+those of the fake backend (whose multiplexing model is itself O(groups));
+the reads per tick are what carries over to real hardware.
+
+    python3 benchmarks/bench_multiplex.py --events 24 --counters 4 --cpus 8
+"""
+
+import argparse
+import tempfile
+import time
+
+import fakes
+from perf_event import FakePerfBackend, EventResolver, CounterSet
+
+
+def run(names, pmu, online, counters, rotate, ticks):
+    backend = FakePerfBackend(counters={4: counters})
+    counter_set = CounterSet(names, backend=backend, resolver=EventResolver(pmu, online),
+                             rotate=rotate).open()
+    counter_set.enable()
+    counter_set.read_values()
+    reads = backend.reads
+    counted = 0.0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        counter_set.read_values()
+        counted += sum(counter_set.coverage) / len(counter_set.coverage)
+    elapsed = (time.perf_counter() - start) / ticks
+    slots = max(len(pmu_slots) for pmu_slots in counter_set.slots.values())
+    sizes = sorted({len(g.events) for g in counter_set.groups})
+    counter_set.close()
+    return slots, sizes, (backend.reads - reads) / ticks, elapsed, counted / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=24)
+    parser.add_argument("--counters", type=int, default=4)
+    parser.add_argument("--cpus", type=int, default=8)
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pmu, online = fakes.make_pmu_tree(tmp, cpus=args.cpus)
+        names = [f"cpu_core/event=0x{i + 1:02x}/" for i in range(args.events)]
+        print(f"{args.events} events, {args.counters} counters per CPU, {args.cpus} CPUs")
+        for rotate in (False, True):
+            slots, sizes, reads, elapsed, coverage = run(names, pmu, online, args.counters,
+                                                         rotate, args.ticks)
+            print(f"{'rotate' if rotate else 'kernel':>6}: {slots} slots of {sizes} events, "
+                  f"{reads:5.1f} reads/tick, {elapsed * 1e6:7.1f} us/tick, "
+                  f"mean coverage {coverage:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+bench_overhead.py - What self-accounting reports, and what it costs
+
+Runs the PMU-free sensor on fake cgroup/powercap trees at each --rates
+(Hz) for --seconds, with self-accounting off and on. Reports the process
+CPU share and wakeups/s measured from outside (getrusage from the first
+tick to the end of the window, leaving out setup and shutdown) next to
+what the sensor's own "overhead" stats report over the same window
+(differences of its totals), plus the CPU per tick, with and without the
+accounting.
+
+    python3 benchmarks/bench_overhead.py --rates 1 10 100 --seconds 3
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import threading
+import time
+
+import fakes
+from sensor import CpuStatSensor
+
+
+def run(root, rate, seconds, account_self, cgroups):
+    paths = fakes.make_cgroup_tree(os.path.join(root, "cg"), [f"tenant{i}" for i in range(cgroups)])
+    sensor = CpuStatSensor(interval_sec=1.0 / rate, cgroup_paths=paths, output_file=None,
+                           cgroup_root=os.path.join(root, "cg"),
+                           powercap_root=fakes.make_powercap_tree(os.path.join(root, "pc")),
+                           account_self=account_self)
+    thread = threading.Thread(target=sensor.read_counters)
+    thread.start()
+    # Counters open and the first tick taken: measure the steady state only
+    while sensor.samples is None or not len(sensor.samples):
+        time.sleep(0.001)
+    first = sensor.stats()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    time.sleep(seconds)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    elapsed = time.monotonic() - start
+    last = sensor.stats()
+    sensor.stop()
+    thread.join()
+    cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+    wakeups = after.ru_nvcsw - before.ru_nvcsw
+    ticks = last["schedule"]["ticks"] - first["schedule"]["ticks"]
+    reported = None
+    if account_self:
+        uptime = last["uptime"] - first["uptime"]
+        woken = (last["wakeups_per_sec"] * last["uptime"]
+                 - first["wakeups_per_sec"] * first["uptime"])
+        reported = ((last["cpu"] - first["cpu"]) / uptime, woken / uptime)
+    return cpu / elapsed, wakeups / elapsed, cpu / max(ticks, 1), reported
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--cgroups", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'Hz':>5} {'accounting':>10} {'CPU %':>7} {'wakeups/s':>10} {'us CPU/tick':>12} "
+          f"{'reported CPU %':>15} {'reported wakeups/s':>19}")
+    for rate in args.rates:
+        for account_self in (False, True):
+            with tempfile.TemporaryDirectory() as root:
+                share, wakeups, per_tick, reported = run(root, rate, args.seconds, account_self,
+                                                         args.cgroups)
+            reported = (f"{reported[0] * 100:15.3f} {reported[1]:19.1f}"
+                        if reported else f"{'-':>15} {'-':>19}")
+            print(f"{rate:>5g} {'on' if account_self else 'off':>10} {share * 100:7.3f} "
+                  f"{wakeups:10.1f} {per_tick * 1e6:12.1f} {reported}")
+
+
+if __name__ == "__main__":
+    main()
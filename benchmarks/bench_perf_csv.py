@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+bench_perf_csv.py - Throughput of the perf stat CSV parser
+
+Replays recorded `perf stat -x, -I` stderr (or a synthetic recording) through
+perf_csv.PerfCsvParser and reports lines/sec, and how much of one core a
+given sampling rate would use. Lines are fed in batches of about one
+READ_SIZE read each, as collector.read_source hands them to feed_lines.
+
+    python3 benchmarks/bench_perf_csv.py                      # synthetic
+    python3 benchmarks/bench_perf_csv.py --file perf.stderr --cgroups 1
+"""
+
+import argparse
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from perf_csv import PerfCsvParser
+
+# collector.READ_SIZE
+READ_SIZE = 65536
+
+
+def synthetic_recording(intervals, events, cgroups, interval_ms=10):
+    """
+    Lines shaped like `perf stat -x, -I` output, including multiplexed,
+    <not counted> and <not supported> counters.
+    """
+    lines = []
+    for i in range(1, intervals + 1):
+        ts = f"{i * interval_ms / 1000:.9f}"
+        for cg in range(max(cgroups, 1)):
+            for e in range(events):
+                if e % 97 == 3:
+                    value, pct = "<not counted>", "0.00"
+                elif e % 101 == 5:
+                    value, pct = "<not supported>", ""
+                else:
+                    value, pct = str(1000003 * (e + 1) + i), "100.00" if e < 8 else "37.50"
+                event = f"cpu_core/event_{e}/"
+                if cgroups:
+                    lines.append(f"{ts},{value},,{event},tenant{cg},10001234,{pct},,")
+                else:
+                    lines.append(f"{ts},{value},,{event},10001234,{pct},,")
+    return lines
+
+
+def batches(lines, size=READ_SIZE):
+    """Lines grouped as they come out of reads of `size` bytes."""
+    out = []
+    batch = []
+    nbytes = 0
+    for line in lines:
+        line = line.strip()
+        batch.append(line)
+        nbytes += len(line) + 1
+        if nbytes >= size:
+            out.append(batch)
+            batch = []
+            nbytes = 0
+    if batch:
+        out.append(batch)
+    return out
+
+
+def parse(batched, cgroups):
+    parser = PerfCsvParser(cgroups=cgroups)
+    records = sum(len(parser.feed_lines(batch)) for batch in batched)
+    return records + (parser.flush() is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", help="Recorded perf stat -x, stderr to replay.")
+    parser.add_argument("--cgroups", type=int, default=10,
+                        help="Synthetic cgroups, 0 for system-wide lines (with --file: >0 if it has a cgroup column).")
+    parser.add_argument("--events", type=int, default=300, help="Synthetic events per cgroup.")
+    parser.add_argument("--intervals", type=int, default=100, help="Synthetic intervals.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=100.0, help="Sampling rate (Hz) to project core usage for.")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            lines = f.readlines()
+    else:
+        lines = synthetic_recording(args.intervals, args.events, args.cgroups)
+    cgroups = args.cgroups > 0
+    batched = batches(lines)
+
+    best = None
+    records = 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        records = parse(batched, cgroups)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    lines_per_sec = len(lines) / best
+    lines_per_interval = len(lines) / max(records, 1)
+    core_share = args.rate * lines_per_interval / lines_per_sec
+    print(f"lines:               {len(lines)}")
+    print(f"intervals:           {records}")
+    print(f"best time:           {best * 1000:.1f} ms")
+    print(f"lines/sec:           {lines_per_sec:,.0f}")
+    print(f"core used at {args.rate:g} Hz: {core_share * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+bench_plot.py - Streaming decimation and headless rendering vs run length
+
+Writes synthetic measurement files (100 Hz, --cgroups cgroups) of each
+--minutes length, then times plot.decimate_file (one streaming pass, a
+MinMaxDecimator per series) and plot.render (Agg, PNG) separately. The
+read grows with the run, the points handed to matplotlib and the render
+time do not. Rendering is skipped when matplotlib is not installed.
+
+    python3 benchmarks/bench_plot.py --minutes 1 10 60
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from writer import JsonlWriter
+from plot import decimate_file, render, POWER
+
+
+def write_run(path, samples, cgroups, rate):
+    with JsonlWriter(path, fsync=False) as writer:
+        for i in range(samples):
+            load = 0.5 + 0.5 * math.sin(i / (rate * 30))
+            record = {"timestamp": 1_700_000_000.0 + i / rate,
+                      "system": {"power/energy-pkg/": (20.0 + 40.0 * load) / rate,
+                                 "cpu_core/instructions/": 1e8 * (0.1 + load)}}
+            for c in range(cgroups):
+                record[f"tenant{c}"] = {"cpu_core/instructions/": 1e8 * load / cgroups}
+            writer.write(record)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--rate", type=float, default=100.0)
+    parser.add_argument("--cgroups", type=int, default=4)
+    parser.add_argument("--points", type=int, default=2000)
+    args = parser.parse_args()
+
+    try:
+        import matplotlib  # noqa: F401
+        can_render = True
+    except ImportError:
+        can_render = False
+        print("[!] matplotlib not installed, timing decimation only")
+
+    print(f"{'minutes':>8} {'samples':>9} {'read+decimate s':>16} {'points':>7} {'render s':>9}")
+    for minutes in args.minutes:
+        samples = int(minutes * 60 * args.rate)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "measurement.jsonl")
+            write_run(path, samples, args.cgroups, args.rate)
+            series = [("system", POWER)] + [(f"tenant{c}", POWER) for c in range(args.cgroups)]
+            start = time.perf_counter()
+            decimators = decimate_file(path, series, args.points)
+            read_time = time.perf_counter() - start
+            points = max(len(d.points()[0]) for d in decimators.values())
+            render_time = "-"
+            if can_render:
+                start = time.perf_counter()
+                render(decimators, os.path.join(tmp, "run.png"), points=args.points)
+                render_time = f"{time.perf_counter() - start:9.2f}"
+        print(f"{minutes:>8g} {samples:>9} {read_time:>16.2f} {points:>7} {render_time:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+bench_processes.py - Per-process breakdown under PID churn
+
+Starts --pids sleeping child processes, lists them in a fake cgroup.procs
+and replaces --churn of them before every tick, like a cgroup running
+short-lived jobs. Each tick is then split per process twice: by
+processes.ProcessBreakdown (kept-open fds, work only for PIDs that came
+or went, at most --budget stat files open) and by the naive approach that
+reads cgroup.procs and opens every /proc/<pid>/stat anew each tick.
+Process creation is not timed.
+
+    python3 benchmarks/bench_processes.py --pids 50 500 --churn 0.1 --budget 256
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import fakes
+from processes import ProcessBreakdown, PROC_ROOT, STAT_READ_SIZE
+
+RECORD = {"system": {"power/energy-pkg/": 50.0, "cpu.stat/usage_usec": 1e6},
+          "jobs": {"cpu.stat/usage_usec": 4e5}}
+
+
+def naive_tick(path):
+    """Reopen everything: returns the number of files opened."""
+    with open(os.path.join(path, "cgroup.procs")) as f:
+        pids = f.read().split()
+    for pid in pids:
+        try:
+            with open(os.path.join(PROC_ROOT, pid, "stat"), "rb") as f:
+                data = f.read(STAT_READ_SIZE)
+            fields = data[data.rindex(b")") + 2:].split(None, 13)
+            int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return len(pids) + 1
+
+
+def spawn(n):
+    return [subprocess.Popen(["sleep", "600"]) for _ in range(n)]
+
+
+def write_procs(path, children):
+    with open(os.path.join(path, "cgroup.procs"), "w") as f:
+        f.write("".join(f"{child.pid}\n" for child in children))
+
+
+def run(root, pids, churn, budget, ticks):
+    path = fakes.make_cgroup_tree(root, ["jobs"])[0]
+    children = spawn(pids)
+    breakdown = ProcessBreakdown(top=10, pid_budget=budget, cgroup_root=root)
+    replace = max(1, int(pids * churn))
+    kept = naive = 0.0
+    kept_opens = naive_opens = 0
+    try:
+        breakdown.sample(RECORD, None, [path])
+        for _ in range(ticks):
+            for child in children[:replace]:
+                child.kill()
+                child.wait()
+            children = children[replace:] + spawn(replace)
+            write_procs(path, children)
+
+            tracked = set(breakdown.trackers[path].stats)
+            start = time.perf_counter()
+            entry = breakdown.sample(RECORD, 1.0, [path])
+            kept += time.perf_counter() - start
+            kept_opens += len(set(breakdown.trackers[path].stats) - tracked)
+            start = time.perf_counter()
+            naive_opens += naive_tick(path)
+            naive += time.perf_counter() - start
+        open_fds = breakdown.open_slots
+        untracked = entry["jobs"]["untracked"]
+    finally:
+        breakdown.close()
+        for child in children:
+            child.kill()
+            child.wait()
+    return (kept / ticks, naive / ticks, kept_opens / ticks, naive_opens / ticks, open_fds,
+            untracked)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pids", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--churn", type=float, default=0.1, help="Fraction replaced per tick")
+    parser.add_argument("--budget", type=int, default=256)
+    parser.add_argument("--ticks", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'pids':>6} {'kept-open us/tick':>18} {'opens/tick':>11} {'reopen us/tick':>15} "
+          f"{'opens/tick':>11} {'open fds':>9} {'untracked':>10}")
+    for pids in args.pids:
+        with tempfile.TemporaryDirectory() as root:
+            kept, naive, kept_opens, naive_opens, fds, untracked = run(
+                root, pids, args.churn, args.budget, args.ticks)
+        print(f"{pids:>6} {kept * 1e6:18.1f} {kept_opens:11.1f} {naive * 1e6:15.1f} "
+              f"{naive_opens:11.0f} {fds:>9} {untracked:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+bench_rapl.py - Per-tick cost of reading energy from powercap sysfs
+
+Times RaplReader.read_values() (one pread per zone on descriptors kept
+open) against reopening every energy_uj file each tick, on a fake
+powercap tree unless --root points at the real one.
+
+First checks RaplDomain.read on a fake zone whose counter starts just
+below max_energy_range_uj: one read without a wrap, then one across it.
+
+    python3 benchmarks/bench_rapl.py --packages 2 --ticks 100000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fakes
+from rapl import RaplReader
+
+
+def check_wraparound(max_range=262143328850):
+    """Deltas of a fake package zone read before and across its wrap."""
+    with tempfile.TemporaryDirectory() as tmp:
+        start = max_range - 3000000
+        root = fakes.make_powercap_tree(tmp, max_range=max_range, energy_uj=start)
+        reader = RaplReader(root).open()
+        package = reader.domains[0]
+        # 2 J, no wrap
+        fakes.set_energy(root, "intel-rapl:0", start + 2000000)
+        steady = package.read()
+        # 1 J up to the wrap and 1.5 J past it
+        fakes.set_energy(root, "intel-rapl:0", 1500000)
+        wrapped = package.read()
+        reader.close()
+    ok = abs(steady - 2.0) < 1e-9 and abs(wrapped - 2.5) < 1e-9
+    print(f"[{'*' if ok else '!'}] wraparound: {steady:g} J without wrap (expected 2), "
+          f"{wrapped:g} J across it (expected 2.5)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", help="powercap root (default: fake tree)")
+    parser.add_argument("--packages", type=int, default=2)
+    parser.add_argument("--ticks", type=int, default=100000)
+    args = parser.parse_args()
+
+    if not check_wraparound():
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root or fakes.make_powercap_tree(tmp, packages=args.packages)
+        reader = RaplReader(root).open()
+        print(f"{len(reader.domains)} zones, events {', '.join(reader.events)}")
+
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            reader.read_values()
+        kept_open = (time.perf_counter() - start) / args.ticks
+
+        paths = [os.path.join(d.path, "energy_uj") for d in reader.domains]
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            for path in paths:
+                with open(path) as f:
+                    int(f.read())
+        reopened = (time.perf_counter() - start) / args.ticks
+        reader.close()
+
+    print(f"kept open: {kept_open * 1e6:7.2f} us/tick")
+    print(f"reopened:  {reopened * 1e6:7.2f} us/tick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+bench_rollups.py - Ingest cost, disk use and query time of the rollup store
+
+Feeds --days of synthetic 1 s samples for --cgroups cgroups into a
+RollupStore (timestamps are simulated, so days run in seconds), with the
+raw tier kept for --raw-hours. Reports the ingest cost per sample, bytes
+per tier against a flat file of every sample, and the time of a query
+over the whole run (answered from a coarse tier) against scanning raw
+samples. Also checks that every tier accounts the same joules.
+
+    python3 benchmarks/bench_rollups.py --days 2 --cgroups 20
+"""
+
+import argparse
+import tempfile
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from rollups import RollupStore, _encode
+
+
+def make_record(timestamp, cgroups, i):
+    busy = 1.0 + (i % 60) / 60
+    record = {"timestamp": timestamp,
+              "system": {"power/energy-pkg/": 20.0 + 10.0 * busy, "cpu_core/instructions/": 1e10 * busy}}
+    for c in range(cgroups):
+        record[f"tenant{c}"] = {"cpu_core/instructions/": 1e10 * busy / cgroups}
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=float, default=2.0)
+    parser.add_argument("--cgroups", type=int, default=20)
+    parser.add_argument("--raw-hours", type=float, default=6.0)
+    args = parser.parse_args()
+
+    samples = int(args.days * 86400)
+    start = 1_700_000_000.0
+    with tempfile.TemporaryDirectory() as root:
+        store = RollupStore(root, retention={"raw": args.raw_hours * 3600})
+        flat_bytes = 0
+        t0 = time.perf_counter()
+        for i in range(samples):
+            record = make_record(start + i, args.cgroups, i)
+            store.ingest(record)
+            if i % 1000 == 0:
+                flat_bytes += len(_encode(record)) + 1
+        elapsed = time.perf_counter() - t0
+        # Let the store thread write the open buckets and close the files
+        store.start().close()
+        flat_bytes = flat_bytes * samples / ((samples + 999) // 1000)
+
+        print(f"{samples} samples x {args.cgroups} cgroups: "
+              f"{elapsed / samples * 1e6:.1f} us per sample (store thread)")
+        usage = store.disk_usage()
+        for name, size in usage.items():
+            print(f"  {name:>4}: {size / 1e6:8.2f} MB")
+        print(f"  all : {sum(usage.values()) / 1e6:8.2f} MB on disk vs "
+              f"{flat_bytes / 1e6:.2f} MB for a flat file of every sample")
+
+        end = start + samples
+        for label, resolution in (("whole run, auto", None), ("whole run, 1 min", 60)):
+            t0 = time.perf_counter()
+            tier, records = store.query(start, end, resolution)
+            print(f"query {label:>16}: tier {tier:>3}, {len(records):5} buckets, "
+                  f"{(time.perf_counter() - t0) * 1000:7.1f} ms")
+        raw = store.tiers[0]
+        t0 = time.perf_counter()
+        records = raw.read(start, end)
+        print(f"scan of retained raw    : {len(records)} samples, "
+              f"{(time.perf_counter() - t0) * 1000:7.1f} ms")
+
+        # Same energy in every rollup tier (first sample has no interval)
+        expected = sum(make_record(0, 0, i)["system"]["power/energy-pkg/"] for i in range(1, samples))
+        for tier in store.tiers[1:]:
+            joules = sum(r["system"]["joules"] for r in tier.read())
+            status = "ok" if abs(joules - expected) < 1e-6 * expected else "MISMATCH"
+            print(f"  {tier.name:>3} joules {joules:.0f} (expected {expected:.0f}) {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+bench_scheduler.py - Drift of the sampling loop and ticks saved by adaptive mode
+
+Runs a loop doing `--work` ms of busy work per tick at `--interval` ms,
+once as wait(interval)-then-work (the old sensor loop) and once on the
+monotonic tick grid, and reports how far the last tick drifted from
+start + n * interval. Then counts the ticks AdaptiveScheduler fires over
+the same span for a cgroup that is busy only for the first 10% of it.
+
+    python3 benchmarks/bench_scheduler.py --interval 20 --work 3 --ticks 200
+"""
+
+import argparse
+import threading
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from scheduler import TickScheduler, AdaptiveScheduler
+
+
+def work(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def sleep_loop(interval, cost, ticks):
+    stop = threading.Event()
+    start = time.monotonic()
+    for _ in range(ticks):
+        stop.wait(interval)
+        work(cost)
+    return time.monotonic() - cost - (start + ticks * interval)
+
+
+def grid_loop(interval, cost, ticks):
+    scheduler = TickScheduler(interval)
+    for deadline in scheduler:
+        work(cost)
+        if scheduler.ticks == ticks:
+            break
+    return abs(deadline - (scheduler.start + ticks * interval)), scheduler.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interval", type=float, default=20.0, help="ms")
+    parser.add_argument("--work", type=float, default=3.0, help="ms of work per tick")
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--max-interval", type=float, default=320.0, help="ms")
+    args = parser.parse_args()
+    interval, cost = args.interval / 1000, args.work / 1000
+
+    drift = sleep_loop(interval, cost, args.ticks)
+    print(f"sleep loop: last tick {drift * 1000:8.2f} ms off the grid after {args.ticks} ticks")
+    drift, stats = grid_loop(interval, cost, args.ticks)
+    print(f"tick grid:  last tick {drift * 1000:8.2f} ms off the grid, late by "
+          f"{stats['late_mean'] * 1000:.3f} ms mean / {stats['late_max'] * 1000:.3f} ms max, "
+          f"{stats['missed']} missed")
+
+    span = args.ticks * interval
+    scheduler = AdaptiveScheduler(interval, args.max_interval / 1000)
+    for deadline in scheduler:
+        if deadline - scheduler.start >= span:
+            break
+        scheduler.update(deadline - scheduler.start < span / 10)
+    print(f"adaptive:   {scheduler.ticks} ticks instead of {args.ticks} "
+          f"(idle after 10%, backing off to {args.max_interval:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
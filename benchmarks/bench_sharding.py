@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+bench_sharding.py - Per-socket sharded counter reads and attribution
+
+Reads the system set plus --cgroups cgroup sets per tick on fake PMUs of
+growing CPU counts, three ways: one CounterSet over every CPU (flat), a
+shards.ShardedCounterSet per set read package after package (sharded),
+and the same shards read by shards.SocketWorkers, one thread per package
+(workers). --read-us adds that much blocking time to every group read,
+standing in for the kernel's cross-CPU read of an active counter, which
+the workers overlap (it is a sleep, so values below ~60 us round up).
+
+Then splits the energy of a synthetic two-socket interval, a busy
+socket 0 running tenant0 and an idle socket 1 running tenant1, with one
+system-wide instruction share and per socket (power.cgroup_power).
+
+    python3 benchmarks/bench_sharding.py --cpus 16 64 128 256 --packages 2
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import fakes
+from perf_event import FakePerfBackend, EventResolver, CounterSet
+from shards import ShardedCounterSet, SocketWorkers, cpu_packages, socket_event
+from power import cgroup_power
+
+SYSTEM_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/", "power/energy-pkg/"]
+CGROUP_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/"]
+
+
+class SlowReadBackend(FakePerfBackend):
+    """FakePerfBackend whose reads block (releasing the GIL) for read_us."""
+    def __init__(self, read_us=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.read_delay = read_us / 1e6
+
+    def read(self, fd, size):
+        if self.read_delay:
+            time.sleep(self.read_delay)
+        return super().read(fd, size)
+
+
+def open_sets(mode, resolver, backend, packages, cgroups):
+    sets = []
+    for i in range(cgroups + 1):
+        events = SYSTEM_EVENTS if i == 0 else CGROUP_EVENTS
+        # Any number stands in for a cgroup fd with the fake backend
+        cgroup_fd = -1 if i == 0 else 100 + i
+        if mode == "flat":
+            counters = CounterSet(events, backend=backend, resolver=resolver, cgroup_fd=cgroup_fd)
+        else:
+            counters = ShardedCounterSet(events, packages, backend=backend, resolver=resolver,
+                                         cgroup_fd=cgroup_fd)
+        sets.append(counters.open())
+    return sets
+
+
+def run(root, cpus, packages, cgroups, mode, ticks, read_us):
+    pmu, online = fakes.make_pmu_tree(os.path.join(root, "pmu"), cpus=cpus, packages=packages)
+    package_cpus = cpu_packages(cpu_root=fakes.make_cpu_tree(os.path.join(root, "cpu"), cpus, packages))
+    backend = SlowReadBackend(read_us)
+    sets = open_sets(mode, EventResolver(pmu, online), backend, package_cpus, cgroups)
+    workers = SocketWorkers(package_cpus) if mode == "workers" else None
+    for counters in sets:
+        counters.enable()
+    reads = backend.reads
+    start = time.perf_counter()
+    for _ in range(ticks):
+        if workers:
+            workers.read(sets)
+        else:
+            for counters in sets:
+                counters.read_values()
+    elapsed = (time.perf_counter() - start) / ticks
+    reads = (backend.reads - reads) / ticks
+    if workers:
+        workers.close()
+    for counters in sets:
+        counters.close()
+    return elapsed, reads
+
+
+def attribution_example():
+    interval = 1.0
+    # Socket 0: 150 J, tenant0 runs 90% of its instructions
+    # Socket 1: 30 J, tenant1 runs 90% of its instructions
+    ins = "cpu_core/instructions/"
+    pkg = "power/energy-pkg/"
+    record = {
+        "timestamp": 0.0,
+        "system": {pkg: 180.0, ins: 2e9,
+                   socket_event(pkg, 0): 150.0, socket_event(ins, 0): 1e9,
+                   socket_event(pkg, 1): 30.0, socket_event(ins, 1): 1e9},
+        "tenant0": {ins: 0.9e9, socket_event(ins, 0): 0.9e9, socket_event(ins, 1): 0.0},
+        "tenant1": {ins: 0.9e9, socket_event(ins, 0): 0.0, socket_event(ins, 1): 0.9e9},
+    }
+    flat = {scope: {k: v for k, v in values.items() if "@" not in k} if isinstance(values, dict) else values
+            for scope, values in record.items()}
+    print(f"{'cgroup':>8} {'global share W':>15} {'per socket W':>13}")
+    global_split, socket_split = cgroup_power(flat, interval), cgroup_power(record, interval)
+    for cgroup in ("tenant0", "tenant1"):
+        print(f"{cgroup:>8} {global_split[cgroup]:15.1f} {socket_split[cgroup]:13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpus", type=int, nargs="+", default=[16, 64, 128, 256])
+    parser.add_argument("--packages", type=int, default=2)
+    parser.add_argument("--cgroups", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--read-us", type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(f"{args.packages} packages, system + {args.cgroups} cgroup sets, "
+          f"{args.read_us:g} us added per group read, {os.cpu_count()} CPUs here")
+    print(f"{'cpus':>5} {'mode':>8} {'us/tick':>10} {'reads/tick':>11}")
+    for cpus in args.cpus:
+        for mode in ("flat", "sharded", "workers"):
+            with tempfile.TemporaryDirectory() as root:
+                elapsed, reads = run(root, cpus, args.packages, args.cgroups, mode, args.ticks,
+                                     args.read_us)
+            print(f"{cpus:>5} {mode:>8} {elapsed * 1e6:10.1f} {reads:11.0f}")
+    print()
+    attribution_example()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+bench_shm.py - Shared-memory readers under concurrent writes
+
+A writer process publishes records with --cgroups cgroups through
+shm.ShmPublisher at --write-hz (0: as fast as it can) while each of
+--readers reader processes loops on ShmReader for --seconds: rows(1) (raw
+newest row), power() (per-cgroup watts) and history(--history) in turn.
+Reports reads/s per reader for each, the writes done meanwhile and how
+often a read had to be retried because it overlapped a write.
+
+    python3 benchmarks/bench_shm.py --readers 1 4 --write-hz 1000
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import fakes  # noqa: F401  (puts the daemon modules on sys.path)
+from power import PKG
+from shm import ShmPublisher, ShmReader
+
+INSTRUCTIONS = "cpu_core/instructions/"
+
+
+def writer(path, cgroups, rate, ready, stop, count):
+    publisher = ShmPublisher(path).start()
+    period = 1.0 / rate if rate else 0.0
+    i = 0
+    next_time = time.monotonic()
+    while not stop.is_set():
+        record = {"timestamp": 1_700_000_000.0 + i * 0.001,
+                  "system": {PKG: 50.0 + i % 7, INSTRUCTIONS: 1e9}}
+        for c in range(cgroups):
+            record[f"tenant{c}"] = {INSTRUCTIONS: 1e9 / (cgroups + 1)}
+        publisher.publish(record)
+        i += 1
+        if i == 2:
+            ready.set()
+        if period:
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    count.value = i
+    publisher.close()
+
+
+def reader(path, mode, seconds, history, results):
+    shm = ShmReader(path)
+    read = {"rows": lambda: shm.rows(1), "power": shm.power,
+            "history": lambda: shm.history(history)}[mode]
+    reads = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        # Batches keep the clock out of the measurement
+        for _ in range(100):
+            read()
+        reads += 100
+    results.put((reads / (time.perf_counter() - start), shm.retries))
+    shm.close()
+
+
+def run(path, mode, readers, args):
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    count = multiprocessing.Value("q", 0)
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=writer, args=(path, args.cgroups, args.write_hz,
+                                                        ready, stop, count))
+    proc.start()
+    ready.wait()
+    procs = [multiprocessing.Process(target=reader, args=(path, mode, args.seconds, args.history,
+                                                          results))
+             for _ in range(readers)]
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    stop.set()
+    proc.join()
+    rate = sum(r for r, _ in stats) / readers
+    retries = sum(n for _, n in stats)
+    return rate, retries, count.value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--cgroups", type=int, default=20)
+    parser.add_argument("--write-hz", type=float, default=1000.0)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--history", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, writer at {args.write_hz:g} Hz "
+          f"({'unthrottled' if not args.write_hz else 'throttled'}), {args.cgroups} cgroups")
+    print(f"{'readers':>8} {'read':>8} {'reads/s per reader':>19} {'writes':>8} {'retries':>8}")
+    for readers in args.readers:
+        for mode in ("rows", "power", "history"):
+            with tempfile.TemporaryDirectory(dir="/dev/shm" if os.path.isdir("/dev/shm") else None) as tmp:
+                rate, retries, writes = run(os.path.join(tmp, "powerdaemon"), mode, readers, args)
+            print(f"{readers:>8} {mode:>8} {rate:19.0f} {writes:>8} {retries:>8}")
+
+
+if __name__ == "__main__":
+    main()
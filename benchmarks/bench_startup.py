@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+bench_startup.py - Cold and warm startup cost of the event catalog and modules
+
+Cold: build the catalog from `perf list --json pmu` output (synthetic,
+~3,900 events; the perf list run itself is not included) and cache it.
+Warm: load the cached catalog and pick the events of one detail level,
+which is all a daemon or sensor start does. Also times importing
+collector.py and daemon.py in a fresh interpreter.
+
+    python3 benchmarks/bench_startup.py
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+from catalog import EventCatalog
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def perf_list(n):
+    """Something shaped like `perf list --json pmu` with n events."""
+    events = [{"Unit": "power", "EventName": f"power/energy-{d}/", "Encoding": f"power/event=0x{i:02x}/"}
+              for i, d in enumerate(("pkg", "cores", "ram", "gpu", "psys"))]
+    for i in range(n - len(events)):
+        unit = ("cpu_core", "cpu_atom", "uncore_imc", "msr")[i % 4]
+        events.append({"Unit": unit, "EventName": f"event_{i}", "Encoding": f"{unit}/event=0x{i % 256:02x},umask=0x{i // 256:02x}/",
+                       "EventType": "Kernel PMU event" if i % 8 == 0 else "Hardware event",
+                       "BriefDescription": "Counts something the PMU can count " * 3})
+    events.append({"Unit": "cpu_core", "EventName": "instructions", "Encoding": "cpu_core/event=0xc0/",
+                   "EventType": "Kernel PMU event"})
+    return events
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def import_time(module, repeat):
+    code = f"import sys; sys.path.insert(0, {fakes.DAEMON_DIR!r}); sys.path.insert(0, {ROOT!r}); import {module}"
+    return best_of(lambda: subprocess.run([sys.executable, "-c", code], check=True), repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=3900)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = perf_list(args.events)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events-test.json")
+        legacy = os.path.join(tmp, "pc_info.json")
+
+        def cold():
+            EventCatalog.from_perf_list(json.loads(json.dumps(data))).save(path)
+
+        def warm():
+            EventCatalog.load(path).levels(0)
+
+        catalog = EventCatalog.from_perf_list(data)
+        with open(legacy, "w") as f:
+            json.dump(catalog.to_pc_info(), f, indent=2)
+
+        def old():
+            EventCatalog.from_pc_info(legacy).levels(0)
+
+        cold()
+        print(f"{len(catalog)} events, cache file {os.path.getsize(path)} bytes, "
+              f"indented pc_info.json {os.path.getsize(legacy)} bytes")
+        print(f"cold build + cache: {best_of(cold, args.repeat) * 1000:7.2f} ms")
+        print(f"warm catalog load:  {best_of(warm, args.repeat) * 1000:7.2f} ms")
+        print(f"pc_info.json load:  {best_of(old, args.repeat) * 1000:7.2f} ms")
+
+    baseline = best_of(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), args.repeat)
+    print(f"interpreter start:  {baseline * 1000:7.2f} ms")
+    for module in ("collector", "daemon"):
+        print(f"import {module + ':':<11} {(import_time(module, args.repeat) - baseline) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+bench_warm.py - Warm pause/resume against stopping and re-creating the sensor
+
+Runs --cycles job boundaries on a fake PMU: the cgroup gets busy for
+--busy seconds, then idles for --idle seconds. Cold re-creates a
+PerfSensor for every job (build, start its thread, open counters) and
+stops it after; warm keeps one sensor and calls resume()/pause(). Reports
+the latency of each start and stop and the share of the run's wall time
+covered by samples: the first sample after a cold start only covers from
+the counters' open, while a warm resume's first sample covers the pause.
+
+    python3 benchmarks/bench_warm.py --cgroups 4 --cycles 20
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import fakes
+from perf_event import FakePerfBackend, EventResolver
+from sensor import PerfSensor
+
+SYSTEM_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/", "power/energy-pkg/"]
+CGROUP_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/"]
+
+
+def make_sensor(root, paths, event_file, interval, timestamps):
+    pmu, online = fakes.make_pmu_tree(os.path.join(root, "pmu"), cpus=8)
+    sensor = PerfSensor(interval_sec=interval, cgroup_paths=paths, output_file=None,
+                        event_file=event_file, backend=FakePerfBackend(),
+                        resolver=EventResolver(pmu, online), cgroup_root=os.path.join(root, "cg"),
+                        account_self=False, sharding="off")
+    sensor.listeners.append(lambda record: timestamps.append(record["timestamp"]))
+    return sensor
+
+
+def start(sensor):
+    """Start the sensor's thread and wait until its counters are open."""
+    thread = threading.Thread(target=sensor.read_counters)
+    thread.start()
+    while sensor.samples is None:
+        time.sleep(0)
+    return thread
+
+
+def run(root, mode, cgroups, cycles, busy, idle, interval):
+    paths = fakes.make_cgroup_tree(os.path.join(root, "cg"), [f"tenant{i}" for i in range(cgroups)])
+    event_file = fakes.make_event_file(os.path.join(root, "pc_info.json"), SYSTEM_EVENTS, CGROUP_EVENTS)
+    starts, stops = [], []
+    # (counters open, timestamps) per sensor
+    runs = []
+    sensor = thread = None
+    begin = time.time()
+    for cycle in range(cycles):
+        t0 = time.perf_counter()
+        if mode == "cold" or sensor is None:
+            timestamps = []
+            opened = time.time()
+            sensor = make_sensor(root, paths, event_file, interval, timestamps)
+            thread = start(sensor)
+            runs.append((opened, timestamps))
+        else:
+            sensor.resume()
+        starts.append(time.perf_counter() - t0)
+        time.sleep(busy)
+
+        t0 = time.perf_counter()
+        if mode == "cold":
+            sensor.stop()
+            thread.join()
+        else:
+            sensor.pause()
+        stops.append(time.perf_counter() - t0)
+        time.sleep(idle)
+    if mode == "warm":
+        sensor.stop()
+        thread.join()
+    end = time.time()
+    covered = sum(timestamps[-1] - opened for opened, timestamps in runs if timestamps)
+    # The first warm start is a cold one
+    if mode == "warm":
+        starts = starts[1:]
+    return starts, stops, covered / (end - begin)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cgroups", type=int, default=4)
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--busy", type=float, default=0.05)
+    parser.add_argument("--idle", type=float, default=0.02)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{args.cgroups} cgroups, {args.cycles} jobs of {args.busy * 1000:g} ms, "
+          f"{args.idle * 1000:g} ms idle between, {args.interval * 1000:g} ms ticks")
+    print(f"{'mode':>5} {'start us med':>13} {'start us max':>13} {'stop us med':>12} "
+          f"{'stop us max':>12} {'time covered':>13}")
+    for mode in ("cold", "warm"):
+        with tempfile.TemporaryDirectory() as root:
+            starts, stops, coverage = run(root, mode, args.cgroups, args.cycles, args.busy,
+                                          args.idle, args.interval)
+        print(f"{mode:>5} {statistics.median(starts) * 1e6:13.1f} {max(starts) * 1e6:13.1f} "
+              f"{statistics.median(stops) * 1e6:12.1f} {max(stops) * 1e6:12.1f} {coverage:13.1%}")
+
+
+if __name__ == "__main__":
+    main()
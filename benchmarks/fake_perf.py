@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+fake_perf.py - Stand-in for `perf stat -I` that needs no PMU
+
+Takes the arguments the collector passes to perf (-x, -I, -e,
+--for-each-cgroup, --per-socket is ignored, then a `sleep N` workload)
+and writes N * 1000 / interval intervals of synthetic counts to stderr,
+in CSV with -x and in the human-readable layout otherwise, one write per
+interval. Environment:
+
+    FAKE_PERF_RATE   intervals per second; 0 writes as fast as the reader
+                     takes them (default: real time, 1000 / interval)
+    FAKE_PERF_STATS  file to append {"cgroup": bool, "intervals", "lines",
+                     "bytes", "blocked": seconds spent in write()} to on exit
+
+Install it as `perf` ahead of the real one on PATH (see bench_collector.py).
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def parse(argv):
+    opts = {"sep": None, "interval": 1000, "events": [], "cgroups": [], "duration": 1.0}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-x":
+            opts["sep"] = argv[i + 1]
+            i += 1
+        elif arg == "-I":
+            opts["interval"] = int(argv[i + 1])
+            i += 1
+        elif arg == "-e":
+            opts["events"] = argv[i + 1].split(",")
+            i += 1
+        elif arg == "--for-each-cgroup":
+            opts["cgroups"] = argv[i + 1].split(",")
+            i += 1
+        elif arg == "sleep":
+            opts["duration"] = float(argv[i + 1])
+            break
+        i += 1
+    return opts
+
+
+def interval_lines(opts, n):
+    ts = n * opts["interval"] / 1000
+    run = opts["interval"] * 1000000
+    sep = opts["sep"]
+    lines = []
+    for scope in opts["cgroups"] or [None]:
+        for e, event in enumerate(opts["events"]):
+            joules = event.startswith("power/")
+            value = 12.5 + e if joules else 1000000 * (e + 1) + n
+            if sep:
+                fields = [f"{ts:.9f}", f"{value:.2f}" if joules else str(value),
+                          "Joules" if joules else "", event]
+                if scope:
+                    fields.append(scope)
+                fields += [str(run), "100.00", "", ""]
+                lines.append(sep.join(fields))
+            elif joules:
+                lines.append(f"{ts:>14.9f} {value:>20.2f} Joules {event}")
+            else:
+                line = f"{ts:>14.9f} {value:>20,}      {event}"
+                lines.append(f"{line}      {scope}" if scope else line)
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def main():
+    opts = parse(sys.argv[1:])
+    intervals = max(1, int(opts["duration"] * 1000 / opts["interval"]))
+    rate = float(os.environ.get("FAKE_PERF_RATE", 1000 / opts["interval"]))
+    blocked = 0.0
+    written = 0
+    lines = 0
+    start = time.monotonic()
+    for n in range(1, intervals + 1):
+        if rate:
+            delay = start + n / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        data = interval_lines(opts, n)
+        lines += data.count(b"\n")
+        t0 = time.perf_counter()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(2, view):]
+        blocked += time.perf_counter() - t0
+        written += len(data)
+    stats = os.environ.get("FAKE_PERF_STATS")
+    if stats:
+        with open(stats, "a") as f:
+            f.write(json.dumps({"cgroup": bool(opts["cgroups"]), "intervals": intervals,
+                                "lines": lines, "bytes": written, "blocked": blocked}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+fakes.py - Fake sysfs/cgroupfs trees for the benchmarks
+
+Lets the sensor code run on machines without a PMU, RAPL or cgroup v2.
+"""
+
+import json
+import os
+import sys
+
+# Shared modules live with the daemon
+DAEMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PowerDaemon", "opt", "PowerDaemon")
+sys.path.insert(0, DAEMON_DIR)
+
+# cgroup v2 cpu.stat with the cpu controller enabled
+CPU_STAT = ("usage_usec 1843275120\nuser_usec 1322907361\nsystem_usec 520367759\n"
+            "nr_periods 0\nnr_throttled 0\nthrottled_usec 0\n"
+            "nr_bursts 0\nburst_usec 0\n")
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def make_pmu_tree(root, cpus=8, packages=1):
+    """
+    A /sys/bus/event_source/devices lookalike with a cpu_core and a power
+    PMU, plus a cpu 'online' file. Returns (pmu_root, online_file).
+    """
+    pmu_root = os.path.join(root, "devices")
+    core = os.path.join(pmu_root, "cpu_core")
+    _write(os.path.join(core, "type"), "4\n")
+    _write(os.path.join(core, "cpus"), f"0-{cpus - 1}\n")
+    _write(os.path.join(core, "format", "event"), "config:0-7\n")
+    _write(os.path.join(core, "format", "umask"), "config:8-15\n")
+    for name, code in (("instructions", "0xc0"), ("cycles", "0x3c"),
+                       ("branches", "0xc4"), ("branch-misses", "0xc5")):
+        _write(os.path.join(core, "events", name), f"event={code}\n")
+
+    power = os.path.join(pmu_root, "power")
+    per_package = max(1, cpus // packages)
+    _write(os.path.join(power, "type"), "23\n")
+    _write(os.path.join(power, "cpumask"), ",".join(str(p * per_package) for p in range(packages)) + "\n")
+    _write(os.path.join(power, "format", "event"), "config:0-7\n")
+    for name, code in (("energy-pkg", "0x02"), ("energy-cores", "0x01")):
+        _write(os.path.join(power, "events", name), f"event={code}\n")
+        _write(os.path.join(power, "events", f"{name}.scale"), "2.3283064365386962890625e-10\n")
+
+    online = os.path.join(root, "online")
+    _write(online, f"0-{cpus - 1}\n")
+    return pmu_root, online
+
+
+def make_cpu_tree(root, cpus=8, packages=1):
+    """
+    A /sys/devices/system/cpu lookalike: 'online' plus each CPU's
+    topology/physical_package_id, CPUs split evenly over packages. Returns root.
+    """
+    _write(os.path.join(root, "online"), f"0-{cpus - 1}\n")
+    per_package = max(1, cpus // packages)
+    for cpu in range(cpus):
+        _write(os.path.join(root, f"cpu{cpu}", "topology", "physical_package_id"),
+               f"{min(cpu // per_package, packages - 1)}\n")
+    return root
+
+
+def make_cgroup_tree(root, names):
+    """
+    Create cgroup directories (with empty cgroup.procs and a cpu.stat)
+    under root, which also gets a cpu.stat. Returns their paths.
+    """
+    _write(os.path.join(root, "cpu.stat"), CPU_STAT)
+    paths = []
+    for name in names:
+        path = os.path.join(root, name)
+        _write(os.path.join(path, "cgroup.procs"), "")
+        _write(os.path.join(path, "cpu.stat"), CPU_STAT)
+        paths.append(path)
+    return paths
+
+
+def make_event_file(path, system_events, group_events):
+    """
+    Write a pc_info.json with one detail level.
+    """
+    data = {"0": {"system": [{"Name": e} for e in system_events],
+                  "group": [{"Name": e} for e in group_events]}}
+    _write(path, json.dumps(data))
+    return path
+
+
+def make_powercap_tree(root, packages=1, max_range=262143328850, energy_uj=0):
+    """
+    A /sys/class/powercap lookalike with a package, core and dram zone per
+    package, every energy_uj counter starting at energy_uj. Returns the root.
+    """
+    for p in range(packages):
+        zones = [(f"intel-rapl:{p}", f"package-{p}"),
+                 (f"intel-rapl:{p}:0", "core"),
+                 (f"intel-rapl:{p}:1", "dram")]
+        for entry, name in zones:
+            path = os.path.join(root, entry)
+            _write(os.path.join(path, "name"), name + "\n")
+            _write(os.path.join(path, "energy_uj"), f"{energy_uj}\n")
+            _write(os.path.join(path, "max_energy_range_uj"), f"{max_range}\n")
+    return root
+
+
+def set_energy(root, zone, energy_uj):
+    """Move a fake zone's ('intel-rapl:0', ...) energy_uj counter."""
+    _write(os.path.join(root, zone, "energy_uj"), f"{energy_uj}\n")
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+suite.py - Benchmark suite for the collection pipeline
+
+Runs each case in its own process (so peak RSS is the case's own) on fake
+inputs that need no root, PMU or cgroup, and reports samples/sec, per-call
+latency (p50/p99) and peak RSS:
+
+    text_parser   collector.parse_perf_chunk on human-readable perf output
+    csv_parser    perf_csv.PerfCsvParser on perf stat -x, output
+    sensor_loop   one PerfSensor tick (read, ring, record) on FakePerfBackend
+    jsonl_writer  writer.JsonlWriter, including draining to disk
+    rollups       rollups.RollupStore ingest
+    replay        a recorded sensor + perf run through replay.Replayer
+
+With --baseline, results are compared to an earlier --json output and the
+run fails if any case lost more than --tolerance of its samples/sec.
+
+    python3 benchmarks/suite.py --json results.json
+    python3 benchmarks/suite.py --baseline results.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+from bench_perf_csv import synthetic_recording
+
+CASES = ("text_parser", "csv_parser", "sensor_loop", "jsonl_writer", "rollups", "replay")
+
+SYSTEM_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/", "power/energy-pkg/", "power/energy-cores/"]
+GROUP_EVENTS = ["cpu_core/instructions/", "cpu_core/cycles/"]
+
+
+def percentiles(latencies):
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return ordered[n // 2], ordered[min(n - 1, int(n * 0.99))]
+
+
+def timed(calls):
+    """Run the zero-argument callables, returning (total seconds, latencies)."""
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for call in calls:
+        t0 = clock()
+        call()
+        latencies.append(clock() - t0)
+    return clock() - start, latencies
+
+
+def text_lines(intervals, cgroups):
+    """Chunks of `perf stat -I` human-readable output, as read_perf_chunks yields them."""
+    chunks = []
+    for i in range(1, intervals + 1):
+        ts = f"{i:>10.9f}"
+        system = [f"{ts}        {1000000 * (e + 1) + i:,}      {event}"
+                  for e, event in enumerate(SYSTEM_EVENTS[:2])]
+        system += [f"{ts}              {12.5 + e:.2f} Joules {event}"
+                   for e, event in enumerate(SYSTEM_EVENTS[2:])]
+        group = [f"{ts}        {500000 * (e + 1) + i:,}      {event}      tenant{c}"
+                 for c in range(cgroups) for e, event in enumerate(GROUP_EVENTS)]
+        chunks.append((system, group))
+    return chunks
+
+
+def case_text_parser(args, tmp):
+    from collector import parse_perf_chunk
+    chunks = text_lines(args.samples, 1)
+    elapsed, latencies = timed(lambda c=c: (parse_perf_chunk(c[0]), parse_perf_chunk(c[1], "tenant0"))
+                               for c in chunks)
+    return len(chunks), elapsed, latencies
+
+
+def case_csv_parser(args, tmp):
+    from perf_csv import PerfCsvParser
+    events = len(GROUP_EVENTS)
+    lines = synthetic_recording(args.samples, events, args.cgroups)
+    per_interval = len(lines) // args.samples
+    parser = PerfCsvParser(cgroups=True)
+    batches = [lines[i:i + per_interval] for i in range(0, len(lines), per_interval)]
+    elapsed, latencies = timed(lambda b=b: parser.feed_lines(b) for b in batches)
+    return len(batches), elapsed, latencies
+
+
+def make_sensor(tmp, cgroups, output_file=None, recorder=None):
+    from perf_event import EventResolver, FakePerfBackend
+    from sensor import PerfSensor
+    pmu_root, online = fakes.make_pmu_tree(tmp, cpus=4)
+    event_file = fakes.make_event_file(os.path.join(tmp, "pc_info.json"), SYSTEM_EVENTS, GROUP_EVENTS)
+    cg_root = os.path.join(tmp, "cgroup")
+    paths = fakes.make_cgroup_tree(cg_root, [f"tenant{i}" for i in range(cgroups)])
+    sensor = PerfSensor(interval_sec=1.0, cgroup_paths=paths, output_file=output_file,
+                        event_file=event_file, backend=FakePerfBackend(),
+                        resolver=EventResolver(pmu_root, online), cgroup_root=cg_root,
+                        recorder=recorder)
+    sensor._open_counters()
+    return sensor
+
+
+def sensor_tick(sensor, timestamp):
+    """The body of PerfSensor.read_counters for one tick, without the scheduler."""
+    values = sensor._read_values()
+    sensor.samples.append(timestamp, values)
+    if sensor.recorder:
+        sensor.recorder.sample(timestamp, values, sensor.samples.schema)
+    record = sensor.samples.record()
+    coverage = sensor._coverage()
+    if coverage:
+        record["coverage"] = coverage
+    return record
+
+
+def case_sensor_loop(args, tmp):
+    sensor = make_sensor(tmp, args.cgroups)
+    elapsed, latencies = timed(lambda i=i: sensor_tick(sensor, float(i)) for i in range(args.samples))
+    sensor._close_counters()
+    return args.samples, elapsed, latencies
+
+
+def case_jsonl_writer(args, tmp):
+    from writer import JsonlWriter
+    sensor = make_sensor(tmp, args.cgroups)
+    records = [sensor_tick(sensor, float(i)) for i in range(args.samples)]
+    sensor._close_counters()
+    writer = JsonlWriter(os.path.join(tmp, "out.jsonl")).start()
+    start = time.perf_counter()
+    _, latencies = timed(lambda r=r: writer.write(r) for r in records)
+    # Throughput counts until everything is on disk
+    writer.close()
+    return len(records), time.perf_counter() - start, latencies
+
+
+def case_rollups(args, tmp):
+    from rollups import RollupStore
+    sensor = make_sensor(tmp, args.cgroups)
+    records = [sensor_tick(sensor, 1_700_000_000.0 + i) for i in range(args.samples)]
+    sensor._close_counters()
+    store = RollupStore(os.path.join(tmp, "store"))
+    elapsed, latencies = timed(lambda r=r: store.ingest(r) for r in records)
+    store.start().close()
+    return len(records), elapsed, latencies
+
+
+def case_replay(args, tmp):
+    from replay import Recorder, Replayer
+    # Record sensor reads and a perf CSV run, then replay them as fast as possible
+    recording = os.path.join(tmp, "recording.jsonl")
+    recorder = Recorder(recording).start()
+    sensor = make_sensor(tmp, args.cgroups, recorder=recorder)
+    for i in range(args.samples):
+        sensor_tick(sensor, 1_700_000_000.0 + i)
+    sensor._close_counters()
+    lines = synthetic_recording(args.samples, len(GROUP_EVENTS), 0)
+    for line in recorder.tee("system", lines):
+        pass
+    recorder.close()
+    summary = Replayer(recording, output=os.path.join(tmp, "replayed.jsonl")).run()
+    stages = {stage: {"p50": s["p50"], "p99": s["p99"], "mean": s["mean"]}
+              for stage, s in summary["stages"].items()}
+    return summary["records"], summary["elapsed"], None, stages
+
+
+def run_case(name, args):
+    """Run one case in this process; returns its result dict."""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = globals()[f"case_{name}"](args, tmp)
+    samples, elapsed, latencies = result[:3]
+    out = {"case": name, "samples": samples, "elapsed": elapsed,
+           "samples_per_sec": samples / elapsed if elapsed else 0.0,
+           # ru_maxrss is in KiB on Linux
+           "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if latencies:
+        out["p50"], out["p99"] = percentiles(latencies)
+    if len(result) > 3:
+        out["stages"] = result[3]
+    return out
+
+
+def spawn_case(name, args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--case", name,
+           "--samples", str(args.samples), "--cgroups", str(args.cgroups)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"case {name} failed:\n{proc.stderr}")
+    # Case output may contain the sensor's own log lines; the result is last
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_results(results):
+    print(f"{'case':<14} {'samples/s':>12} {'p50 us':>9} {'p99 us':>9} {'peak RSS MB':>12}")
+    for r in results:
+        p50 = f"{r['p50'] * 1e6:9.1f}" if "p50" in r else f"{'-':>9}"
+        p99 = f"{r['p99'] * 1e6:9.1f}" if "p99" in r else f"{'-':>9}"
+        print(f"{r['case']:<14} {r['samples_per_sec']:>12,.0f} {p50} {p99} {r['peak_rss_mb']:>12.1f}")
+        for stage, s in r.get("stages", {}).items():
+            print(f"  {stage:<12} {'':>12} {s['p50'] * 1e6:9.1f} {s['p99'] * 1e6:9.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Names of cases whose samples/sec fell more than tolerance below the baseline."""
+    before = {r["case"]: r for r in baseline}
+    regressed = []
+    for r in results:
+        old = before.get(r["case"])
+        if old and r["samples_per_sec"] < old["samples_per_sec"] * (1 - tolerance):
+            change = r["samples_per_sec"] / old["samples_per_sec"] - 1
+            print(f"[!] {r['case']}: {change * 100:+.0f}% samples/sec against the baseline")
+            regressed.append(r["case"])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--cgroups", type=int, default=10)
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--json", metavar="FILE", help="Save the results here.")
+    parser.add_argument("--baseline", metavar="FILE", help="Fail on regressions against these results.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Child process: one case, result as the last line of stdout
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+        print(json.dumps(run_case(args.case, args)))
+        return
+
+    results = [spawn_case(name, args) for name in args.cases]
+    print(f"{args.samples} samples, {args.cgroups} cgroups")
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
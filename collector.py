@@ -1,11 +1,29 @@
-import subprocess
+import asyncio
 import argparse
-import json
 import sys
 import os
-import matplotlib.pyplot as plt
-from itertools import zip_longest
-import math
+import threading
+import time
+
+# Shared modules live with the daemon
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PowerDaemon", "opt", "PowerDaemon"))
+from writer import JsonlWriter, read_records
+from perf_csv import PerfCsvParser, stat_command
+from align import Aligner
+from cgroups import expand_cgroups, cgroup_name, CGROUP_ROOT
+from sensor import CpuStatSensor
+from catalog import load_catalog
+from replay import Recorder
+
+MEASUREMENT_FILE = "measurement.jsonl"
+# Keys of attribution.MODELS, listed here so argument parsing does not import NumPy
+MODEL_NAMES = ("cputime", "cycles", "instructions", "linear")
+# Shortest interval perf stat -I accepts
+PERF_MIN_INTERVAL_MS = 10
+# Parsed records waiting for the merge; when full, the pipes (and perf) wait
+QUEUE_RECORDS = 1024
+# Bytes taken from a perf pipe per read
+READ_SIZE = 65536
 
 def parse_args():
     #ArgumentParser Class from Library
@@ -17,108 +35,90 @@ def parse_args():
     #run subparser
     run_parser = subparsers.add_parser("run", help="Run the power sensor")
     #arguments for run subparser
-    run_parser.add_argument("cgroup", type=str, help="Path to the cgroup to monitor.")
+    run_parser.add_argument("cgroup", type=str,
+                            help="Cgroup(s) to monitor: a name, comma list or glob (e.g. 'system.slice/*.service').")
     run_parser.add_argument("time", type=float, help="Time in seconds to monitor.")
     run_parser.add_argument("frequency", type=float, help="Sampling frequency (Hz).")
     run_parser.add_argument("detail", type=int, help="Detail level from init.")
+    run_parser.add_argument("--parser", choices=["csv", "text"], default="csv",
+                            help="Read perf output as CSV (perf stat -x) or human-readable text.")
+    run_parser.add_argument("--model", choices=MODEL_NAMES, default=None,
+                            help="Attribution model used for the cgroup power estimate "
+                                 "(default: instructions, cputime with --source cpustat).")
+    run_parser.add_argument("--source", choices=["perf", "cpustat"], default="perf",
+                            help="Count with perf, or use cgroup cpu.stat CPU time and RAPL "
+                                 "sysfs energy on hosts without a PMU.")
+    run_parser.add_argument("--plot", metavar="FILE",
+                            help="Render a decimated plot to FILE (.png/.svg) without a display "
+                                 "instead of the interactive graphs.")
+    run_parser.add_argument("--per-socket", action="store_true",
+                            help="Count per socket (perf stat --per-socket) so every package's "
+                                 "energy is attributed by that package's counters.")
+    run_parser.add_argument("--record", metavar="FILE",
+                            help="Also record the raw perf output (or sensor reads) to FILE "
+                                 "for replay.py.")
+
+    #plot subparser
+    plot_parser = subparsers.add_parser("plot", help="Plot a measurement file headless")
+    plot_parser.add_argument("output", help="Image to write (.png, .svg, .pdf).")
+    plot_parser.add_argument("--file", default=MEASUREMENT_FILE, help="Measurement file to plot.")
+    plot_parser.add_argument("--cgroups", default="", help="Comma list of cgroups (default: all).")
+    plot_parser.add_argument("--events", default="power",
+                             help="Comma list of events; 'power' is the estimated watts.")
+    plot_parser.add_argument("--points", type=int, default=2000, help="Points per series.")
+    plot_parser.add_argument("--method", choices=["minmax", "lttb"], default="minmax")
 
     #return arguments
     return parser.parse_args()
 
 def init_events():
-    print("[*] Running 'perf list --json pmu'")
-    result = subprocess.run(
-        ["perf", "list", "--json", "pmu"],
-        capture_output=True,
-        text=True
-    )
-    if result.returncode != 0:
-        sys.exit(f"Error: failed to run 'perf list --json'\n{result.stderr}")
-    print("Parsing into a dictionary")
-    try:
-        events_data = json.loads(result.stdout.replace("\n",""))
-    except json.JSONDecodeError as e:
-        sys.exit(f"Error parsing JSON from perf list: {e}")
-    
-    event_dict = {}
-    for event in events_data:
-        unit = event.get("Unit")
-        if unit == "cpu_core":
-            name = f"cpu_core/{event.get("EventName")}/"
-        else:
-            name = event.get("EventName")
-        encoding = event.get("Encoding")
-        eventType = event.get("EventType", None)
-        if name and encoding:
-            event_dict[name] = {"Unit":unit, "Name":name, "Type":eventType, "Encoding":encoding}
-    print("Creating Detail levels")
-    # Assign detail levels (could be same if list is short)
-    events_by_detail = {
-        0:{"system":[], "group":[]},
-        1:{"system":[], "group":[]}
-    }
-    for e in event_dict:
-        if event_dict[e]["Unit"] == "power":
-            events_by_detail[0]["system"].append(event_dict[e])
-        elif event_dict[e]["Unit"] == "msr":
-            events_by_detail[1]["system"].append(event_dict[e])
-            events_by_detail[1]["group"].append(event_dict[e])
-        elif event_dict[e]["Unit"] == "cpu_core" and event_dict[e]["Type"] and event_dict[e]["Type"] == "Kernel PMU event" and event_dict[e]["Unit"] in ["cpu_core", "cpu_atom"]:
-            events_by_detail[1]["system"].append(event_dict[e])
-            events_by_detail[1]["group"].append(event_dict[e])
-            if event_dict[e]["Name"] == "cpu_core/instructions/":
-                events_by_detail[0]["system"].append(event_dict[e])
-                events_by_detail[0]["group"].append(event_dict[e])
-
-    with open("pc_info.json", "w") as f:
-        json.dump(events_by_detail, f, indent=2)
-
-    print(f"[*] Saved events into file")
+    # Rebuild the cached event catalog (perf list --json pmu, or libpfm4)
+    catalog = load_catalog(rebuild=True)
+    system, group = catalog.levels(2)
+    print(f"[*] Catalog holds {len(catalog)} events, {len(system)} system and {len(group)} group monitored")
+
+def interval_ms(frequency):
+    """perf stat -I interval for a sampling frequency in Hz."""
+    return int(round(1000 / frequency))
 
 def validate_run_args(args):
-    info_file = "pc_info.json"
     # Check numbers
     print("Checking args")
     print("Checking time,frequency > 0")
     if args.time <= 0:
         sys.exit("Error: time must be > 0")
-    if args.frequency <= 100:
-        sys.exit("Error: frequency must be > 100")
+    if args.frequency <= 0:
+        sys.exit("Error: frequency must be > 0")
+    if interval_ms(args.frequency) < PERF_MIN_INTERVAL_MS:
+        sys.exit(f"Error: frequency must be at most {1000 // PERF_MIN_INTERVAL_MS} Hz")
 
     print("Checking cgroup")
-    # Check cgroup exists
+    # Check cgroups exist, expanding comma lists and globs
+    args.cgroups = []
     if args.cgroup != "":
-        if not os.path.exists(f"/sys/fs/cgroup/{args.cgroup}"):
+        args.cgroups = [cgroup_name(path) for path in expand_cgroups(args.cgroup)]
+        if not args.cgroups:
             sys.exit(f"Error: cgroup '{args.cgroup}' does not exist.")
-    
-    print("Checking if pc_info has been saved")
-    try:
-        with open(info_file) as f:
-            print(f"file exists")
-    except:
-        sys.exit("Error: no info file found, run 'init' first.")
+        if args.parser == "text" and len(args.cgroups) > 1:
+            sys.exit("Error: the text parser supports a single cgroup, use --parser csv")
+        print(f"Monitoring {len(args.cgroups)} cgroups")
+    if args.record and args.parser == "text" and args.source == "perf":
+        sys.exit("Error: --record needs --parser csv")
+    if args.per_socket and (args.parser == "text" or args.source != "perf"):
+        sys.exit("Error: --per-socket needs --parser csv and --source perf")
     
     if not (0 <= args.detail <= 2):
         sys.exit(f"Error: detail must be between 0 and 2")
 
 def run_monitor(args):
     validate_run_args(args)
+    if args.source == "cpustat":
+        run_cpustat_monitor(args)
+        return
 
     print("collecting events to track")
-    with open("pc_info.json") as f:
-        events_data = json.load(f)
-
-    print("Creating events list")
-    sysevents = []
-    groupevents = []
-    for i in range(0, args.detail + 1):
-        try:
-            for j in events_data[str(i)]["system"]:
-                sysevents.append(j["Name"])
-            for x in events_data[str(i)]["group"]:
-                groupevents.append(x["Name"])
-        except:
-            continue
+    # Cached per CPU/microcode/kernel, built on first use
+    sysevents, groupevents = load_catalog().levels(args.detail)
     sysevents_arg = ",".join(sysevents)
     groupevents_arg = ",".join(groupevents)
     print(sysevents_arg)
@@ -126,7 +126,7 @@ def run_monitor(args):
     sevents = len(sysevents)
     cgevents = len(groupevents)
     # Interval in ms
-    interval = int(args.frequency)  # e.g., 1000 for 1s
+    interval = interval_ms(args.frequency)  # e.g., 1000 for 1 Hz
     time_arg = int(args.time)    # total run time (s)
 
     print("Running Perf")
@@ -136,63 +136,202 @@ def run_monitor(args):
     #print(result.stderr)
     #parse_stat(result.stderr)
     
-    results = []
-    # parallel method
+    # Start from an empty file, the writer appends one line per interval
+    open(MEASUREMENT_FILE, "w").close()
+    writer = JsonlWriter(MEASUREMENT_FILE).start()
+    if args.parser == "csv":
+        run_csv_monitor(args, sysevents, groupevents, interval, time_arg, writer)
+        writer.close()
+        return
+    # parallel method, both outputs aligned on one tick grid
     syscmd = ["perf", "stat", "-I", str(interval), "-a", "-e", sysevents_arg, "sleep", str(time_arg)]
+    sources = [("system", syscmd, PerfTextParser(sevents))]
     # Cgroup
     if args.cgroup != "":
-        groupcmd = ["perf", "stat", "-I", str(interval), "-e", groupevents_arg, "-a", "--for-each-cgroup", args.cgroup, "sleep", str(time_arg)]
-        sysproc = subprocess.Popen(syscmd, stderr=subprocess.PIPE, text=True)
-        groupproc = subprocess.Popen(groupcmd, stderr=subprocess.PIPE, text=True)
-        sys_chunks = read_perf_chunks(sysproc, sevents)
-        cg_chunks  = read_perf_chunks(groupproc, cgevents)
-        for line in zip_longest(sys_chunks, cg_chunks):
-            results.append(parse_perf_line(line,True,args.cgroup))
-            #parse_perf_line(sys_line,cg_line)
-            # cg_line = first line from cgroup perf
-    else:
-        sysproc = subprocess.Popen(syscmd, stderr=subprocess.PIPE, text=True)
-        sys_chunks = read_perf_chunks(sysproc, sevents)
-        for line in zip(sys_chunks):
-            results.append(parse_perf_line(line,False))
-    
-    sysproc.wait()
-    with open("measurement.json", "w") as f:
-        json.dump(results, f, indent=2)
-
-def read_perf_chunks(proc, events_per_interval):
-    chunk = []
-    for line in proc.stderr:
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        chunk.append(line)
-        if len(chunk) == events_per_interval:
-            yield chunk
-            chunk = []
-    if chunk:
-        yield chunk
-
-def parse_perf_line(line, cg, cgname=None):
+        groupcmd = ["perf", "stat", "-I", str(interval), "-e", groupevents_arg, "-a", "--for-each-cgroup", args.cgroups[0], "sleep", str(time_arg)]
+        sources.append(("cgroup", groupcmd, PerfTextParser(cgevents, args.cgroups[0])))
+    run_sources(sources, interval / 1000, writer)
+    writer.close()
+
+def run_sources(sources, interval, writer, recorder=None):
+    """
+    Run every (name, command, parser) perf source to the end, reading all
+    of their outputs at once, and write the records aligned on one tick
+    grid (align.Aligner). Every child is reaped, also on errors and ^C.
+    Returns the aligner.
+    """
+    aligner = Aligner(interval)
+    asyncio.run(_run_sources(sources, aligner, writer, recorder))
+    return aligner
+
+async def _run_sources(sources, aligner, writer, recorder):
+    arrivals = asyncio.Queue(maxsize=QUEUE_RECORDS)
+    procs = []
+    readers = []
+    start = time.monotonic()
+    try:
+        for name, cmd, parser in sources:
+            proc = await asyncio.create_subprocess_exec(*cmd, stderr=asyncio.subprocess.PIPE)
+            # perf counts its interval timestamps from about its start
+            aligner.add_source(name, offset=time.monotonic() - start)
+            procs.append((name, proc))
+            if recorder:
+                recorder.stream(name, interval=aligner.interval)
+        for (name, proc), (_, _, parser) in zip(procs, sources):
+            readers.append(asyncio.create_task(read_source(name, proc.stderr, parser, arrivals,
+                                                           recorder)))
+        running = len(readers)
+        while running:
+            name, record = await arrivals.get()
+            if record is None:
+                running -= 1
+                done = aligner.finish(name)
+            else:
+                done = aligner.push(name, record)
+            for merged in done:
+                writer.write(merged)
+        for merged in aligner.flush():
+            writer.write(merged)
+        # Re-raises a reader's error
+        await asyncio.gather(*readers)
+        for name, proc in procs:
+            code = await proc.wait()
+            if code:
+                print(f"[!] perf ({name}) exited with {code}")
+    finally:
+        # Cut short (error, ^C): stop whatever still runs, then reap it
+        for task in readers:
+            task.cancel()
+        for name, proc in procs:
+            if proc.returncode is None:
+                try:
+                    proc.terminate()
+                except ProcessLookupError:
+                    pass
+        for name, proc in procs:
+            await proc.wait()
+
+async def read_source(name, stream, parser, arrivals, recorder=None):
+    """
+    Parse one perf output as it arrives, READ_SIZE bytes at a time, and
+    queue (name, record) per interval, then (name, None) at its end.
+    """
+    pending = b""
+    try:
+        while True:
+            data = await stream.read(READ_SIZE)
+            if not data:
+                break
+            data = pending + data
+            cut = data.rfind(b"\n") + 1
+            pending = data[cut:]
+            if not cut:
+                continue
+            lines = data[:cut].decode(errors="replace").split("\n")
+            lines.pop()
+            if recorder:
+                for line in lines:
+                    recorder.perf_line(name, line)
+            for record in parser.feed_lines([line.strip() for line in lines]):
+                await arrivals.put((name, record))
+        if pending:
+            line = pending.decode(errors="replace")
+            if recorder:
+                recorder.perf_line(name, line)
+            for record in parser.feed_lines([line.strip()]):
+                await arrivals.put((name, record))
+        record = parser.flush()
+        if record is not None:
+            await arrivals.put((name, record))
+    finally:
+        await arrivals.put((name, None))
+
+def run_cpustat_monitor(args):
+    """
+    PMU-free run: cpu.stat of every cgroup plus RAPL energy, same output records.
+    """
+    paths = [os.path.join(CGROUP_ROOT, name) for name in args.cgroups]
+    recorder = Recorder(args.record).start() if args.record else None
+    sensor = CpuStatSensor(interval_sec=1.0 / args.frequency, cgroup_paths=paths,
+                           output_file=MEASUREMENT_FILE, recorder=recorder)
+    open(MEASUREMENT_FILE, "w").close()
+    timer = threading.Timer(args.time, sensor.stop)
+    timer.start()
+    sensor.read_counters()
+    timer.cancel()
+    if recorder:
+        recorder.close()
+
+def run_csv_monitor(args, sysevents, groupevents, interval, time_arg, writer):
+    """
+    Run perf stat in CSV mode. All cgroups share one system-wide perf and one
+    --for-each-cgroup perf; both outputs are read at once and rebinned onto
+    one tick grid, so a record's energy and counters always cover the same
+    window.
+    """
+    # Raw stderr is teed to the recording before parsing
+    recorder = Recorder(args.record).start() if args.record else None
+    sources = [("system", stat_command(sysevents, interval, duration=time_arg,
+                                       per_socket=args.per_socket), PerfCsvParser())]
+    if args.cgroups:
+        sources.append(("cgroup", stat_command(groupevents, interval, cgroups=args.cgroups,
+                                               duration=time_arg, per_socket=args.per_socket),
+                        PerfCsvParser(cgroups=True)))
+    try:
+        run_sources(sources, interval / 1000, writer, recorder)
+    finally:
+        if recorder:
+            recorder.close()
+
+class PerfTextParser:
+    """
+    Incremental parser of one human-readable `perf stat -I` output:
+    events_per_interval lines make an interval, parsed by parse_perf_chunk.
+    Same feed_lines/flush interface as perf_csv.PerfCsvParser.
+    """
+    def __init__(self, events_per_interval, cgname=None):
+        self.events_per_interval = events_per_interval
+        self.cgname = cgname
+        self._chunk = []
+
+    def feed_lines(self, lines):
+        done = []
+        chunk = self._chunk
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            chunk.append(line)
+            if len(chunk) == self.events_per_interval:
+                done.append(parse_perf_chunk(chunk, self.cgname))
+                chunk = self._chunk = []
+        return done
+
+    def flush(self):
+        if not self._chunk:
+            return None
+        chunk, self._chunk = self._chunk, []
+        return parse_perf_chunk(chunk, self.cgname)
+
+def parse_perf_chunk(chunk, cgname=None):
+    # One interval of one perf output: system-wide, or --for-each-cgroup cgname
     result = {}
-    print(line)
-    sysline = line[0]
-    result["timestamp"] = float(sysline[0].split()[0])
-    result["system"] = {}
-    for i in sysline:
-        measure = i.split()
-        if "<not counted>" in i:
-            result["system"][measure[-1]] = 0
-            continue
-        
-        if "Joules" in i:
-            result["system"][measure[3]] = float(measure[1].replace(",",""))
-            continue
-        result["system"][measure[2]] = float(measure[1].replace(",",""))
-    if cg:
-        cgline = line[1]
+    result["timestamp"] = float(chunk[0].split()[0])
+    if cgname is None:
+        result["system"] = {}
+        for i in chunk:
+            measure = i.split()
+            if "<not counted>" in i:
+                result["system"][measure[-1]] = 0
+                continue
+            
+            if "Joules" in i:
+                result["system"][measure[3]] = float(measure[1].replace(",",""))
+                continue
+            result["system"][measure[2]] = float(measure[1].replace(",",""))
+    else:
         result[cgname] = {}
-        for i in cgline:
+        for i in chunk:
             measure = i.split()
             if "<not counted>" in i and "Joules" in i:
                 result[cgname][measure[4]] = 0
@@ -208,27 +347,50 @@ def parse_perf_line(line, cg, cgname=None):
     
     return result
 
-def graph(cgname, plott=0):
-    with open("measurement.json") as f:
-        data = json.load(f)
-    time = []
-    syspow = []
-    sysinstr = []
-    groupinstr = []
-    for i in data:
-        time.append(i["timestamp"])
-        sysinstr.append(i["system"]["cpu_core/instructions/"])
-        syspow.append(i["system"]["power/energy-cores/"])
-        groupinstr.append(i[cgname]["cpu_core/instructions/"])
-    est_power = []
-    for p, si, gi in zip(syspow, sysinstr, groupinstr):
-        est_power.append(p * gi / si)
+def plot(output, cgnames=None, events=("power",), path=MEASUREMENT_FILE, points=2000, method="minmax"):
+    """
+    Headless plot: streams the file once, decimates every series to
+    `points` and renders with matplotlib's Agg backend, so the time taken
+    does not grow with the run's length beyond one read.
+    """
+    from plot import decimate_file, render
+    from samples import RESERVED_KEYS
+    if not cgnames:
+        # Every cgroup of the first record
+        first = next(read_records(path), {})
+        cgnames = [k for k, v in first.items() if isinstance(v, dict) and k not in RESERVED_KEYS]
+    series = [("system", event) for event in events]
+    series += [(cg, event) for cg in cgnames for event in events]
+    decimators = decimate_file(path, series, points)
+    render(decimators, output, title=path, points=points, method=method)
+    print(f"[*] Plot written to {output}")
+
+def graph(cgnames, plott=0, path=MEASUREMENT_FILE, model="instructions"):
+    # NumPy and matplotlib are only loaded when plotting
+    import matplotlib.pyplot as plt
+    from attribution import load_run, MODELS, CORES, INSTRUCTIONS, CPU_TIME
+    if isinstance(cgnames, str):
+        cgnames = [cgnames]
+    run = load_run(path, cgroups=cgnames)
+    time = run.times
+    # Counter the share is based on, CPU time for runs without a PMU
+    basis = getattr(MODELS[model], "event", None) or (INSTRUCTIONS if INSTRUCTIONS in run.system else CPU_TIME)
+    sysinstr = run.system[basis]
+    syspow = run.system[CORES]
+    # All cgroups and intervals in one pass
+    energy = MODELS[model]().fit(run, CORES).attribute(run, CORES)
+    groupinstr = {}
+    est_power = {}
+    for j, cg in enumerate(run.cgroups):
+        groupinstr[cg] = run.groups[basis][:, j]
+        est_power[cg] = energy[:, j]
     
     # Plot
     if plott == 0:
         plt.figure(figsize=(10,6))
         plt.plot(time, syspow, label="System Power", marker="o")
-        plt.plot(time, est_power, label="Scaled (sysinstr/groupinstr)", marker="x")
+        for cg in cgnames:
+            plt.plot(time, est_power[cg], label=f"{cg} estimated ({model})", marker="x")
 
         plt.xlabel("Time")
         plt.ylabel("Value")
@@ -246,26 +408,28 @@ def graph(cgname, plott=0):
 
     # Cgroup power on right y-axis
         ax2 = ax1.twinx()
-        ax2.plot(time, est_power, label="Cgroup Estimated Power", color="red")
+        for cg in cgnames:
+            ax2.plot(time, est_power[cg], label=f"{cg} estimated power")
         ax2.set_ylabel("Cgroup Power (Joules)", color="red")
 
         plt.xlabel("Time (s)")
         plt.title("System vs Cgroup Power")
         plt.show()
     plt.figure(figsize=(10,6))
-    plt.plot(time, sysinstr, label="System Instructions", marker="o")
-    plt.plot(time, groupinstr, label="group instructions", marker="x")
+    plt.plot(time, sysinstr, label=f"System {basis}", marker="o")
+    for cg in cgnames:
+        plt.plot(time, groupinstr[cg], label=f"{cg} {basis}", marker="x")
 
     plt.xlabel("Time")
     plt.ylabel("Value")
-    plt.title("System vs group instr")
+    plt.title(f"System vs group {basis}")
     plt.legend()
     plt.grid(True)
 
     plt.show()
 
 
-def main(): #LATER MAKE CGROUP A LIST
+def main():
     print("Parsing Arguments")
     args = parse_args()
     print(f"returned args : {args}")
@@ -275,7 +439,15 @@ def main(): #LATER MAKE CGROUP A LIST
     elif args.command == "run":
         print("RUN COMMAND")
         run_monitor(args)
-        graph(args.cgroup)
+        if args.plot:
+            plot(args.plot, args.cgroups)
+            return
+        model = args.model or ("cputime" if args.source == "cpustat" else "instructions")
+        graph(args.cgroups, model=model)
+    elif args.command == "plot":
+        plot(args.output, list(filter(None, args.cgroups.split(","))),
+             events=list(filter(None, args.events.split(","))), path=args.file,
+             points=args.points, method=args.method)
 
 if __name__ == "__main__":
     main()